@@ -1,14 +1,32 @@
+import time
+
+_T0 = time.perf_counter()
+
 import sys
+from PySide6.QtCore import QTimer
 from PySide6.QtWidgets import QApplication
+from app.services.startup import StartupTimer
 from app.ui.main_window import MainWindow
 
 
 def main() -> int:
+    # 启动耗时：import → QApplication → 主窗口构建 → 首次进入事件循环（窗口已显示）
+    timer = StartupTimer(_T0)
+    timer.mark("imports")
     app = QApplication(sys.argv)
+    timer.mark("qapp")
     win = MainWindow()
+    timer.mark("window_built")
     win.show()
+
+    def on_first_frame() -> None:
+        timer.mark("first_window")
+        timer.extra["font_families"] = win.wm_panel.font_family.count()
+        timer.write()
+
+    QTimer.singleShot(0, on_first_frame)
     return app.exec()
 
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
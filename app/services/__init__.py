@@ -18,19 +18,33 @@ def hex_to_qcolor(value: Any) -> QColor:
         return QColor(0, 0, 0)
 
 def normalize_settings_for_save(settings: Dict[str, Any]) -> Dict[str, Any]:
+    from .spec import WatermarkSpec
+    if isinstance(settings, WatermarkSpec):
+        # 规格本身已是规范的可序列化形式
+        return settings.to_dict()
     data = dict(settings)
     # 颜色转为十六进制字符串
     data["color"] = qcolor_to_hex(data.get("color"))
     # 处理阴影和描边颜色
     data["shadow_color"] = qcolor_to_hex(data.get("shadow_color"))
     data["stroke_color"] = qcolor_to_hex(data.get("stroke_color"))
+    # 附加图层逐层处理
+    if isinstance(data.get("layers"), (list, tuple)):
+        data["layers"] = [normalize_settings_for_save(layer) for layer in data["layers"]
+                          if isinstance(layer, (dict, WatermarkSpec))]
     return data
 
 def normalize_settings_for_load(settings: Dict[str, Any]) -> Dict[str, Any]:
+    from .spec import WatermarkSpec
+    if isinstance(settings, WatermarkSpec):
+        return settings.to_settings()
     data = dict(settings)
     data["color"] = hex_to_qcolor(data.get("color"))
     # 处理阴影和描边颜色
     data["shadow_color"] = hex_to_qcolor(data.get("shadow_color"))
     data["stroke_color"] = hex_to_qcolor(data.get("stroke_color"))
+    if isinstance(data.get("layers"), (list, tuple)):
+        data["layers"] = [normalize_settings_for_load(layer) for layer in data["layers"]
+                          if isinstance(layer, (dict, WatermarkSpec))]
     # 保持其余字段原样（text, font_size, opacity, margin, position, pos_x_pct/pos_y_pct）
     return data
\ No newline at end of file
@@ -0,0 +1,761 @@
+from __future__ import annotations
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from PySide6.QtCore import Qt, QPointF, QRect, QRectF
+from PySide6.QtGui import (
+    QBrush,
+    QColor,
+    QFont,
+    QFontDatabase,
+    QFontMetricsF,
+    QImage,
+    QPainter,
+    QPainterPath,
+    QPen,
+    QPixmap,
+    QTransform,
+)
+from PySide6.QtWidgets import QGraphicsItem, QGraphicsPixmapItem, QGraphicsScene, QGraphicsTextItem
+
+from .glyphs import shared_glyph_atlas
+from .shadow import shared_shadow_cache
+from .spec import WatermarkSpec
+from .tokens import expand, stack_templated, templated, token_context
+
+
+# 九宫格位置
+GRID_POSITIONS = (
+    "top_left", "top_right", "bottom_left", "bottom_right", "center",
+    "top_center", "bottom_center", "center_left", "center_right",
+)
+
+# 平铺模式默认参数
+DEFAULT_TILE_SPACING = 80
+DEFAULT_TILE_ANGLE = -30
+
+
+class StrokedTextItem(QGraphicsTextItem):
+    """带描边效果的文本项"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.stroke_width = 0
+        self.stroke_color = QColor(255, 255, 255)
+        # 文本路径缓存：(文本, 字体) 不变时重绘不再重新排版字形
+        self._path_key = None
+        self._path = QPainterPath()
+
+    def set_stroke(self, width, color):
+        """设置描边宽度和颜色"""
+        self.stroke_width = width
+        self.stroke_color = color
+        self.update()
+
+    def paint(self, painter, option, widget=None):
+        """重写绘制方法以添加描边效果"""
+        if self.stroke_width > 0:
+            # 保存原始设置
+            original_pen = painter.pen()
+            original_brush = painter.brush()
+
+            # 获取文本路径
+            path = self.textPath()
+
+            # 绘制描边 - 使用较粗的笔绘制路径轮廓
+            stroke_pen = QPen(self.stroke_color, self.stroke_width * 2)
+            stroke_pen.setJoinStyle(Qt.RoundJoin)
+            stroke_pen.setCapStyle(Qt.RoundCap)
+            painter.setPen(stroke_pen)
+            painter.setBrush(Qt.NoBrush)
+            painter.drawPath(path)
+
+            # 绘制文本填充
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(self.defaultTextColor())
+            painter.drawPath(path)
+
+            # 恢复原始设置
+            painter.setPen(original_pen)
+            painter.setBrush(original_brush)
+        else:
+            # 没有描边时使用默认绘制
+            super().paint(painter, option, widget)
+
+    def boundingRect(self):
+        """重写边界矩形以包含描边"""
+        rect = super().boundingRect()
+        if self.stroke_width > 0:
+            # 为描边预留额外空间
+            extra = self.stroke_width
+            rect = rect.adjusted(-extra, -extra, extra, extra)
+        return rect
+
+    def textPath(self):
+        """获取文本路径"""
+        font = self.font()
+        text = self.toPlainText()
+        key = (text, font.key())
+        if key == self._path_key:
+            return self._path
+        path = QPainterPath()
+        # 使用QFontMetricsF获取更准确的基线位置
+        metrics = QFontMetricsF(font)
+        baseline_y = metrics.ascent()
+        path.addText(0, baseline_y, font, text)
+        self._path_key = key
+        self._path = path
+        return path
+
+
+def watermark_font(wm: Dict[str, Any]) -> QFont:
+    font_family = wm.get("font_family", "")
+    if font_family:
+        font = QFont(font_family)
+    else:
+        font = QFontDatabase.systemFont(QFontDatabase.GeneralFont)
+    font.setPointSize(int(wm.get("font_size", 32)))
+    font.setBold(bool(wm.get("font_bold", False)))
+    font.setItalic(bool(wm.get("font_italic", False)))
+    return font
+
+
+def build_text_item(wm: Dict[str, Any]) -> QGraphicsTextItem:
+    """按设置创建文本项（描边、颜色、字体），不含阴影与透明度"""
+    color = wm.get("color", QColor(0, 0, 0))
+    if not isinstance(color, QColor):
+        color = QColor(0, 0, 0)
+    stroke_color = wm.get("stroke_color", QColor(255, 255, 255))
+    if not isinstance(stroke_color, QColor):
+        stroke_color = QColor(255, 255, 255)
+    if bool(wm.get("stroke_enabled", False)):
+        item = StrokedTextItem()
+        item.set_stroke(int(wm.get("stroke_width", 2)), stroke_color)
+    else:
+        item = QGraphicsTextItem()
+    item.setPlainText(wm.get("text", ""))
+    item.setDefaultTextColor(color)
+    item.setFont(watermark_font(wm))
+    return item
+
+
+def render_text_layer(wm: Dict[str, Any]) -> QImage | None:
+    """把文本水印（含描边、阴影、透明度）渲染为透明图层"""
+    text = wm.get("text", "")
+    if not text:
+        return None
+    opacity = float(wm.get("opacity", 0.6))
+    color = wm.get("color", QColor(0, 0, 0))
+    if not isinstance(color, QColor):
+        color = QColor(0, 0, 0)
+
+    shadow_enabled = bool(wm.get("shadow_enabled", False))
+    shadow_offset = int(wm.get("shadow_offset", 2))
+
+    text_scene = QGraphicsScene()
+    text_item = build_text_item(wm)
+    text_scene.addItem(text_item)
+    text_rect = text_scene.itemsBoundingRect()
+    text_scene.setSceneRect(text_rect)
+    if shadow_enabled:
+        # 阴影为缓存的预模糊图层，作为文本项的子项画在其后，不再逐次模糊
+        add_shadow_item(text_item, wm, shadow_offset)
+    text_img = QImage(int(text_rect.width()), int(text_rect.height()), QImage.Format_ARGB32)
+    text_img.fill(QColor(0, 0, 0, 0))
+    painter_layer = QPainter(text_img)
+    text_item.setPos(text_item.pos() - text_rect.topLeft())
+    text_scene.render(painter_layer)
+    # 透明度作用于“文字 + 阴影”整体，与原先对带效果的文本项设置不透明度一致
+    if opacity < 1.0:
+        painter_layer.setCompositionMode(QPainter.CompositionMode.CompositionMode_DestinationIn)
+        painter_layer.fillRect(text_img.rect(), QColor(0, 0, 0, int(round(max(0.0, opacity) * 255))))
+    painter_layer.end()
+    return text_img
+
+
+def add_shadow_item(text_item: QGraphicsTextItem, wm: Dict[str, Any], offset: int) -> QGraphicsPixmapItem | None:
+    """为文本项挂上缓存的阴影子项（位于文本之后，随文本移动、旋转与淡出）"""
+    result = shared_shadow_cache().get(wm, lambda: build_text_item(wm))
+    if result is None:
+        return None
+    shadow_img, origin = result
+    shadow_item = QGraphicsPixmapItem(QPixmap.fromImage(shadow_img), text_item)
+    shadow_item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemStacksBehindParent)
+    shadow_item.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+    shadow_item.setPos(origin + QPointF(offset, offset))
+    return shadow_item
+
+
+def render_image_layer(wm: Dict[str, Any]) -> QImage | None:
+    """把图片水印按缩放设置渲染为图层，透明度直接烘焙进图层"""
+    img_path = wm.get("image_path", "")
+    if not img_path:
+        return None
+    wm_img = QImage(img_path)
+    if wm_img.isNull():
+        return None
+    scale_mode = wm.get("img_scale_mode", "proportional")
+    if scale_mode == "proportional":
+        pct = int(wm.get("img_scale_pct", 100))
+        target_w = max(1, int(wm_img.width() * pct / 100.0))
+        target_h = max(1, int(wm_img.height() * pct / 100.0))
+        wm_scaled = wm_img.scaled(target_w, target_h, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+    else:
+        target_w = max(1, int(wm.get("img_width", wm_img.width())))
+        target_h = max(1, int(wm.get("img_height", wm_img.height())))
+        wm_scaled = wm_img.scaled(target_w, target_h, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+
+    layer = QImage(wm_scaled.size(), QImage.Format_ARGB32)
+    layer.fill(QColor(0, 0, 0, 0))
+    painter = QPainter(layer)
+    painter.setOpacity(float(wm.get("img_opacity", 0.6)))
+    painter.drawImage(0, 0, wm_scaled)
+    painter.end()
+    return layer
+
+
+def render_layer(wm: Dict[str, Any]) -> QImage | None:
+    if wm.get("wm_type", "text") == "image":
+        return render_image_layer(wm)
+    return render_text_layer(wm)
+
+
+class LayerStack:
+    """多图层水印：底层（顶层设置本身）与其上按顺序叠加的各层，均已渲染为图层
+
+    底层的摆放按每张图的设置计算（逐图自定义位置仍然生效），其余各层使用
+    各自的设置。合成时整组编译为一张叠加层（见 compile_stack），与单图层一样
+    每张图只混合一次。提供 isNull()/cacheKey()，可在导出流水线中替代单个图层。
+    """
+
+    __slots__ = ("base", "extras", "_key")
+
+    def __init__(self, base: QImage | None, extras: Sequence[Tuple[QImage, Dict[str, Any]]]) -> None:
+        self.base = base if base is not None and not base.isNull() else None
+        self.extras: List[Tuple[QImage, Dict[str, Any]]] = [
+            (img, wm) for img, wm in extras if img is not None and not img.isNull()
+        ]
+        self._key = (
+            self.base.cacheKey() if self.base is not None else 0,
+            tuple((img.cacheKey(), placement_key(wm)) for img, wm in self.extras),
+        )
+
+    def isNull(self) -> bool:
+        return self.base is None and not self.extras
+
+    def cacheKey(self) -> Tuple:
+        return self._key
+
+    def layers(self, wm: Dict[str, Any]) -> List[Tuple[QImage, Dict[str, Any]]]:
+        """按绘制顺序返回 [(图层, 摆放设置)]，底层使用 wm"""
+        head = [(self.base, wm)] if self.base is not None else []
+        return head + self.extras
+
+
+def render_stack(wm: Dict[str, Any]) -> "QImage | LayerStack | None":
+    """渲染水印：没有附加图层时与 render_layer 相同，否则返回 LayerStack"""
+    extras = wm.get("layers") or ()
+    base = render_layer(wm)
+    if not extras:
+        return base
+    layers = [WatermarkSpec.from_settings(layer) for layer in extras]
+    return LayerStack(base, [(render_layer(layer), layer) for layer in layers])
+
+
+def _bind_layer(layer: QImage | None, wm: Dict[str, Any], context: Dict[str, Any]) -> QImage | None:
+    if not templated(wm):
+        return layer
+    return shared_glyph_atlas().render(wm, expand(wm.get("text", ""), context))
+
+
+def bind_tokens(layer: "QImage | LayerStack | None", wm: Dict[str, Any],
+                context: Dict[str, Any]) -> "QImage | LayerStack | None":
+    """按一张图片的令牌取值重新渲染含令牌的文本层，其余图层原样复用
+
+    逐图不同的文字用字形图集拼出，不经过 QGraphicsScene，可在导出工作线程中调用。
+    """
+    if isinstance(layer, LayerStack):
+        return LayerStack(_bind_layer(layer.base, wm, context),
+                          [(_bind_layer(img, layer_wm, context), layer_wm) for img, layer_wm in layer.extras])
+    return _bind_layer(layer, wm, context)
+
+
+def make_tile(layer: QImage, spacing: int, stagger: bool) -> QImage:
+    """把单个水印图层渲染进可重复的平铺单元
+
+    交错模式下单元包含两行，第二行水平偏移半个单元，越界部分回绕到左侧，
+    保证纹理重复时图案连续。
+    """
+    spacing = max(0, int(spacing))
+    cell_w = layer.width() + spacing
+    cell_h = layer.height() + spacing
+    tile = QImage(cell_w, cell_h * 2 if stagger else cell_h, QImage.Format_ARGB32_Premultiplied)
+    tile.fill(Qt.GlobalColor.transparent)
+    painter = QPainter(tile)
+    x0 = spacing // 2
+    y0 = spacing // 2
+    painter.drawImage(x0, y0, layer)
+    if stagger:
+        x1 = x0 + cell_w // 2
+        painter.drawImage(x1, y0 + cell_h, layer)
+        painter.drawImage(x1 - cell_w, y0 + cell_h, layer)
+    painter.end()
+    return tile
+
+
+def tile_brush(layer: QImage, wm: Dict[str, Any], center: QPointF) -> QBrush:
+    """平铺画刷：图案以 center 为原点旋转，一次 fillRect 铺满整幅图"""
+    tile = make_tile(
+        layer,
+        int(wm.get("tile_spacing", DEFAULT_TILE_SPACING)),
+        bool(wm.get("tile_stagger", True)),
+    )
+    brush = QBrush(tile)
+    transform = QTransform()
+    transform.translate(center.x(), center.y())
+    transform.rotate(float(wm.get("tile_angle", DEFAULT_TILE_ANGLE)))
+    transform.translate(-tile.width() / 2, -tile.height() / 2)
+    brush.setTransform(transform)
+    return brush
+
+
+def grid_anchor(position: str, width: int, height: int, layer_w: int, layer_h: int, margin: int):
+    """九宫格位置：返回图层左上角坐标（与原导出逻辑一致）"""
+    content_rect = QRect(0, 0, width, height).adjusted(margin, margin, -margin, -margin)
+    if position == "top_left":
+        x = content_rect.left()
+        y = content_rect.top()
+    elif position == "top_right":
+        x = content_rect.right() - layer_w
+        y = content_rect.top()
+    elif position == "bottom_left":
+        x = content_rect.left()
+        y = content_rect.bottom() - layer_h
+    elif position == "bottom_right":
+        x = content_rect.right() - layer_w
+        y = content_rect.bottom() - layer_h
+    elif position == "top_center":
+        x = content_rect.center().x() - layer_w // 2
+        y = content_rect.top()
+    elif position == "bottom_center":
+        x = content_rect.center().x() - layer_w // 2
+        y = content_rect.bottom() - layer_h
+    elif position == "center_left":
+        x = content_rect.left()
+        y = content_rect.center().y() - layer_h // 2
+    elif position == "center_right":
+        x = content_rect.right() - layer_w
+        y = content_rect.center().y() - layer_h // 2
+    else:  # center
+        x = content_rect.center().x() - layer_w // 2
+        y = content_rect.center().y() - layer_h // 2
+    return x, y
+
+
+def custom_anchor(wm: Dict[str, Any], width: int, height: int, layer_w: int, layer_h: int):
+    """自定义位置：百分比优先，按图像边界夹紧（不使用 margin，与预览一致）"""
+    margin = int(wm.get("margin", 20))
+    if "pos_x_pct" in wm and "pos_y_pct" in wm:
+        cx = float(wm.get("pos_x_pct", 0.0)) * width
+        cy = float(wm.get("pos_y_pct", 0.0)) * height
+    else:
+        cx = float(wm.get("pos_x", margin))
+        cy = float(wm.get("pos_y", margin))
+    x = max(0, min(width - layer_w, cx))
+    y = max(0, min(height - layer_h, cy))
+    return x, y
+
+
+class RotatedLayerCache:
+    """预旋转图层缓存：每个 (图层, 角度) 只重采样一次
+
+    旋转结果为紧贴旋转后边界的预乘 ARGB32 图像；批量导出时每张图只做一次
+    整数坐标的 drawImage，与不旋转的水印开销相同。
+    """
+
+    def __init__(self, limit: int = 8) -> None:
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[int, float], QImage]" = OrderedDict()
+
+    def get(self, layer: QImage, angle: float) -> QImage:
+        key = (layer.cacheKey(), float(angle))
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                return hit
+        rotated = rotate_layer(layer, angle)
+        with self._lock:
+            self._entries[key] = rotated
+            while len(self._entries) > self.limit:
+                self._entries.popitem(last=False)
+        return rotated
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def rotate_layer(layer: QImage, angle: float) -> QImage:
+    """绕中心旋转图层，返回紧贴旋转后边界的预乘图像（中心与原图层中心重合）"""
+    src = layer.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    transform = QTransform()
+    transform.rotate(float(angle))
+    rotated = src.transformed(transform, Qt.TransformationMode.SmoothTransformation)
+    if rotated.format() != QImage.Format_ARGB32_Premultiplied:
+        rotated = rotated.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+    return rotated
+
+
+_rotated_layers = RotatedLayerCache()
+
+
+def place_layer(width: int, height: int, layer: QImage, wm: Dict[str, Any],
+                cache: bool = True) -> Tuple[QImage, int, int]:
+    """计算非平铺水印在 width×height 目标图上的绘制方式：(要绘制的图层, 左上角 x, y)
+
+    位置按未旋转的图层尺寸计算（与预览中水印项的 pos 一致），旋转后的图层
+    以同一中心绘制，不按旋转后的边界重新贴边；预览对文本和图片水印在所有
+    位置都应用旋转，这里保持一致。只用一次的图层 cache=False，不进入旋转缓存。
+    """
+    position = wm.get("position", "bottom_right")
+    rotation_angle = float(wm.get("rotation_angle", 0.0))
+    layer_w = layer.width()
+    layer_h = layer.height()
+    if position == "custom":
+        x, y = custom_anchor(wm, width, height, layer_w, layer_h)
+    else:
+        x, y = grid_anchor(position, width, height, layer_w, layer_h, int(wm.get("margin", 20)))
+    if rotation_angle % 360.0:
+        rotated = _rotated_layers.get(layer, rotation_angle) if cache else rotate_layer(layer, rotation_angle)
+        cx = x + layer_w / 2.0
+        cy = y + layer_h / 2.0
+        return rotated, int(round(cx - rotated.width() / 2.0)), int(round(cy - rotated.height() / 2.0))
+    return layer, int(x), int(y)
+
+
+# 影响水印摆放（而非图层像素）的设置项
+PLACEMENT_FIELDS = (
+    "position", "margin", "pos_x", "pos_y", "pos_x_pct", "pos_y_pct", "rotation_angle",
+    "tile_spacing", "tile_stagger", "tile_angle",
+)
+
+
+def placement_key(wm: Dict[str, Any]) -> Tuple:
+    return tuple(wm.get(k) for k in PLACEMENT_FIELDS)
+
+
+class OverlayPlan:
+    """某一尺寸目标图上的完整摆放方案：锚点、旋转与平铺画刷都已算好
+
+    apply() 对每张图只做一次绘制调用：非平铺为一次 drawImage；平铺首次用画刷
+    fillRect，同尺寸再次使用时由 OverlayPlanCache 预先铺成整幅叠加层（image），
+    之后每张图只是一次不带变换的 drawImage。图层组（LayerStack）同样编译为
+    一个方案，见 compile_stack。
+    """
+
+    __slots__ = ("image", "x", "y", "brush", "parts", "uses", "expected", "building")
+
+    def __init__(self, image: QImage | None = None, x: int = 0, y: int = 0, brush: QBrush | None = None,
+                 parts: "List[OverlayPlan] | None" = None) -> None:
+        self.image = image
+        self.x = x
+        self.y = y
+        self.brush = brush
+        # 图层组中需分别绘制的各部分：分散的图层，或尚未铺成整幅叠加层的平铺层
+        self.parts = parts
+        self.uses = 0
+        # 预计使用次数（批量导出中同尺寸同设置的图片数，见 OverlayPlanCache.prepare）
+        self.expected = 0
+        self.building = False
+
+    @property
+    def full_frame(self) -> bool:
+        """需要整幅叠加层才能一次绘制（平铺或含平铺层的图层组）"""
+        return self.brush is not None or any(p.full_frame for p in self.parts or ())
+
+    @property
+    def overlay_bytes(self) -> int:
+        return self.image.sizeInBytes() if self.full_frame and self.image is not None else 0
+
+    def apply(self, img: QImage) -> None:
+        painter = QPainter(img)
+        self.paint(painter, img.rect())
+        painter.end()
+
+    def paint(self, painter: QPainter, rect: QRect) -> None:
+        if self.image is not None:
+            painter.drawImage(self.x, self.y, self.image)
+        elif self.brush is not None:
+            painter.setRenderHint(QPainter.Antialiasing, True)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+            painter.fillRect(rect, self.brush)
+        elif self.parts:
+            for part in self.parts:
+                part.paint(painter, rect)
+
+    def paint_scaled(self, painter: QPainter, rect: QRect, sx: float, sy: float) -> None:
+        """按原图坐标的方案缩小绘制（rect 为原图范围，sx/sy 为缩放比例）
+
+        图层先用平滑缩放（区域平均）缩到目标大小再绘制，大倍率缩小时细笔画
+        不会因双线性采样而丢失；平铺画刷同理先超采样填充再缩小。
+        """
+        if self.image is not None:
+            target = QRectF(self.x * sx, self.y * sy, self.image.width() * sx, self.image.height() * sy)
+            small = self.image.scaled(max(1, math.ceil(target.width())), max(1, math.ceil(target.height())),
+                                      Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+            painter.drawImage(target, small)
+        elif self.brush is not None:
+            # 画刷纹理直接缩小填充会走样：先在至多 4 倍的目标分辨率上填充，再平滑缩小
+            k = max(1.0, min(4.0, 1.0 / max(sx, sy, 1e-6)))
+            w = max(1, math.ceil(rect.width() * sx))
+            h = max(1, math.ceil(rect.height() * sy))
+            big = QImage(math.ceil(w * k), math.ceil(h * k), QImage.Format_ARGB32_Premultiplied)
+            big.fill(Qt.GlobalColor.transparent)
+            inner = QPainter(big)
+            inner.scale(sx * k, sy * k)
+            inner.translate(-rect.x(), -rect.y())
+            self.paint(inner, rect)
+            inner.end()
+            small = big.scaled(w, h, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            painter.drawImage(QPointF(rect.x() * sx, rect.y() * sy), small)
+        elif self.parts:
+            for part in self.parts:
+                part.paint_scaled(painter, rect, sx, sy)
+
+
+def plan_overlay(width: int, height: int, layer: "QImage | LayerStack", wm: Dict[str, Any],
+                 cache: bool = True) -> OverlayPlan:
+    if isinstance(layer, LayerStack):
+        return compile_stack(width, height, layer, wm, cache)
+    if wm.get("position", "bottom_right") == "tile":
+        return OverlayPlan(brush=tile_brush(layer, wm, QRectF(0, 0, width, height).center()))
+    drawn, x, y = place_layer(width, height, layer, wm, cache)
+    return OverlayPlan(drawn, x, y)
+
+
+def _cluster_parts(parts: List[OverlayPlan], frame: QRect) -> List[Tuple[QRect, List[int]]]:
+    """把非平铺的摆放方案按所占矩形分组，返回 [(组矩形, 按绘制顺序的成员下标)]
+
+    相交的必须同组（保持上下关系）；不相交但合并后混合面积不增加的也并为一组。
+    分组结束后各组矩形两两不相交，组间绘制顺序无关。
+    """
+    def area(rect: QRect) -> int:
+        return 0 if rect.isEmpty() else rect.width() * rect.height()
+
+    clusters = [(QRect(p.x, p.y, p.image.width(), p.image.height()).intersected(frame), [i])
+                for i, p in enumerate(parts)]
+    merged = True
+    while merged:
+        merged = False
+        for a in range(len(clusters)):
+            for b in range(a + 1, len(clusters)):
+                (ra, ia), (rb, ib) = clusters[a], clusters[b]
+                union = ra.united(rb)
+                if ra.intersects(rb) or area(union) <= area(ra) + area(rb):
+                    clusters[a] = (union, sorted(ia + ib))
+                    del clusters[b]
+                    merged = True
+                    break
+            if merged:
+                break
+    return clusters
+
+
+def compile_stack(width: int, height: int, stack: LayerStack, wm: Dict[str, Any],
+                  cache: bool = True) -> OverlayPlan:
+    """把图层组编译为一个摆放方案
+
+    各层都不平铺时，相互重叠（或相距很近）的图层合成到覆盖它们的最小矩形上，
+    叠在一起的多层只需一次 drawImage；分散在图片各处的图层各自绘制，避免
+    为覆盖它们而混合中间的大片透明区域。含平铺层时方案先逐层绘制，同尺寸
+    再次使用时由 OverlayPlanCache 铺成整幅叠加层。逐层的 SourceOver 混合
+    满足结合律，先合成叠加层再混合与依次绘制各层的结果一致（仅有取整误差）。
+    """
+    parts = [plan_overlay(width, height, layer, layer_wm, cache) for layer, layer_wm in stack.layers(wm)]
+    if len(parts) == 1:
+        return parts[0]
+    if any(p.brush is not None for p in parts):
+        return OverlayPlan(parts=parts)
+    plans = []
+    for bounds, members in _cluster_parts(parts, QRect(0, 0, width, height)):
+        if bounds.isEmpty():
+            continue
+        if len(members) == 1:
+            plans.append(parts[members[0]])
+            continue
+        overlay = QImage(bounds.size(), QImage.Format_ARGB32_Premultiplied)
+        overlay.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(overlay)
+        painter.translate(-bounds.x(), -bounds.y())
+        for i in members:
+            parts[i].paint(painter, bounds)
+        painter.end()
+        plans.append(OverlayPlan(overlay, bounds.x(), bounds.y()))
+    if len(plans) == 1:
+        return plans[0]
+    return OverlayPlan(parts=plans) if plans else OverlayPlan()
+
+
+def render_full_overlay(width: int, height: int, plan: OverlayPlan) -> QImage:
+    """把需要整幅绘制的方案（平铺画刷或图层组）铺成一张整幅叠加层"""
+    overlay = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    overlay.fill(Qt.GlobalColor.transparent)
+    plan.apply(overlay)
+    return overlay
+
+
+# 平铺叠加层缓存的总字节上限；单张超过上限的尺寸始终用画刷绘制
+OVERLAY_BUDGET_BYTES = 256 * 1024 * 1024
+
+
+def _weight(plan: OverlayPlan) -> int:
+    """方案的保留优先级：预计使用次数与实际使用次数中的较大者"""
+    return max(plan.expected, plan.uses)
+
+
+class OverlayPlanCache:
+    """按 (图层, 目标尺寸, 摆放设置) 缓存摆放方案
+
+    同一批拍摄的图片大多尺寸相同，整批只需计算一次锚点、旋转与平铺单元；
+    每张图剩下的开销只有解码、一次混合与编码。
+    """
+
+    def __init__(self, limit: int = 32, overlay_budget: int = OVERLAY_BUDGET_BYTES) -> None:
+        self.limit = limit
+        self.overlay_budget = overlay_budget
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, OverlayPlan]" = OrderedDict()
+
+    def get(self, width: int, height: int, layer: "QImage | LayerStack", wm: Dict[str, Any]) -> OverlayPlan:
+        key = (layer.cacheKey(), width, height, placement_key(wm))
+        with self._lock:
+            plan = self._entries.get(key)
+            if plan is not None:
+                self._entries.move_to_end(key)
+                plan.uses += 1
+                build = (plan.uses >= 2 and plan.full_frame and plan.image is None and not plan.building
+                         and self._has_room(width * height * 4, _weight(plan)))
+                if build:
+                    plan.building = True
+        if plan is None:
+            plan = plan_overlay(width, height, layer, wm)
+            plan.uses = 1
+            with self._lock:
+                self._entries[key] = plan
+                self._evict()
+            return plan
+        if build:
+            # 同尺寸第二次使用：整幅铺好一次，之后只需不带变换的 drawImage
+            overlay = render_full_overlay(width, height, plan)
+            with self._lock:
+                plan.image = overlay
+                plan.building = False
+                self._evict(keep=key)
+        return plan
+
+    def _has_room(self, size: int, weight: int) -> bool:
+        """叠加层预算能否容纳 size 字节：空闲不足时只允许挤掉权重更低的叠加层"""
+        if size > self.overlay_budget:
+            return False
+        total = sum(p.overlay_bytes for p in self._entries.values())
+        lighter = sorted(p.overlay_bytes for p in self._entries.values() if p.overlay_bytes and _weight(p) < weight)
+        while total + size > self.overlay_budget and lighter:
+            total -= lighter.pop()
+        return total + size <= self.overlay_budget
+
+    def _drop_lightest(self, keep: Tuple | None, overlays_only: bool) -> bool:
+        """移除权重最低（同权重取最久未用）的条目；没有可移除的返回 False
+
+        其他线程可能正在用这份方案绘制，不能清空其字段：只从表中移除，
+        由引用计数在最后一个使用者用完后释放叠加层。
+        """
+        victim = None
+        for order, (k, p) in enumerate(self._entries.items()):
+            if k == keep or (overlays_only and not p.overlay_bytes):
+                continue
+            rank = (_weight(p), order)
+            if victim is None or rank < victim[0]:
+                victim = (rank, k)
+        if victim is None:
+            return False
+        del self._entries[victim[1]]
+        return True
+
+    def _evict(self, keep: Tuple | None = None) -> None:
+        while len(self._entries) > self.limit and self._drop_lightest(keep, False):
+            pass
+        while (sum(p.overlay_bytes for p in self._entries.values()) > self.overlay_budget
+               and self._drop_lightest(keep, True)):
+            pass
+
+    def prepare(self, layer: "QImage | LayerStack", targets) -> int:
+        """按 (宽, 高, 设置) 分组，为最常见的若干组预先生成方案，返回生成的组数
+
+        targets 为 (宽, 高, 设置) 序列；尺寸未知（0）的跳过，由合成时按需生成。
+        叠加层预算按组内图片数从多到少分配：预算用完后，较小的组只生成方案、
+        用画刷绘制，不会挤掉大组的叠加层。
+        """
+        groups: Dict[Tuple, list] = {}
+        for width, height, wm in targets:
+            if width > 0 and height > 0:
+                entry = groups.setdefault((width, height, placement_key(wm)), [0, wm])
+                entry[0] += 1
+        ranked = sorted(groups.items(), key=lambda kv: kv[1][0], reverse=True)[:self.limit]
+        for (width, height, _), (count, wm) in ranked:
+            plan = self.get(width, height, layer, wm)
+            with self._lock:
+                plan.expected = max(plan.expected, count)
+            if count > 1:
+                # 多张同尺寸：平铺叠加层也在此一并铺好
+                plan = self.get(width, height, layer, wm)
+            plan.uses = 0
+        return len(ranked)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_overlay_plans = OverlayPlanCache()
+
+
+def shared_overlay_plans() -> OverlayPlanCache:
+    return _overlay_plans
+
+
+def compose_layer_onto(img: QImage, layer: "QImage | LayerStack", wm: Dict[str, Any], cache: bool = True) -> None:
+    """把已渲染的水印图层按位置设置绘制到目标图上（摆放方案按尺寸复用）
+
+    只用一次的图层（逐图的令牌文本、单张合成时现渲染的图层）传 cache=False，
+    不进入方案缓存与旋转缓存，以免挤掉批量导出共用的条目。
+    """
+    if cache:
+        _overlay_plans.get(img.width(), img.height(), layer, wm).apply(img)
+    else:
+        plan_overlay(img.width(), img.height(), layer, wm, cache=False).apply(img)
+
+
+def compose_image_file(path: str, wm: Dict[str, Any], context: Dict[str, Any] | None = None) -> QImage | None:
+    """离屏合成：从文件读取为 QImage 并绘制水印，读取失败返回 None
+
+    context 为令牌取值（见 tokens.token_context），省略时按该文件单独计算。
+    """
+    if not path:
+        return None
+    img = QImage(path)
+    if img.isNull():
+        return None
+    img = img.convertToFormat(QImage.Format_ARGB32)
+    # 每次调用都现渲染图层，cacheKey 各不相同，不进入共享缓存
+    layer = render_stack(wm)
+    if stack_templated(wm):
+        layer = bind_tokens(layer, wm, context or token_context(path, 1, img.width(), img.height()))
+    if layer is None or layer.isNull():
+        return img
+    compose_layer_onto(img, layer, wm, cache=False)
+    return img
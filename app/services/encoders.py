@@ -0,0 +1,151 @@
+from __future__ import annotations
+import io
+import sys
+from pathlib import Path
+from typing import Any, Dict
+
+from PIL import Image
+from PySide6.QtGui import QImage
+
+from .fileio import write_bytes_atomic
+
+
+# 输出格式与扩展名
+FORMAT_EXTENSIONS: Dict[str, str] = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+# zlib 压缩策略（Pillow 的 compress_type 参数直接传给 zlib）
+_ZLIB_DEFAULT_STRATEGY = 0
+_ZLIB_FILTERED = 1
+_ZLIB_RLE = 3
+
+# PNG 压缩策略：fast 用 RLE 牺牲体积换速度，small 用过滤策略并开启 optimize
+PNG_STRATEGIES = ("default", "fast", "small")
+JPEG_SUBSAMPLINGS = ("4:4:4", "4:2:2", "4:2:0")
+
+# 编码预设：在 CPU 时间与写入字节之间取舍，未列出的字段保持面板当前值
+ENCODER_PRESETS: Dict[str, Dict[str, Any]] = {
+    "fast": {
+        "png_compress_level": 1,
+        "png_strategy": "fast",
+        "jpeg_progressive": False,
+        "jpeg_optimize": False,
+        "jpeg_subsampling": "4:2:0",
+        "webp_method": 0,
+    },
+    "balanced": {
+        "png_compress_level": 6,
+        "png_strategy": "default",
+        "jpeg_progressive": False,
+        "jpeg_optimize": True,
+        "jpeg_subsampling": "4:2:0",
+        "webp_method": 4,
+    },
+    "small": {
+        "png_compress_level": 9,
+        "png_strategy": "small",
+        "jpeg_progressive": True,
+        "jpeg_optimize": True,
+        "jpeg_subsampling": "4:2:0",
+        "webp_method": 6,
+    },
+}
+
+DEFAULT_ENCODER_SETTINGS: Dict[str, Any] = {
+    "jpeg_quality": 90,
+    "png_compress_level": 6,
+    "png_strategy": "default",
+    "jpeg_progressive": False,
+    "jpeg_optimize": False,
+    "jpeg_subsampling": "4:2:0",
+    "webp_lossless": False,
+    "webp_quality": 85,
+    "webp_method": 4,
+}
+
+
+def extension_for(fmt: str) -> str:
+    return FORMAT_EXTENSIONS.get(str(fmt).upper(), ".png")
+
+
+def format_for_suffix(suffix: str) -> str | None:
+    suffix = suffix.lower()
+    if suffix in {".jpg", ".jpeg"}:
+        return "JPEG"
+    if suffix == ".png":
+        return "PNG"
+    if suffix == ".webp":
+        return "WEBP"
+    return None
+
+
+def pil_save_options(fmt: str, settings: Dict[str, Any] | None) -> Dict[str, Any]:
+    """将导出设置转换为 Pillow save() 的编码参数"""
+    opts = dict(DEFAULT_ENCODER_SETTINGS)
+    opts.update(settings or {})
+    fmt = str(fmt).upper()
+    if fmt == "JPEG":
+        subsampling = opts.get("jpeg_subsampling", "4:2:0")
+        if subsampling not in JPEG_SUBSAMPLINGS:
+            subsampling = "4:2:0"
+        return {
+            "quality": max(0, min(100, int(opts.get("jpeg_quality", 90)))),
+            "progressive": bool(opts.get("jpeg_progressive", False)),
+            "optimize": bool(opts.get("jpeg_optimize", False)),
+            "subsampling": subsampling,
+        }
+    if fmt == "WEBP":
+        lossless = bool(opts.get("webp_lossless", False))
+        return {
+            "lossless": lossless,
+            # 无损模式下 quality 表示压缩力度，有损模式下表示画质
+            "quality": max(0, min(100, int(opts.get("webp_quality", 85)))),
+            "method": max(0, min(6, int(opts.get("webp_method", 4)))),
+        }
+    # PNG
+    strategy = opts.get("png_strategy", "default")
+    result = {"compress_level": max(0, min(9, int(opts.get("png_compress_level", 6))))}
+    if strategy == "fast":
+        result["compress_type"] = _ZLIB_RLE
+    elif strategy == "small":
+        result["compress_type"] = _ZLIB_FILTERED
+        result["optimize"] = True
+    else:
+        result["compress_type"] = _ZLIB_DEFAULT_STRATEGY
+    return result
+
+
+def _qimage_to_pil(img: QImage, keep_alpha: bool) -> Image.Image:
+    # ARGB32 在内存中按字节序排列：小端为 BGRA，大端为 ARGB
+    if img.format() != QImage.Format_ARGB32:
+        img = img.convertToFormat(QImage.Format_ARGB32)
+    raw_mode = "BGRA" if sys.byteorder == "little" else "ARGB"
+    # 原始模式与 RGBA 不同，Pillow 会解包为自有内存，不依赖 QImage 的生命周期
+    pil = Image.frombuffer(
+        "RGBA", (img.width(), img.height()), img.constBits(), "raw", raw_mode, img.bytesPerLine(), 1
+    )
+    if not keep_alpha:
+        pil = pil.convert("RGB")
+    return pil
+
+
+def encode_qimage(img: QImage, fmt: str, settings: Dict[str, Any] | None = None) -> bytes | None:
+    """按导出设置把 QImage 编码为字节，失败返回 None"""
+    if img is None or img.isNull():
+        return None
+    fmt = str(fmt).upper()
+    if fmt not in FORMAT_EXTENSIONS:
+        return None
+    try:
+        pil = _qimage_to_pil(img, keep_alpha=(fmt != "JPEG"))
+        buf = io.BytesIO()
+        pil.save(buf, fmt, **pil_save_options(fmt, settings))
+        return buf.getvalue()
+    except Exception:
+        return None
+
+
+def save_qimage(img: QImage, path: str | Path, fmt: str, settings: Dict[str, Any] | None = None) -> bool:
+    data = encode_qimage(img, fmt, settings)
+    if data is None:
+        return False
+    return write_bytes_atomic(path, data)
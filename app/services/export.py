@@ -0,0 +1,151 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage
+
+from .encoders import DEFAULT_ENCODER_SETTINGS, extension_for
+
+
+RESIZE_MODES = ("none", "width", "height", "percent")
+NAMING_MODES = ("keep", "prefix", "suffix")
+
+# 规格中与编码相关的字段，从导出面板当前设置中拷贝
+_ENCODER_KEYS = tuple(DEFAULT_ENCODER_SETTINGS.keys()) + ("encoder_preset",)
+
+
+def target_size(width: int, height: int, resize_mode: str, resize_value: int) -> Tuple[int, int]:
+    """按尺寸调整规则计算输出尺寸（保持宽高比）"""
+    if width <= 0 or height <= 0:
+        return width, height
+    value = max(1, int(resize_value))
+    if resize_mode == "width":
+        return value, max(1, int(height * (value / width)))
+    if resize_mode == "height":
+        return max(1, int(width * (value / height))), value
+    if resize_mode == "percent":
+        factor = value / 100.0
+        return max(1, int(width * factor)), max(1, int(height * factor))
+    return width, height
+
+
+def resize_qimage(img: QImage, resize_mode: str, resize_value: int) -> QImage:
+    if resize_mode not in RESIZE_MODES or resize_mode == "none":
+        return img
+    new_w, new_h = target_size(img.width(), img.height(), resize_mode, resize_value)
+    if (new_w, new_h) == (img.width(), img.height()):
+        return img
+    return img.scaled(new_w, new_h, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+
+
+def build_output_name(stem: str, ext: str, naming_mode: str, naming_value: str) -> str:
+    if naming_mode == "prefix":
+        return f"{naming_value}{stem}{ext}"
+    if naming_mode == "suffix":
+        return f"{stem}{naming_value}{ext}"
+    return f"{stem}{ext}"
+
+
+def _safe_subdir(subdir: str) -> str:
+    # 子文件夹仅允许相对路径，逐段去除非法字符并丢弃 . / ..
+    parts = []
+    for part in str(subdir or "").replace("\\", "/").split("/"):
+        part = "".join(c for c in part.strip() if c not in ":*?\"<>|")
+        if part and part not in {".", ".."}:
+            parts.append(part)
+    return "/".join(parts)
+
+
+def normalize_rendition(data: Dict[str, Any]) -> Dict[str, Any]:
+    """补齐规格字段的默认值，防止旧配置或手工编辑缺项"""
+    rend: Dict[str, Any] = dict(DEFAULT_ENCODER_SETTINGS)
+    rend.update({
+        "name": "",
+        "format": "PNG",
+        "resize_mode": "none",
+        "resize_value": 100,
+        "naming_mode": "keep",
+        "naming_value": "",
+        "subdir": "",
+    })
+    rend.update({k: v for k, v in (data or {}).items() if v is not None})
+    rend["format"] = str(rend.get("format", "PNG")).upper()
+    if rend["resize_mode"] not in RESIZE_MODES:
+        rend["resize_mode"] = "none"
+    if rend["naming_mode"] not in NAMING_MODES:
+        rend["naming_mode"] = "keep"
+    rend["subdir"] = _safe_subdir(rend.get("subdir", ""))
+    if not rend["name"]:
+        rend["name"] = rend["subdir"] or rend["format"]
+    return rend
+
+
+def rendition_from_settings(export_settings: Dict[str, Any], **overrides: Any) -> Dict[str, Any]:
+    """从导出面板的当前设置生成一个规格（格式、编码、尺寸），可覆盖命名与子文件夹"""
+    data = {k: export_settings[k] for k in _ENCODER_KEYS if k in export_settings}
+    data["format"] = export_settings.get("format", "PNG")
+    data["resize_mode"] = export_settings.get("resize_mode", "none")
+    data["resize_value"] = export_settings.get("resize_value", 100)
+    data.update(overrides)
+    return normalize_rendition(data)
+
+
+def describe_rendition(rend: Dict[str, Any]) -> str:
+    mode = rend.get("resize_mode", "none")
+    value = rend.get("resize_value", 100)
+    size = {
+        "none": "原尺寸",
+        "width": f"宽 {value}px",
+        "height": f"高 {value}px",
+        "percent": f"{value}%",
+    }.get(mode, "原尺寸")
+    folder = rend.get("subdir") or "."
+    return f"{rend.get('name', '')}：{rend.get('format', 'PNG')} · {size} → {folder}"
+
+
+def render_renditions(composed: QImage, renditions: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], QImage]]:
+    """把一张合成图扇出为多个规格
+
+    按目标尺寸从大到小处理，小规格从已生成的、最小但不小于目标的中间图缩放，
+    避免每个规格都从全尺寸原图缩放。返回顺序与传入的 renditions 一致。
+    """
+    w, h = composed.width(), composed.height()
+    planned = []
+    for idx, rend in enumerate(renditions):
+        tw, th = target_size(w, h, rend.get("resize_mode", "none"), rend.get("resize_value", 100))
+        planned.append((tw * th, idx, tw, th, rend))
+    planned.sort(key=lambda t: (-t[0], t[1]))
+
+    # 已生成的中间图（包含全尺寸合成图本身）
+    intermediates: List[QImage] = [composed]
+    results: Dict[int, Tuple[Dict[str, Any], QImage]] = {}
+    for _, idx, tw, th, rend in planned:
+        source = composed
+        for cand in intermediates:
+            if cand.width() >= tw and cand.height() >= th and cand.width() * cand.height() <= source.width() * source.height():
+                source = cand
+        if (source.width(), source.height()) == (tw, th):
+            out = source
+        else:
+            out = source.scaled(tw, th, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+            intermediates.append(out)
+        results[idx] = (rend, out)
+    return [results[i] for i in range(len(renditions))]
+
+
+def same_output(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """两个规格是否会把同一源图写到同一个文件（扩展名、命名与子文件夹都相同，忽略大小写）"""
+    return (str(output_path_for("", "_", a)).lower() == str(output_path_for("", "_", b)).lower())
+
+
+def output_path_for(out_dir: str | Path, src_path: str | Path, rend: Dict[str, Any]) -> Path:
+    src = Path(src_path)
+    name = build_output_name(src.stem, extension_for(rend.get("format", "PNG")),
+                             rend.get("naming_mode", "keep"), rend.get("naming_value", ""))
+    folder = Path(out_dir)
+    subdir = rend.get("subdir", "")
+    if subdir:
+        folder = folder / subdir
+    return folder / name
+
@@ -0,0 +1,58 @@
+from __future__ import annotations
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+
+PARTIAL_SUFFIX = ".part"
+
+
+def partial_path_for(path: str | Path) -> Path:
+    """同目录下的临时文件名（隐藏文件 + .part），保证 rename 在同一文件系统内原子完成"""
+    path = Path(path)
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}{PARTIAL_SUFFIX}")
+
+
+def write_bytes_atomic(path: str | Path, data: bytes, fsync: bool = True) -> bool:
+    """先写临时文件再原子替换目标文件；中途崩溃只会留下 .part 临时文件，不会产生截断的输出"""
+    path = Path(path)
+    tmp = partial_path_for(path)
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return True
+    except OSError:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return False
+
+
+def link_or_copy(src: str | Path, dst: str | Path) -> bool:
+    """把已写出的文件再放到另一个位置：同一文件系统内优先硬链接，否则复制
+
+    同样先落到临时文件再原子替换，目标已存在时直接覆盖。
+    """
+    src, dst = Path(src), Path(dst)
+    if src == dst:
+        return src.exists()
+    tmp = partial_path_for(dst)
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+        return True
+    except OSError:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,305 @@
+from __future__ import annotations
+import hashlib
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Tuple
+
+from .image_cache import file_stamp
+
+
+# 抽样块大小：文件头、中部、尾部各取一块
+SAMPLE_BLOCK = 64 * 1024
+# 完整哈希时的读块大小
+_READ_CHUNK = 1024 * 1024
+
+
+def _blake(data: bytes = b"") -> "hashlib.blake2b":
+    return hashlib.blake2b(data, digest_size=16)
+
+
+def quick_fingerprint(path: str) -> Tuple[str, bool] | None:
+    """文件大小 + 头/中/尾抽样块的哈希，返回 (指纹, 是否已覆盖整个文件)
+
+    只读三块，几乎不受文件大小影响；小文件（不超过三块）直接哈希全文，
+    结果即为精确指纹。读取失败返回 None。
+    """
+    stamp = file_stamp(path)
+    if stamp is None:
+        return None
+    size = stamp[1]
+    h = _blake(size.to_bytes(8, "little"))
+    try:
+        with open(path, "rb") as f:
+            if size <= SAMPLE_BLOCK * 3:
+                h.update(f.read())
+                return f"{size}:{h.hexdigest()}", True
+            for offset in (0, (size - SAMPLE_BLOCK) // 2, size - SAMPLE_BLOCK):
+                f.seek(offset)
+                h.update(f.read(SAMPLE_BLOCK))
+    except OSError:
+        return None
+    return f"{size}:{h.hexdigest()}", False
+
+
+def full_fingerprint(path: str) -> str | None:
+    """整个文件内容的哈希；读取失败返回 None"""
+    h = _blake()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(_READ_CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+class FingerprintIndex:
+    """导入图片的内容指纹索引，用于识别换名或来自不同读卡器的重复照片
+
+    先算抽样指纹（大小 + 抽样块哈希）；只有抽样指纹相同时才对相关文件做完整
+    哈希确认，绝大多数图片只需读取 192KB。submit() 交给后台线程计算，发现重复后
+    记录 (重复路径, 最先导入的同内容路径)，由界面线程通过 drain() 取走。
+    各路径的结果按 mtime 与大小缓存，文件被修改后自动重算。
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._queue: Deque[str] = deque()
+        self._busy = False
+        self._closed = False
+        # 路径 → 导入顺序；重复项总是指向顺序最早的同内容路径
+        self._order: Dict[str, int] = {}
+        self._next_order = 0
+        self._quick: Dict[str, Tuple[Any, str, bool]] = {}
+        self._full: Dict[str, Tuple[Any, str]] = {}
+        self._by_quick: Dict[str, List[str]] = {}
+        self._events: List[Tuple[str, str]] = []
+        self._thread = threading.Thread(target=self._run, name="fingerprint", daemon=True)
+        self._thread.start()
+
+    def submit(self, paths: Iterable[str]) -> None:
+        """交给后台线程计算；已由 seed() 提供指纹的路径跳过"""
+        with self._cond:
+            for p in paths:
+                if p not in self._order:
+                    self._order[p] = self._next_order
+                    self._next_order += 1
+                elif p in self._quick:
+                    continue
+                self._queue.append(p)
+            self._cond.notify_all()
+
+    def seed(self, entries: Dict[str, Tuple[Tuple[int, int], str]]) -> None:
+        """用已保存的抽样指纹 {路径: ((mtime_ns, 大小), 指纹)} 预填索引，不读取文件
+
+        只有抽样指纹与其他路径相同的路径才交给后台线程确认是否重复；其余路径
+        之后 submit() 时跳过。文件已被修改时，下次取指纹会按 mtime 与大小自动重算。
+        """
+        with self._cond:
+            touched = []
+            for p, (stamp, key) in entries.items():
+                if p not in self._order:
+                    self._order[p] = self._next_order
+                    self._next_order += 1
+                self._quick[p] = (stamp, key, stamp[1] <= SAMPLE_BLOCK * 3)
+                peers = self._by_quick.setdefault(key, [])
+                if p not in peers:
+                    peers.append(p)
+                touched.append(key)
+            for key in dict.fromkeys(touched):
+                peers = self._by_quick[key]
+                if len(peers) > 1:
+                    self._queue.extend(peers)
+            self._cond.notify_all()
+
+    def quick_keys(self, paths: Iterable[str]) -> Dict[str, Tuple[Tuple[int, int], str]]:
+        """已算好的抽样指纹 {路径: ((mtime_ns, 大小), 指纹)}，供保存后 seed() 使用；不访问文件"""
+        with self._cond:
+            return {p: (entry[0], entry[1]) for p in paths if (entry := self._quick.get(p)) is not None}
+
+    def forget(self, paths: Iterable[str]) -> None:
+        """移出列表的路径不再参与比较"""
+        with self._cond:
+            for p in paths:
+                self._order.pop(p, None)
+                entry = self._quick.pop(p, None)
+                self._full.pop(p, None)
+                if entry is not None:
+                    peers = self._by_quick.get(entry[1], [])
+                    if p in peers:
+                        peers.remove(p)
+                if p in self._queue:
+                    self._queue = deque(q for q in self._queue if q != p)
+
+    def clear(self) -> None:
+        with self._cond:
+            self._queue.clear()
+            self._order.clear()
+            self._quick.clear()
+            self._full.clear()
+            self._by_quick.clear()
+            self._events = []
+
+    def pending(self) -> bool:
+        with self._cond:
+            return bool(self._queue) or self._busy
+
+    def drain(self) -> List[Tuple[str, str]]:
+        """取走后台发现的重复项 [(重复路径, 原路径)]"""
+        with self._cond:
+            events, self._events = self._events, []
+        return events
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def duplicate_of(self, path: str) -> str | None:
+        """同内容中导入最早的路径；path 本身最早或无重复时返回 None（同步计算）"""
+        key = self._content_key(path)
+        if key is None:
+            return None
+        with self._cond:
+            quick = self._quick.get(path)
+            peers = list(self._by_quick.get(quick[1], [])) if quick else []
+            order = self._order.get(path)
+        if order is None:
+            return None
+        for peer in sorted(peers, key=lambda p: self._order.get(p, 1 << 62)):
+            if peer == path or self._order.get(peer, 1 << 62) >= order:
+                continue
+            if self._content_key(peer) == key:
+                return peer
+        return None
+
+    def known_content_keys(self, paths: Iterable[str]) -> Dict[str, str | None]:
+        """批量取已算好的内容键：键相同即内容相同
+
+        只查后台线程已缓存的结果（每个路径仅做一次 stat 核对 mtime 与大小），
+        不读取文件内容，可在界面线程调用；尚未算完、需要完整哈希但还没有、
+        或文件已被修改的路径为 None。
+        """
+        out: Dict[str, str | None] = {}
+        for p in paths:
+            stamp = file_stamp(p)
+            key = None
+            with self._cond:
+                quick = self._quick.get(p)
+                if stamp is not None and quick is not None and quick[0] == stamp:
+                    if quick[2] or len(self._by_quick.get(quick[1], [])) <= 1:
+                        key = quick[1]
+                    else:
+                        full = self._full.get(p)
+                        if full is not None and full[0] == stamp:
+                            key = f"full:{full[1]}"
+            out[p] = key
+        return out
+
+    # 内部实现
+
+    def _quick_entry(self, path: str) -> Tuple[str, bool] | None:
+        stamp = file_stamp(path)
+        if stamp is None:
+            return None
+        with self._cond:
+            cached = self._quick.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1], cached[2]
+        result = quick_fingerprint(path)
+        if result is None:
+            return None
+        key, exact = result
+        with self._cond:
+            old = self._quick.get(path)
+            if old is not None and old[1] != key:
+                peers = self._by_quick.get(old[1], [])
+                if path in peers:
+                    peers.remove(path)
+            self._quick[path] = (stamp, key, exact)
+            self._full.pop(path, None)
+            peers = self._by_quick.setdefault(key, [])
+            if path not in peers:
+                peers.append(path)
+        return key, exact
+
+    def _full_hash(self, path: str) -> str | None:
+        stamp = file_stamp(path)
+        if stamp is None:
+            return None
+        with self._cond:
+            cached = self._full.get(path)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+        digest = full_fingerprint(path)
+        if digest is not None:
+            with self._cond:
+                self._full[path] = (stamp, digest)
+        return digest
+
+    def _content_key(self, path: str) -> str | None:
+        entry = self._quick_entry(path)
+        if entry is None:
+            return None
+        key, exact = entry
+        if exact:
+            return key
+        with self._cond:
+            alone = len(self._by_quick.get(key, [])) <= 1
+        if alone:
+            # 抽样指纹唯一即可断定内容唯一，无需完整哈希
+            return key
+        digest = self._full_hash(path)
+        return f"full:{digest}" if digest is not None else None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._queue:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                path = self._queue.popleft()
+                self._busy = True
+            try:
+                if path in self._order:
+                    original = self.duplicate_of(path)
+                    if original is not None:
+                        with self._cond:
+                            if path in self._order:
+                                self._events.append((path, original))
+            finally:
+                with self._cond:
+                    self._busy = False
+
+
+def collapse_duplicates(tasks: List[Tuple[str, Any]], index: FingerprintIndex
+                        ) -> Tuple[List[Tuple[str, Any]], Dict[str, List[str]]]:
+    """把内容相同且水印规格相同的导出任务合并为一个
+
+    返回 (去重后的任务, {保留的源路径: [内容相同的其他源路径]})；
+    保留路径只渲染一次，其余路径的输出由导出流水线链接或复制得到。
+    只使用后台已算好的指纹，不等待也不读取文件：指纹未就绪的路径照常单独导出。
+    """
+    keys = index.known_content_keys(p for p, _ in tasks)
+    kept: List[Tuple[str, Any]] = []
+    aliases: Dict[str, List[str]] = {}
+    first: Dict[Tuple, str] = {}
+    for path, settings in tasks:
+        content = keys.get(path)
+        try:
+            group = (content, settings) if content is not None else None
+            hash(group)
+        except TypeError:
+            group = None
+        if group is None or group not in first:
+            if group is not None:
+                first[group] = path
+            kept.append((path, settings))
+            continue
+        aliases.setdefault(first[group], []).append(path)
+    return kept, aliases
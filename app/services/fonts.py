@@ -0,0 +1,40 @@
+from __future__ import annotations
+import json
+from typing import List
+
+from PySide6.QtGui import QFontDatabase
+
+from app.store import ensure_dirs, get_app_data_dir
+from .fileio import write_bytes_atomic
+
+
+def _snapshot_file():
+    return get_app_data_dir() / "font-families.json"
+
+
+def load_family_snapshot() -> List[str] | None:
+    """读取上次枚举的字体族快照；不存在或损坏时返回 None"""
+    try:
+        with _snapshot_file().open("r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if isinstance(data, list) and all(isinstance(x, str) for x in data):
+        return data
+    return None
+
+
+def save_family_snapshot(families: List[str]) -> None:
+    try:
+        ensure_dirs()
+    except OSError:
+        return
+    write_bytes_atomic(_snapshot_file(), json.dumps(list(families), ensure_ascii=False).encode("utf-8"), fsync=False)
+
+
+def enumerate_families() -> List[str]:
+    """枚举系统字体族（字体很多时耗时数秒，只应在需要时调用），并刷新快照"""
+    families = list(QFontDatabase.families())
+    if families != load_family_snapshot():
+        save_family_snapshot(families)
+    return families
@@ -0,0 +1,265 @@
+from __future__ import annotations
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from PySide6.QtCore import QPointF, Qt
+from PySide6.QtGui import (
+    QColor,
+    QFontMetricsF,
+    QGlyphRun,
+    QImage,
+    QPainter,
+    QPen,
+    QRawFont,
+    QTextLayout,
+    QTextOption,
+)
+
+from .shadow import BLUR_SIGMA_PER_RADIUS, alpha_of, blur_alpha, colorize
+
+
+# 字形水平位置量化到 1/4 像素：每个字形最多 4 份位图，位置误差不超过 1/8 像素
+SUBPIXEL_STEPS = 4
+# 与 QGraphicsTextItem 的文档边距一致，使图层尺寸与文字原点与 render_text_layer 相同
+DOCUMENT_MARGIN = 4
+_STYLE_LIMIT = 16
+_GLYPH_LIMIT = 4096
+
+
+def _color(wm: Dict[str, Any], key: str, default: QColor) -> QColor:
+    value = wm.get(key, default)
+    return value if isinstance(value, QColor) else QColor(default)
+
+
+def _raw_font_key(raw: QRawFont) -> Tuple:
+    return (raw.familyName(), raw.styleName(), raw.pixelSize(), raw.weight(), int(raw.style().value))
+
+
+class _Sprite:
+    """单个字形在某一亚像素相位下的位图：左上角相对笔位（取整后）的偏移"""
+
+    __slots__ = ("fill", "stroke", "shadow", "dx", "dy", "sx", "sy")
+
+    def __init__(self) -> None:
+        self.fill: QImage | None = None
+        self.stroke: QImage | None = None
+        self.shadow: QImage | None = None
+        self.dx = self.dy = self.sx = self.sy = 0
+
+
+class _Style:
+    """一种字体与样式（颜色、描边、阴影）下的字形位图集合"""
+
+    def __init__(self, wm: Dict[str, Any]) -> None:
+        from .compositor import watermark_font
+
+        self.font = watermark_font(wm)
+        metrics = QFontMetricsF(self.font)
+        self.ascent = metrics.ascent()
+        self.height = math.ceil(metrics.ascent() + metrics.descent())
+        self.color = _color(wm, "color", QColor(0, 0, 0))
+        self.stroke_width = int(wm.get("stroke_width", 2)) if bool(wm.get("stroke_enabled", False)) else 0
+        self.stroke_color = _color(wm, "stroke_color", QColor(255, 255, 255))
+        self.shadow = bool(wm.get("shadow_enabled", False))
+        self.shadow_blur = int(wm.get("shadow_blur", 5))
+        self.shadow_color = _color(wm, "shadow_color", QColor(0, 0, 0))
+        self.lock = threading.Lock()
+        self.sprites: "OrderedDict[Tuple, _Sprite]" = OrderedDict()
+
+    def sprite(self, raw: QRawFont, glyph: int, phase: int, baseline: float) -> _Sprite:
+        key = (_raw_font_key(raw), glyph, phase)
+        with self.lock:
+            hit = self.sprites.get(key)
+            if hit is not None:
+                self.sprites.move_to_end(key)
+                return hit
+        sprite = self._render(raw, glyph, phase / SUBPIXEL_STEPS, baseline - math.floor(baseline))
+        with self.lock:
+            sprite = self.sprites.setdefault(key, sprite)
+            while len(self.sprites) > _GLYPH_LIMIT:
+                self.sprites.popitem(last=False)
+        return sprite
+
+    def _render(self, raw: QRawFont, glyph: int, fx: float, fy: float) -> _Sprite:
+        sprite = _Sprite()
+        bounds = raw.boundingRect(glyph)
+        pad = self.stroke_width + 2
+        left = math.floor(bounds.left() + fx) - pad
+        top = math.floor(bounds.top() + fy) - pad
+        w = max(1, math.ceil(bounds.right() + fx) + pad - left)
+        h = max(1, math.ceil(bounds.bottom() + fy) + pad - top)
+        origin = QPointF(fx - left, fy - top)
+        sprite.dx, sprite.dy = left, top
+
+        def canvas() -> Tuple[QImage, QPainter]:
+            img = QImage(w, h, QImage.Format_ARGB32_Premultiplied)
+            img.fill(Qt.GlobalColor.transparent)
+            painter = QPainter(img)
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
+            return img, painter
+
+        if self.stroke_width > 0:
+            # 与 StrokedTextItem 一致：描边与填充都按字形路径绘制
+            path = raw.pathForGlyph(glyph).translated(origin)
+            sprite.stroke, painter = canvas()
+            pen = QPen(self.stroke_color, self.stroke_width * 2)
+            pen.setJoinStyle(Qt.PenJoinStyle.RoundJoin)
+            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+            painter.strokePath(path, pen)
+            painter.end()
+            sprite.fill, painter = canvas()
+            painter.fillPath(path, self.color)
+            painter.end()
+        else:
+            run = QGlyphRun()
+            run.setRawFont(raw)
+            run.setGlyphIndexes([glyph])
+            run.setPositions([QPointF(0, 0)])
+            sprite.fill, painter = canvas()
+            painter.setPen(self.color)
+            painter.drawGlyphRun(origin, run)
+            painter.end()
+        if self.shadow:
+            sprite.shadow, sprite.sx, sprite.sy = self._shadow(sprite)
+        return sprite
+
+    def _shadow(self, sprite: _Sprite) -> Tuple[QImage, int, int]:
+        """字形（含描边）遮罩的模糊阴影；模糊是线性的，逐字形相加即整段文字的阴影"""
+        pad = int(math.ceil(self.shadow_blur * BLUR_SIGMA_PER_RADIUS * 3.0)) + 1
+        mask = QImage(sprite.fill.width() + pad * 2, sprite.fill.height() + pad * 2,
+                      QImage.Format_ARGB32_Premultiplied)
+        mask.fill(0)
+        painter = QPainter(mask)
+        if sprite.stroke is not None:
+            painter.drawImage(pad, pad, sprite.stroke)
+        painter.drawImage(pad, pad, sprite.fill)
+        painter.end()
+        blurred = blur_alpha(alpha_of(mask), self.shadow_blur)
+        return colorize(blurred, self.shadow_color), sprite.dx - pad, sprite.dy - pad
+
+
+def style_key(wm: Dict[str, Any]) -> Tuple:
+    """影响字形位图的设置；文本、透明度与阴影偏移不参与"""
+    def name(key: str, default: str) -> str:
+        value = wm.get(key)
+        return value.name(QColor.NameFormat.HexArgb) if isinstance(value, QColor) else default
+
+    return (
+        wm.get("font_family", ""),
+        int(wm.get("font_size", 32)),
+        bool(wm.get("font_bold", False)),
+        bool(wm.get("font_italic", False)),
+        name("color", "#ff000000"),
+        bool(wm.get("stroke_enabled", False)),
+        int(wm.get("stroke_width", 2)),
+        name("stroke_color", "#ffffffff"),
+        bool(wm.get("shadow_enabled", False)),
+        int(wm.get("shadow_blur", 5)),
+        name("shadow_color", "#ff000000"),
+    )
+
+
+class GlyphAtlas:
+    """按字体与样式缓存的字形位图集，用于逐图不同的文本（如含令牌的水印）
+
+    文字先用 QTextLayout 排版（含字距与字体回退），每个字形按亚像素相位取一次
+    位图（含描边与预模糊的阴影），之后任意文本只是若干次整数坐标的 drawImage。
+    不经过 QGraphicsScene，可在导出的工作线程中调用。输出的图层尺寸与文字原点
+    与 render_text_layer 相同，但字形逐个栅格化、位置量化到 1/4 像素、阴影逐字形
+    相加，边缘抗锯齿与 render_text_layer 的像素并不逐一相同。
+    """
+
+    def __init__(self, limit: int = _STYLE_LIMIT) -> None:
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._styles: "OrderedDict[Tuple, _Style]" = OrderedDict()
+
+    def style(self, wm: Dict[str, Any]) -> _Style:
+        key = style_key(wm)
+        with self._lock:
+            style = self._styles.get(key)
+            if style is not None:
+                self._styles.move_to_end(key)
+                return style
+        style = _Style(wm)
+        with self._lock:
+            style = self._styles.setdefault(key, style)
+            while len(self._styles) > self.limit:
+                self._styles.popitem(last=False)
+        return style
+
+    def render(self, wm: Dict[str, Any], text: str) -> QImage | None:
+        """把 text 按 wm 的样式渲染为透明图层；文本为空返回 None"""
+        if not text:
+            return None
+        style = self.style(wm)
+        layout = QTextLayout(text, style.font)
+        option = QTextOption()
+        option.setWrapMode(QTextOption.WrapMode.NoWrap)
+        layout.setTextOption(option)
+        layout.beginLayout()
+        line = layout.createLine()
+        line.setLineWidth(1e7)
+        layout.endLayout()
+        sw = style.stroke_width
+        if sw > 0:
+            # 与 render_text_layer 对描边文本的排布相同：边界外扩描边宽度，
+            # 路径原点落在 (2×描边宽度, 2×描边宽度 + ascent)
+            ox = oy = float(2 * sw)
+            extra = 2 * DOCUMENT_MARGIN + 2 * sw
+        else:
+            ox = oy = float(DOCUMENT_MARGIN)
+            extra = 2 * DOCUMENT_MARGIN
+        width = int(line.naturalTextWidth() + extra)
+        height = int(style.height + extra)
+        if width <= 0 or height <= 0:
+            return None
+
+        placed: List[Tuple[_Sprite, int, int]] = []
+        for run in layout.glyphRuns():
+            raw = run.rawFont()
+            for glyph, pos in zip(run.glyphIndexes(), run.positions()):
+                x = ox + pos.x()
+                y = oy + pos.y()
+                ix = math.floor(x)
+                phase = int(round((x - ix) * SUBPIXEL_STEPS))
+                if phase == SUBPIXEL_STEPS:
+                    ix, phase = ix + 1, 0
+                sprite = style.sprite(raw, glyph, phase, y)
+                placed.append((sprite, ix, math.floor(y)))
+
+        layer = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+        layer.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(layer)
+        if style.shadow:
+            # 各字形阴影直接相加（等同于对整段文字遮罩做一次模糊），画在文字之后
+            offset = int(wm.get("shadow_offset", 2))
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Plus)
+            for sprite, ix, iy in placed:
+                painter.drawImage(ix + sprite.sx + offset, iy + sprite.sy + offset, sprite.shadow)
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+        if sw > 0:
+            for sprite, ix, iy in placed:
+                painter.drawImage(ix + sprite.dx, iy + sprite.dy, sprite.stroke)
+        for sprite, ix, iy in placed:
+            painter.drawImage(ix + sprite.dx, iy + sprite.dy, sprite.fill)
+        opacity = float(wm.get("opacity", 0.6))
+        if opacity < 1.0:
+            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_DestinationIn)
+            painter.fillRect(layer.rect(), QColor(0, 0, 0, int(round(max(0.0, opacity) * 255))))
+        painter.end()
+        return layer
+
+    def clear(self) -> None:
+        with self._lock:
+            self._styles.clear()
+
+
+_shared_atlas = GlyphAtlas()
+
+
+def shared_glyph_atlas() -> GlyphAtlas:
+    return _shared_atlas
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import os
+import threading
+from collections import OrderedDict
+from typing import Tuple
+
+from PySide6.QtGui import QImage
+
+
+DEFAULT_PREVIEW_CACHE_MB = 512
+
+
+def file_stamp(path: str) -> Tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class DecodedImageCache:
+    """按字节预算的已解码图片 LRU 缓存（线程安全）
+
+    以路径为键，同时记录文件的 mtime 与大小；文件被修改后旧条目自动失效。
+    预取线程写入、主线程读取，共用同一份缓存。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_PREVIEW_CACHE_MB * 1024 * 1024) -> None:
+        self.max_bytes = max(0, int(max_bytes))
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], QImage, int]]" = OrderedDict()
+
+    def get(self, path: str) -> QImage | None:
+        stamp = file_stamp(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != stamp:
+                # 文件已变化：丢弃过期条目
+                self._drop(path)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def contains(self, path: str) -> bool:
+        stamp = file_stamp(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            return entry is not None and entry[0] == stamp
+
+    def put(self, path: str, img: QImage, stamp: Tuple[int, int] | None = None) -> None:
+        """stamp 应在解码前取得，避免解码期间文件被替换时缓存到旧内容"""
+        if img is None or img.isNull():
+            return
+        stamp = stamp if stamp is not None else file_stamp(path)
+        if stamp is None:
+            return
+        nbytes = img.sizeInBytes()
+        with self._lock:
+            if path in self._entries:
+                self._drop(path)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[path] = (stamp, img, nbytes)
+            self.used_bytes += nbytes
+            self._evict_to(self.max_bytes)
+
+    def discard(self, path: str) -> None:
+        with self._lock:
+            if path in self._entries:
+                self._drop(path)
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            self._evict_to(self.max_bytes)
+
+    def trim(self, fraction: float = 0.5) -> None:
+        """内存紧张时收缩到预算的一定比例（0 为清空），按最久未用优先淘汰"""
+        with self._lock:
+            self._evict_to(int(self.max_bytes * max(0.0, min(1.0, fraction))))
+
+    def clear(self) -> None:
+        self.trim(0.0)
+
+    def _evict_to(self, limit: int) -> None:
+        while self._entries and self.used_bytes > limit:
+            path = next(iter(self._entries))
+            self._drop(path)
+
+    def _drop(self, path: str) -> None:
+        _, _, nbytes = self._entries.pop(path)
+        self.used_bytes -= nbytes
@@ -0,0 +1,299 @@
+from __future__ import annotations
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+from app.store import ensure_dirs, get_library_db_file
+from .probe import ImageInfo
+
+
+SCHEMA_VERSION = 2
+# executemany / IN (...) 每批的行数，低于 SQLite 的变量上限
+_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    width INTEGER NOT NULL DEFAULT 0,
+    height INTEGER NOT NULL DEFAULT 0,
+    format TEXT NOT NULL DEFAULT '',
+    orientation INTEGER NOT NULL DEFAULT 1,
+    mode TEXT NOT NULL DEFAULT '',
+    file_size INTEGER NOT NULL DEFAULT 0,
+    mtime_ns INTEGER NOT NULL DEFAULT 0,
+    added_at INTEGER NOT NULL,
+    placement TEXT,
+    exported_at INTEGER,
+    export_count INTEGER NOT NULL DEFAULT 0,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_images_folder ON images(folder);
+CREATE INDEX IF NOT EXISTS idx_images_mtime ON images(mtime_ns);
+CREATE INDEX IF NOT EXISTS idx_images_size ON images(file_size);
+CREATE INDEX IF NOT EXISTS idx_images_exported ON images(exported_at);
+CREATE INDEX IF NOT EXISTS idx_images_pending ON images(folder, path) WHERE exported_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS thumbnails (
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    edge INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (image_id, edge)
+);
+
+CREATE TABLE IF NOT EXISTS exports (
+    id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    ts INTEGER NOT NULL,
+    out_path TEXT NOT NULL,
+    template TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_exports_image ON exports(image_id, ts);
+"""
+
+_INFO_COLUMNS = "path, width, height, format, orientation, mode, file_size, mtime_ns"
+
+
+def _chunks(items: List[Any], size: int = _BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _folder_of(path: str) -> str:
+    return str(Path(path).parent)
+
+
+class LibraryCatalog:
+    """可选的本地图库目录（SQLite），用于跨会话复用大型图片档案
+
+    记录图片路径、文件头元数据、抽样内容指纹、列表缩略图、每图自定义坐标与导出记录；
+    按文件夹、修改时间、文件大小与导出状态建索引（未导出的图片另有部分索引），
+    重新打开档案并筛选“尚未导出”只需一次索引查询，不扫描磁盘也不探测文件头。
+    数据库位于数据目录的 library.sqlite3，只在用户把图片加入图库后才创建。
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = Path(path) if path is not None else get_library_db_file()
+        if path is None:
+            ensure_dirs()
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # 缩略图在界面线程读写，导出记录在导出结束后写入；统一用锁串行化
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        with self._db:
+            self._db.executescript(_SCHEMA)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(images)")}
+            if "fingerprint" not in columns:
+                # 第 1 版数据库没有指纹列
+                self._db.execute("ALTER TABLE images ADD COLUMN fingerprint TEXT")
+            self._db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    @staticmethod
+    def exists(path: Path | None = None) -> bool:
+        return (Path(path) if path is not None else get_library_db_file()).exists()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    # 图片
+
+    def add(self, paths: Iterable[str], infos: Dict[str, ImageInfo] | None = None,
+            fingerprints: Dict[str, str] | None = None) -> int:
+        """加入或更新图片，返回处理的行数
+
+        infos 提供已探测的元数据（缺失的字段保持默认值）；fingerprints 为抽样内容指纹，
+        须与 infos 中同一 (mtime_ns, 大小) 的文件对应，没有元数据的路径不保存指纹。
+        """
+        infos = infos or {}
+        fingerprints = fingerprints or {}
+        now = int(time.time())
+        rows = []
+        for p in paths:
+            info = infos.get(p)
+            if info is None:
+                rows.append((p, _folder_of(p), Path(p).name, 0, 0, "", 1, "", 0, 0, now, None))
+            else:
+                rows.append((p, _folder_of(p), Path(p).name, info.width, info.height, info.format,
+                             info.orientation, info.mode, info.file_size, info.mtime_ns, now, fingerprints.get(p)))
+        # 已在图库中的路径只刷新元数据与指纹，保留坐标与导出状态；未探测到的元数据不覆盖已有值
+        sql = (
+            "INSERT INTO images (path, folder, name, width, height, format, orientation, mode, file_size, mtime_ns, "
+            "added_at, fingerprint) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET "
+            "width=excluded.width, height=excluded.height, format=excluded.format, orientation=excluded.orientation, "
+            "mode=excluded.mode, file_size=excluded.file_size, mtime_ns=excluded.mtime_ns, "
+            "fingerprint=excluded.fingerprint "
+            "WHERE excluded.mtime_ns != 0"
+        )
+        with self._lock, self._db:
+            self._db.executemany(sql, rows)
+        return len(rows)
+
+    def remove(self, paths: Iterable[str]) -> None:
+        paths = list(paths)
+        with self._lock, self._db:
+            for chunk in _chunks(paths):
+                self._db.execute(f"DELETE FROM images WHERE path IN ({','.join('?' * len(chunk))})", chunk)
+
+    def contains(self, path: str) -> bool:
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM images WHERE path = ?", (path,)).fetchone() is not None
+
+    def query(self, folder: str | None = None, recursive: bool = True, exported: bool | None = None,
+              modified_after: float | None = None, modified_before: float | None = None,
+              min_size: int | None = None, max_size: int | None = None,
+              order: str = "path", limit: int | None = None) -> List[ImageInfo]:
+        """按文件夹（可含子文件夹）、修改时间（秒）、文件大小与导出状态查询
+
+        exported=False 只返回从未导出的图片，True 只返回导出过的，None 不限。
+        元数据未知（加入时未能探测）的行 width/height 为 0。
+        """
+        where: List[str] = []
+        args: List[Any] = []
+        if folder is not None:
+            folder = str(Path(folder))
+            if recursive:
+                # 前缀范围查询可以走 folder 索引（LIKE 不能）
+                sep = "\\" if "\\" in folder else "/"
+                prefix = folder.rstrip("\\/") + sep
+                where.append("(folder = ? OR (folder >= ? AND folder < ?))")
+                args += [folder, prefix, prefix + "\U0010ffff"]
+            else:
+                where.append("folder = ?")
+                args.append(folder)
+        if exported is True:
+            where.append("exported_at IS NOT NULL")
+        elif exported is False:
+            where.append("exported_at IS NULL")
+        if modified_after is not None:
+            where.append("mtime_ns >= ?")
+            args.append(int(modified_after * 1e9))
+        if modified_before is not None:
+            where.append("mtime_ns < ?")
+            args.append(int(modified_before * 1e9))
+        if min_size is not None:
+            where.append("file_size >= ?")
+            args.append(int(min_size))
+        if max_size is not None:
+            where.append("file_size <= ?")
+            args.append(int(max_size))
+        order_by = {"path": "path", "mtime": "mtime_ns DESC", "size": "file_size DESC", "name": "name"}.get(order, "path")
+        sql = f"SELECT {_INFO_COLUMNS} FROM images"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {order_by}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [ImageInfo(*row) for row in rows]
+
+    def fingerprints(self, paths: Iterable[str]) -> Dict[str, Tuple[Tuple[int, int], str]]:
+        """{路径: ((mtime_ns, 大小), 抽样指纹)}；指纹对应该 mtime 与大小时的文件内容"""
+        sql = "SELECT path, mtime_ns, file_size, fingerprint FROM images WHERE fingerprint IS NOT NULL"
+        rows = []
+        with self._lock:
+            for chunk in _chunks(list(paths)):
+                rows += self._db.execute(f"{sql} AND path IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+        return {path: ((mtime_ns, size), key) for path, mtime_ns, size, key in rows}
+
+    # 每图自定义坐标
+
+    def set_placements(self, placements: Dict[str, Dict[str, Any] | None]) -> None:
+        """批量写入自定义坐标（None 表示清除）；不在图库中的路径忽略"""
+        rows = [(json.dumps(pos, sort_keys=True) if pos else None, p) for p, pos in placements.items()]
+        with self._lock, self._db:
+            self._db.executemany("UPDATE images SET placement = ? WHERE path = ?", rows)
+
+    def placements(self, paths: Iterable[str] | None = None) -> Dict[str, Dict[str, Any]]:
+        sql = "SELECT path, placement FROM images WHERE placement IS NOT NULL"
+        with self._lock:
+            if paths is None:
+                rows = self._db.execute(sql).fetchall()
+            else:
+                rows = []
+                for chunk in _chunks(list(paths)):
+                    rows += self._db.execute(f"{sql} AND path IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+        out: Dict[str, Dict[str, Any]] = {}
+        for path, data in rows:
+            try:
+                pos = json.loads(data)
+            except ValueError:
+                continue
+            if isinstance(pos, dict):
+                out[path] = pos
+        return out
+
+    # 缩略图
+
+    def thumbnail(self, path: str, edge: int, stamp: Tuple[int, int]) -> bytes | None:
+        """取缓存的缩略图字节；源文件的 (mtime_ns, 大小) 与记录不一致时视为失效"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT t.data FROM thumbnails t JOIN images i ON i.id = t.image_id "
+                "WHERE i.path = ? AND t.edge = ? AND t.mtime_ns = ? AND t.file_size = ?",
+                (path, int(edge), stamp[0], stamp[1]),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_thumbnail(self, path: str, edge: int, stamp: Tuple[int, int], data: bytes) -> bool:
+        """保存缩略图；路径不在图库中时返回 False"""
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT OR REPLACE INTO thumbnails (image_id, edge, mtime_ns, file_size, data) "
+                "SELECT id, ?, ?, ?, ? FROM images WHERE path = ?",
+                (int(edge), stamp[0], stamp[1], sqlite3.Binary(data), path),
+            )
+            return cur.rowcount > 0
+
+    # 导出记录
+
+    def record_exports(self, outputs: Iterable[Tuple[str, str]], template: str = "", ts: int | None = None) -> None:
+        """记录成功的导出 [(源路径, 输出路径)]，并更新源图的导出状态"""
+        ts = int(ts if ts is not None else time.time())
+        outputs = list(outputs)
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO exports (image_id, ts, out_path, template) "
+                "SELECT id, ?, ?, ? FROM images WHERE path = ?",
+                [(ts, out, template, src) for src, out in outputs],
+            )
+            self._db.executemany(
+                "UPDATE images SET exported_at = ?, export_count = export_count + 1 WHERE path = ?",
+                [(ts, src) for src in dict.fromkeys(src for src, _ in outputs)],
+            )
+
+    def export_history(self, path: str) -> List[Tuple[int, str, str]]:
+        """某张图的导出记录 [(时间戳, 输出路径, 模板)]，最新在前"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT e.ts, e.out_path, e.template FROM exports e JOIN images i ON i.id = e.image_id "
+                "WHERE i.path = ? ORDER BY e.ts DESC, e.id DESC",
+                (path,),
+            ).fetchall()
+
+    def reset_export_status(self, paths: Iterable[str]) -> None:
+        """把图片重新标记为未导出；导出记录保留"""
+        paths = list(paths)
+        with self._lock, self._db:
+            for chunk in _chunks(paths):
+                self._db.execute(
+                    f"UPDATE images SET exported_at = NULL WHERE path IN ({','.join('?' * len(chunk))})", chunk)
@@ -0,0 +1,463 @@
+from __future__ import annotations
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from PySide6.QtGui import QImage, QImageReader
+
+from .compositor import LayerStack, bind_tokens, compose_layer_onto, shared_overlay_plans
+from .encoders import encode_qimage
+from .export import output_path_for, render_renditions, target_size
+from .fileio import link_or_copy, write_bytes_atomic
+from .probe import MetadataIndex
+from .streaming import can_stream, copy_output, stream_job_bytes, stream_unit_rows, stream_watermark
+from .telemetry import ExportTelemetry
+from .tokens import stack_templated, token_context
+
+
+DEFAULT_MEMORY_BUDGET_MB = 2048
+
+
+class MemoryBudget:
+    """按字节计数的在途内存预算
+
+    acquire() 在预算不足时阻塞，从而限制同时解码的图片数量；
+    单张超出全部预算的大图在没有其他在途任务时独占放行，避免死锁。
+    """
+
+    def __init__(self, limit_bytes: int) -> None:
+        self.limit = max(1, int(limit_bytes))
+        self.in_use = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+        self._cancelled = False
+
+    def acquire(self, nbytes: int) -> bool:
+        nbytes = max(0, int(nbytes))
+        with self._cond:
+            while not self._cancelled and self.in_use > 0 and self.in_use + nbytes > self.limit:
+                self._cond.wait()
+            if self._cancelled:
+                return False
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+            return True
+
+    def release(self, nbytes: int) -> None:
+        with self._cond:
+            self.in_use = max(0, self.in_use - max(0, int(nbytes)))
+            self._cond.notify_all()
+
+    def cancel(self) -> None:
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+
+def image_dimensions(path: str) -> Tuple[int, int]:
+    """只读文件头获取尺寸，不解码像素；失败返回 (0, 0)"""
+    reader = QImageReader(path)
+    size = reader.size()
+    if not size.isValid():
+        return 0, 0
+    return size.width(), size.height()
+
+
+def estimate_job_bytes(width: int, height: int, renditions: List[Dict[str, Any]]) -> int:
+    """估算一张图在导出过程中的峰值像素内存
+
+    解码缓冲 + ARGB32 合成图 + 各规格的缩放中间图 + 编码时最大的一份拷贝。
+    """
+    base = width * height * 4
+    if base <= 0:
+        return 0
+    scaled = 0
+    largest = 0
+    for rend in renditions:
+        tw, th = target_size(width, height, rend.get("resize_mode", "none"), rend.get("resize_value", 100))
+        nbytes = tw * th * 4
+        largest = max(largest, nbytes)
+        if (tw, th) != (width, height):
+            scaled += nbytes
+    return base * 2 + scaled + largest
+
+
+def auto_worker_count(budget_bytes: int, job_bytes: List[int]) -> int:
+    """按 CPU 数与“预算能容纳几张典型图片”取较小者"""
+    cpu = os.cpu_count() or 2
+    sizes = sorted(b for b in job_bytes if b > 0)
+    if not sizes:
+        return max(1, min(cpu, 4))
+    typical = sizes[len(sizes) // 2]
+    return max(1, min(cpu, budget_bytes // max(1, typical)))
+
+
+_STOP = object()
+
+
+class _Job:
+    """一张源图在流水线中的状态：字节 → 合成图 → 各规格编码结果"""
+
+    __slots__ = ("path", "settings", "nbytes", "stream", "data", "pending", "results", "t0", "aliases",
+                 "index", "size", "templated")
+
+    def __init__(self, path: str, settings: Dict[str, Any], nbytes: int, stream: bool = False) -> None:
+        self.path = path
+        self.settings = settings
+        self.nbytes = nbytes
+        # 超大 PNG/TIFF：不整图解码，合成线程按条带读取、贴水印并直接写出
+        self.stream = stream
+        self.data: bytes | None = None
+        self.pending = 0
+        self.results: List[Tuple[Dict[str, Any], Path, bool]] = []
+        # 开始读取的时刻，用于统计单个文件的端到端耗时
+        self.t0 = 0.0
+        # 内容与水印规格都相同的其他源路径：不再渲染，输出由本任务的结果链接或复制
+        self.aliases: List[str] = []
+        # 令牌 {index} 的取值（任务顺序，从 1 开始）、文件头尺寸，以及水印文字是否逐图不同
+        self.index = 0
+        self.size = (0, 0)
+        self.templated = False
+
+
+class BatchExporter:
+    """分阶段的批量导出流水线：读取 → 合成 → 编码 → 写入
+
+    - 读取线程预取源文件字节，受内存预算约束（预算不足时阻塞，不再继续解码）
+    - 合成线程解码、贴水印图层并扇出各规格缩放图
+    - 编码线程把各规格编码为字节
+    - 写入线程写临时文件后原子重命名，中途崩溃不会留下截断的输出
+    各阶段之间用有界队列连接，磁盘/网络延迟与 CPU 计算相互重叠。
+    超大的 PNG/TIFF（见 streaming.can_stream）不整图解码，由合成线程按条带流式导出。
+
+    tasks 为 (源路径, 水印设置) 列表；layer 为已在 GUI 线程渲染好的水印图层
+    （多图层水印为 compositor.LayerStack，按尺寸编译为一张叠加层），
+    工作线程只做解码、贴图层与编码，不接触 QGraphicsScene/QPixmap。
+    aliases 为 {源路径: [内容相同的其他源路径]}（见 fingerprint.collapse_duplicates），
+    这些路径不再渲染，写出源路径的结果后按各自的输出文件名硬链接或复制。
+    metadata 为导入时建立的元数据表，命中时不再读取文件头估算内存。
+    水印文字含令牌（见 tokens）时，合成线程按每张图的取值用字形图集重新拼出文字层。
+    """
+
+    def __init__(self, tasks: List[Tuple[str, Dict[str, Any]]], layer: QImage | LayerStack | None,
+                 out_dir: str, renditions: List[Dict[str, Any]],
+                 memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB, max_workers: int = 0,
+                 aliases: Dict[str, List[str]] | None = None, metadata: MetadataIndex | None = None) -> None:
+        self.tasks = list(tasks)
+        self.aliases = {path: list(dups) for path, dups in (aliases or {}).items()}
+        self.metadata = metadata
+        self.layer = layer
+        self.out_dir = out_dir
+        self.renditions = list(renditions)
+        self.budget = MemoryBudget(max(64, int(memory_budget_mb)) * 1024 * 1024)
+        self.max_workers = int(max_workers)
+        self.ok_count = 0
+        self.done_count = 0
+        self.skipped_count = 0
+        self.fail_items: List[str] = []
+        # 成功写出的 (源路径, 输出路径)，供图库记录导出状态
+        self.written: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.telemetry = ExportTelemetry()
+        self.workers = 0
+        self._read_q: queue.Queue | None = None
+        self._encode_q: queue.Queue | None = None
+        self._write_q: queue.Queue | None = None
+
+    @property
+    def total(self) -> int:
+        return len(self.tasks) + sum(len(dups) for dups in self.aliases.values())
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="batch-export", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """等待结束，返回是否已完成"""
+        if self._thread is None:
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        self.budget.cancel()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def queue_depths(self) -> Dict[str, int]:
+        """各阶段入口队列中等待的任务数（合成/编码/写入）"""
+        queues = (("compose", self._read_q), ("encode", self._encode_q), ("write", self._write_q))
+        return {name: (q.qsize() if q is not None else 0) for name, q in queues}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """供界面定期读取的实时统计"""
+        snap = self.telemetry.snapshot()
+        snap["queues"] = self.queue_depths()
+        snap["done"] = self.done_count
+        snap["total"] = self.total
+        snap["workers"] = self.workers
+        snap["in_flight_mb"] = round(self.budget.in_use / (1024 * 1024), 1)
+        snap["peak_budget_mb"] = round(self.budget.peak / (1024 * 1024), 1)
+        return snap
+
+    def _run(self) -> None:
+        # 先只读文件头估算每张图的内存占用，据此决定并发数
+        jobs = []
+        targets = []
+        for index, (path, settings) in enumerate(self.tasks, 1):
+            info = self.metadata.info(path) if self.metadata is not None else None
+            if info is not None:
+                w, h, raw = info.width, info.height, info.file_size
+            else:
+                w, h = image_dimensions(path)
+                try:
+                    # 预取的压缩字节在解码前也占内存，一并计入预算
+                    raw = os.path.getsize(path)
+                except OSError:
+                    raw = 0
+            if can_stream(path, w, h, self.renditions, self.budget.limit):
+                job = _Job(path, settings, stream_job_bytes(w, unit_rows=stream_unit_rows(path) or 0), stream=True)
+            else:
+                job = _Job(path, settings, estimate_job_bytes(w, h, self.renditions) + raw)
+            job.aliases = self.aliases.get(path, [])
+            job.index = index
+            job.size = (w, h)
+            job.templated = stack_templated(settings)
+            jobs.append(job)
+            if not job.stream and not job.templated:
+                targets.append((w, h, settings))
+        # 按尺寸与摆放设置分组，每组只计算一次摆放方案；合成时每张图只需一次混合
+        if self.layer is not None and not self.layer.isNull():
+            shared_overlay_plans().prepare(self.layer, targets)
+        workers = self.max_workers if self.max_workers > 0 else auto_worker_count(
+            self.budget.limit, [job.nbytes for job in jobs])
+        self.workers = workers
+        self.telemetry.set_threads("compose", workers)
+        self.telemetry.set_threads("encode", workers)
+
+        self._read_q: queue.Queue = queue.Queue(maxsize=max(2, workers))
+        self._encode_q: queue.Queue = queue.Queue(maxsize=max(2, workers * 2))
+        self._write_q: queue.Queue = queue.Queue(maxsize=8)
+
+        composers = [threading.Thread(target=self._compose_stage, name=f"export-compose-{i}", daemon=True)
+                     for i in range(workers)]
+        encoders = [threading.Thread(target=self._encode_stage, name=f"export-encode-{i}", daemon=True)
+                    for i in range(workers)]
+        writer = threading.Thread(target=self._write_stage, name="export-write", daemon=True)
+        for t in composers + encoders + [writer]:
+            t.start()
+
+        self._read_stage(jobs)
+        # 逐级关闭：读取结束 → 合成结束 → 编码结束 → 写入结束
+        for _ in composers:
+            self._read_q.put(_STOP)
+        for t in composers:
+            t.join()
+        for _ in encoders:
+            self._encode_q.put(_STOP)
+        for t in encoders:
+            t.join()
+        self._write_q.put(_STOP)
+        writer.join()
+        self.telemetry.finish()
+
+    def _read_stage(self, jobs: List[_Job]) -> None:
+        for job in jobs:
+            if self._cancelled.is_set() or not self.budget.acquire(job.nbytes):
+                # 已取消：计入进度但不算失败
+                self._skip(job)
+                continue
+            job.t0 = time.perf_counter()
+            if job.stream:
+                self._read_q.put(job)
+                continue
+            try:
+                job.data = Path(job.path).read_bytes()
+            except OSError:
+                self.budget.release(job.nbytes)
+                self._fail(job)
+                continue
+            self.telemetry.add_read(len(job.data), time.perf_counter() - job.t0)
+            self._read_q.put(job)
+
+    def _compose_stage(self) -> None:
+        while True:
+            job = self._read_q.get()
+            if job is _STOP:
+                return
+            if job.stream:
+                self._stream_job(job)
+                continue
+            name = Path(job.path).name
+            t0 = time.perf_counter()
+            try:
+                img = QImage.fromData(job.data)
+                job.data = None
+                if img.isNull() or self._cancelled.is_set():
+                    raise ValueError(name)
+                img = img.convertToFormat(QImage.Format_ARGB32)
+                if self.layer is not None and not self.layer.isNull():
+                    layer = self._job_layer(job, img.width(), img.height())
+                    if layer is not None and not layer.isNull():
+                        compose_layer_onto(img, layer, job.settings, cache=not job.templated)
+                outputs = render_renditions(img, self.renditions)
+                del img
+            except Exception:
+                job.data = None
+                self.budget.release(job.nbytes)
+                if self._cancelled.is_set():
+                    self._skip(job)
+                else:
+                    self._fail(job)
+                continue
+            self.telemetry.add_busy("compose", time.perf_counter() - t0)
+            job.pending = len(outputs)
+            for rend, scaled in outputs:
+                self._encode_q.put((job, rend, scaled))
+
+    def _job_layer(self, job: _Job, width: int, height: int):
+        """该图使用的水印图层：文字含令牌时按本图的取值重新拼出"""
+        if not job.templated or self.layer is None:
+            return self.layer
+        return bind_tokens(self.layer, job.settings, token_context(job.path, job.index, width, height))
+
+    def _stream_job(self, job: _Job) -> None:
+        """流式导出一张大图：第一个规格按条带写出，其余同格式规格复制该文件"""
+        results = []
+        first: Path | None = None
+        t0 = time.perf_counter()
+        for rend in self.renditions:
+            out_path = output_path_for(self.out_dir, job.path, rend)
+            ok = False
+            if not self._cancelled.is_set():
+                try:
+                    out_path.parent.mkdir(parents=True, exist_ok=True)
+                    if first is None:
+                        ok = stream_watermark(job.path, out_path, self._job_layer(job, *job.size), job.settings, rend,
+                                              cancelled=self._cancelled.is_set, cache=not job.templated)
+                        if ok:
+                            first = out_path
+                    else:
+                        ok = copy_output(first, out_path)
+                except OSError:
+                    ok = False
+            results.append((rend, out_path, ok))
+        # 流式任务的读取、合成、编码与写入交织在一起，整体计入合成阶段
+        self.telemetry.add_busy("compose", time.perf_counter() - t0)
+        self._count_stream_bytes(job.path, [p for _, p, ok in results if ok])
+        self.budget.release(job.nbytes)
+        self._complete(job, results)
+
+    def _count_stream_bytes(self, src: str, outputs: List[Path]) -> None:
+        try:
+            self.telemetry.add_read(os.path.getsize(src), 0.0)
+            self.telemetry.add_written(sum(p.stat().st_size for p in outputs), 0.0)
+        except OSError:
+            pass
+
+    def _encode_stage(self) -> None:
+        while True:
+            item = self._encode_q.get()
+            if item is _STOP:
+                return
+            job, rend, scaled = item
+            t0 = time.perf_counter()
+            data = None if self._cancelled.is_set() else encode_qimage(scaled, rend.get("format", "PNG"), rend)
+            del scaled
+            self.telemetry.add_busy("encode", time.perf_counter() - t0)
+            with self._lock:
+                job.pending -= 1
+                last = job.pending == 0
+            if last:
+                # 该图所有规格都已编码，像素缓冲可以释放
+                self.budget.release(job.nbytes)
+            self._write_q.put((job, rend, data))
+
+    def _write_stage(self) -> None:
+        while True:
+            item = self._write_q.get()
+            if item is _STOP:
+                return
+            job, rend, data = item
+            out_path = output_path_for(self.out_dir, job.path, rend)
+            ok = False
+            if data is not None and not self._cancelled.is_set():
+                t0 = time.perf_counter()
+                try:
+                    out_path.parent.mkdir(parents=True, exist_ok=True)
+                    ok = write_bytes_atomic(out_path, data)
+                except OSError:
+                    ok = False
+                self.telemetry.add_written(len(data) if ok else 0, time.perf_counter() - t0)
+            job.results.append((rend, out_path, ok))
+            if len(job.results) == len(self.renditions):
+                self._complete(job, job.results)
+
+    def _complete(self, job: _Job, results) -> None:
+        """记录一张图的结果，并把输出链接或复制到内容相同的其他源路径名下"""
+        self._finish(job.path, results, job.t0)
+        for alias in job.aliases:
+            alias_results = []
+            for rend, out_path, ok in results:
+                alias_out = output_path_for(self.out_dir, alias, rend)
+                if ok and not self._cancelled.is_set():
+                    try:
+                        alias_out.parent.mkdir(parents=True, exist_ok=True)
+                        ok = link_or_copy(out_path, alias_out)
+                    except OSError:
+                        ok = False
+                else:
+                    ok = False
+                alias_results.append((rend, alias_out, ok))
+            self._finish(alias, alias_results)
+
+    def _skip(self, job: _Job) -> None:
+        with self._lock:
+            self.done_count += 1 + len(job.aliases)
+            self.skipped_count += 1 + len(job.aliases)
+
+    def _fail(self, job: _Job) -> None:
+        for path in [job.path] + job.aliases:
+            self._finish_failed(Path(path).name)
+
+    def _finish_failed(self, name: str) -> None:
+        with self._lock:
+            self.done_count += 1
+            self.fail_items.append(name)
+
+    def _finish(self, path: str, results, t0: float = 0.0) -> None:
+        name = Path(path).name
+        if t0:
+            self.telemetry.add_file(name, time.perf_counter() - t0)
+        with self._lock:
+            self.done_count += 1
+            if self._cancelled.is_set() and not any(ok for _, _, ok in results):
+                self.skipped_count += 1
+                return
+            for rend, out_path, ok in results:
+                if ok:
+                    self.ok_count += 1
+                    self.written.append((path, str(out_path)))
+                elif len(self.renditions) > 1:
+                    self.fail_items.append(f"{name}（{rend.get('name', '')}）")
+                else:
+                    self.fail_items.append(name)
+
+
+def run_with_progress(exporter: BatchExporter, on_tick: Callable[[int, int], bool]) -> None:
+    """在调用线程轮询进度；on_tick(done, total) 返回 False 时取消"""
+    exporter.start()
+    while not exporter.wait(0.05):
+        exporter.telemetry.sample_rss()
+        if not on_tick(exporter.done_count, exporter.total):
+            exporter.cancel()
+    exporter.telemetry.sample_rss()
+    on_tick(exporter.done_count, exporter.total)
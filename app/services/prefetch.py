@@ -0,0 +1,76 @@
+from __future__ import annotations
+import threading
+from typing import Iterable, List
+
+from PySide6.QtGui import QImage
+
+from .image_cache import DecodedImageCache, file_stamp
+
+
+class ImagePrefetcher:
+    """后台预解码预览图片
+
+    预览切换图片时，主窗口把相邻图片（上一张、下一张及滚动方向上的下一张）交给
+    prefetch()；工作线程按顺序解码为 QImage 并写入共享的 DecodedImageCache。
+    load() 优先命中缓存，正在解码中的图片会等待其完成，避免同一张图被重复解码。
+    QImage 可在非 GUI 线程中使用，转换为 QPixmap 仍在主线程完成。
+    """
+
+    def __init__(self, cache: DecodedImageCache | None = None) -> None:
+        self.cache = cache if cache is not None else DecodedImageCache()
+        self._cond = threading.Condition()
+        self._wanted: List[str] = []
+        self._decoding: str | None = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="preview-prefetch", daemon=True)
+        self._thread.start()
+
+    def prefetch(self, paths: Iterable[str]) -> None:
+        """替换待预取列表（按优先级排序），已缓存的路径直接跳过"""
+        wanted = []
+        for p in paths:
+            if p and p not in wanted and p != self._decoding and not self.cache.contains(p):
+                wanted.append(p)
+        with self._cond:
+            self._wanted = wanted
+            self._cond.notify_all()
+
+    def load(self, path: str) -> QImage | None:
+        """取得解码后的图片：命中缓存直接返回，否则在调用线程同步解码并写入缓存"""
+        with self._cond:
+            if path in self._wanted:
+                self._wanted.remove(path)
+            while self._decoding == path and not self._closed:
+                self._cond.wait()
+        img = self.cache.get(path)
+        if img is not None:
+            return img
+        stamp = file_stamp(path)
+        img = QImage(path)
+        if img.isNull():
+            return None
+        self.cache.put(path, img, stamp)
+        return img
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._wanted = []
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._wanted:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                path = self._wanted.pop(0)
+                self._decoding = path
+            stamp = file_stamp(path)
+            img = QImage(path)
+            if not img.isNull():
+                self.cache.put(path, img, stamp)
+            with self._cond:
+                self._decoding = None
+                self._cond.notify_all()
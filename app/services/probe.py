@@ -0,0 +1,294 @@
+from __future__ import annotations
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, List, Set, Tuple
+
+from PIL import Image
+from PySide6.QtGui import QImage, QImageReader
+
+from .image_cache import file_stamp
+
+
+# QImageReader.transformation() 的标志值 → EXIF Orientation（1..8）
+_TRANSFORM_TO_EXIF = {0: 1, 1: 2, 3: 3, 2: 4, 6: 5, 4: 6, 5: 7, 7: 8}
+_EXIF_ORIENTATION = 0x0112
+
+# 头信息中的像素格式 → 颜色模式（与 Pillow 的模式名保持一致，16 位通道另加后缀）
+_QT_MODES = {
+    QImage.Format_Mono: "1",
+    QImage.Format_MonoLSB: "1",
+    QImage.Format_Indexed8: "P",
+    QImage.Format_Grayscale8: "L",
+    QImage.Format_Grayscale16: "L;16",
+    QImage.Format_RGB32: "RGB",
+    QImage.Format_RGB888: "RGB",
+    QImage.Format_BGR888: "RGB",
+    QImage.Format_RGBX8888: "RGB",
+    QImage.Format_RGBX64: "RGB;16",
+    QImage.Format_ARGB32: "RGBA",
+    QImage.Format_ARGB32_Premultiplied: "RGBA",
+    QImage.Format_RGBA8888: "RGBA",
+    QImage.Format_RGBA8888_Premultiplied: "RGBA",
+    QImage.Format_RGBA64: "RGBA;16",
+    QImage.Format_RGBA64_Premultiplied: "RGBA;16",
+}
+_PIL_MODES = {"I;16": "L;16", "I;16B": "L;16", "I;16L": "L;16", "LA": "RGBA", "PA": "P", "RGBX": "RGB"}
+
+
+class ImageInfo:
+    """只读文件头得到的图片元数据：尺寸、格式、EXIF 方向、颜色模式与文件大小
+
+    width/height 为文件中存储的像素尺寸（未按 EXIF 方向旋转），
+    display_size 为按方向旋转后的显示尺寸。
+    """
+
+    __slots__ = ("path", "width", "height", "format", "orientation", "mode", "file_size", "mtime_ns")
+
+    def __init__(self, path: str, width: int, height: int, format: str, orientation: int = 1,
+                 mode: str = "", file_size: int = 0, mtime_ns: int = 0) -> None:
+        self.path = path
+        self.width = int(width)
+        self.height = int(height)
+        self.format = format
+        self.orientation = int(orientation) if 1 <= int(orientation) <= 8 else 1
+        self.mode = mode
+        self.file_size = int(file_size)
+        self.mtime_ns = int(mtime_ns)
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+    @property
+    def display_size(self) -> Tuple[int, int]:
+        # 方向 5..8 含 90° 旋转，宽高互换
+        if self.orientation >= 5:
+            return self.height, self.width
+        return self.width, self.height
+
+    @property
+    def shape(self) -> str:
+        """按显示尺寸判断横图/竖图/方图"""
+        w, h = self.display_size
+        if w > h:
+            return "landscape"
+        if h > w:
+            return "portrait"
+        return "square"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ImageInfo":
+        return cls(**{k: data[k] for k in cls.__slots__ if k in data})
+
+    def __repr__(self) -> str:
+        return f"ImageInfo({self.path!r}, {self.width}x{self.height}, {self.format}, {self.mode}, o={self.orientation})"
+
+
+def _probe_qt(path: str, stamp: Tuple[int, int]) -> ImageInfo | None:
+    reader = QImageReader(path)
+    size = reader.size()
+    if not size.isValid():
+        return None
+    mode = _QT_MODES.get(reader.imageFormat())
+    if mode is None:
+        # 头信息未给出像素格式（如部分 TIFF/CMYK JPEG），交给 Pillow
+        return None
+    orientation = _TRANSFORM_TO_EXIF.get(reader.transformation().value, 1)
+    fmt = bytes(reader.format()).decode("ascii", "ignore").upper()
+    return ImageInfo(path, size.width(), size.height(), fmt, orientation, mode, stamp[1], stamp[0])
+
+
+def _probe_pil(path: str, stamp: Tuple[int, int]) -> ImageInfo | None:
+    # Image.open 只解析文件头，像素在 load() 时才解码
+    try:
+        with Image.open(path) as im:
+            w, h = im.size
+            fmt = (im.format or Path(path).suffix.lstrip(".")).upper()
+            mode = _PIL_MODES.get(im.mode, im.mode)
+            try:
+                orientation = int(im.getexif().get(_EXIF_ORIENTATION, 1))
+            except Exception:
+                orientation = 1
+    except Exception:
+        return None
+    return ImageInfo(path, w, h, fmt, orientation, mode, stamp[1], stamp[0])
+
+
+def probe_image(path: str) -> ImageInfo | None:
+    """只读文件头获取元数据，不解码像素；无法识别返回 None
+
+    优先用 QImageReader（与预览、导出的解码器一致），头信息不完整时改用 Pillow。
+    """
+    stamp = file_stamp(path)
+    if stamp is None:
+        return None
+    return _probe_qt(path, stamp) or _probe_pil(path, stamp)
+
+
+# sorted_paths 支持的排序键
+SORT_KEYS: Dict[str, Callable[[str, ImageInfo | None], Any]] = {
+    "name": lambda p, info: (Path(p).name.lower(), p),
+    "file_size": lambda p, info: (info.file_size if info else -1, p),
+    "pixels": lambda p, info: (info.pixels if info else -1, p),
+    "format": lambda p, info: (info.format if info else "", Path(p).name.lower()),
+    "mtime": lambda p, info: (info.mtime_ns if info else -1, p),
+}
+
+
+class MetadataIndex:
+    """导入图片的元数据表（内存中，线程安全）
+
+    submit() 交给后台线程逐个探测文件头；get() 只查表，info()/dimensions() 在
+    未命中或文件已修改时同步探测。按格式、颜色模式与横竖方向维护二级索引，
+    导出调度、列表排序与筛选都只读这张表，不接触像素。
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._queue: Deque[str] = deque()
+        self._busy = False
+        self._closed = False
+        self._rows: Dict[str, ImageInfo] = {}
+        self._by_format: Dict[str, Set[str]] = {}
+        self._by_mode: Dict[str, Set[str]] = {}
+        self._by_shape: Dict[str, Set[str]] = {}
+        self._thread = threading.Thread(target=self._run, name="probe", daemon=True)
+        self._thread.start()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._rows)
+
+    def submit(self, paths: Iterable[str]) -> None:
+        with self._cond:
+            self._queue.extend(p for p in paths if p not in self._rows)
+            self._cond.notify_all()
+
+    def pending(self) -> bool:
+        with self._cond:
+            return bool(self._queue) or self._busy
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def get(self, path: str) -> ImageInfo | None:
+        """只查表，不访问文件"""
+        with self._cond:
+            return self._rows.get(path)
+
+    def info(self, path: str) -> ImageInfo | None:
+        """查表；未命中或文件的 mtime/大小已变化时同步探测文件头"""
+        stamp = file_stamp(path)
+        if stamp is None:
+            return None
+        with self._cond:
+            row = self._rows.get(path)
+        if row is not None and (row.mtime_ns, row.file_size) == stamp:
+            return row
+        row = probe_image(path)
+        if row is not None:
+            self.put(row)
+        return row
+
+    def dimensions(self, path: str) -> Tuple[int, int]:
+        """存储尺寸 (宽, 高)；无法识别返回 (0, 0)"""
+        row = self.info(path)
+        return (row.width, row.height) if row is not None else (0, 0)
+
+    def put(self, row: ImageInfo) -> None:
+        with self._cond:
+            self._drop(row.path)
+            self._rows[row.path] = row
+            self._by_format.setdefault(row.format, set()).add(row.path)
+            self._by_mode.setdefault(row.mode, set()).add(row.path)
+            self._by_shape.setdefault(row.shape, set()).add(row.path)
+
+    def forget(self, paths: Iterable[str]) -> None:
+        gone = set(paths)
+        with self._cond:
+            for p in gone:
+                self._drop(p)
+            self._queue = deque(p for p in self._queue if p not in gone)
+
+    def clear(self) -> None:
+        with self._cond:
+            self._queue.clear()
+            self._rows.clear()
+            self._by_format.clear()
+            self._by_mode.clear()
+            self._by_shape.clear()
+
+    def ensure(self, paths: Iterable[str]) -> None:
+        """同步补齐尚未探测的路径（排序、筛选前调用）"""
+        for p in paths:
+            if self.get(p) is None:
+                self.info(p)
+
+    def sorted_paths(self, paths: Iterable[str], key: str = "name", reverse: bool = False) -> List[str]:
+        """按元数据排序；无法识别的文件排在最前（reverse 时最后）"""
+        fn = SORT_KEYS[key]
+        with self._cond:
+            rows = self._rows
+            return sorted(paths, key=lambda p: fn(p, rows.get(p)), reverse=reverse)
+
+    def filter(self, paths: Iterable[str] | None = None, *, formats: Iterable[str] | None = None,
+               modes: Iterable[str] | None = None, shape: str | None = None,
+               min_pixels: int = 0, max_pixels: int | None = None) -> List[str]:
+        """按格式、颜色模式、横竖方向与像素数筛选；paths 为 None 时在整张表中筛选
+
+        格式/模式/方向先用二级索引取交集，再逐行比较像素数。返回顺序与 paths 一致。
+        """
+        with self._cond:
+            candidates: Set[str] | None = None
+            for index, values in ((self._by_format, formats), (self._by_mode, modes),
+                                  (self._by_shape, [shape] if shape else None)):
+                if values is None:
+                    continue
+                hit: Set[str] = set()
+                for v in values:
+                    hit |= index.get(v.upper() if index is self._by_format else v, set())
+                candidates = hit if candidates is None else candidates & hit
+            order = list(paths) if paths is not None else list(self._rows)
+            out = []
+            for p in order:
+                row = self._rows.get(p)
+                if row is None or (candidates is not None and p not in candidates):
+                    continue
+                if row.pixels < min_pixels or (max_pixels is not None and row.pixels > max_pixels):
+                    continue
+                out.append(p)
+            return out
+
+    def _drop(self, path: str) -> None:
+        row = self._rows.pop(path, None)
+        if row is None:
+            return
+        for index, value in ((self._by_format, row.format), (self._by_mode, row.mode), (self._by_shape, row.shape)):
+            bucket = index.get(value)
+            if bucket is not None:
+                bucket.discard(path)
+                if not bucket:
+                    del index[value]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._queue:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                path = self._queue.popleft()
+                self._busy = True
+            try:
+                if self.get(path) is None:
+                    self.info(path)
+            finally:
+                with self._cond:
+                    self._busy = False
@@ -0,0 +1,235 @@
+from __future__ import annotations
+import math
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from PySide6.QtCore import QMarginsF, QRect, QSize, Qt
+from PySide6.QtGui import QColor, QFont, QFontMetrics, QImage, QPageLayout, QPageSize, QPainter, QPdfWriter, QPen
+
+from .compositor import LayerStack, bind_tokens
+from .thumbnails import ThumbnailCache, ThumbnailOverlays
+from .tokens import stack_templated, token_context
+
+
+PAGE_SIZES = {
+    "A4": QPageSize.PageSizeId.A4,
+    "A3": QPageSize.PageSizeId.A3,
+    "Letter": QPageSize.PageSizeId.Letter,
+}
+
+# 版面尺寸（毫米）：页边距、格子间距、页眉高度
+_MARGIN_MM = 10.0
+_GAP_MM = 4.0
+_HEADER_MM = 8.0
+# 文字字号（磅）
+_CAPTION_PT = 7.0
+_HEADER_PT = 9.0
+
+
+def _mm(mm: float, dpi: int) -> int:
+    return int(round(mm / 25.4 * dpi))
+
+
+def _pt(pt: float, dpi: int) -> int:
+    return max(1, int(round(pt / 72.0 * dpi)))
+
+
+class ProofSheet:
+    """校样版式：每页 columns×rows 个格子，格子内为贴好水印的缩略图与文件名
+
+    坐标以页面像素计（纸张尺寸 × dpi），PNG 与 PDF 共用同一套版式。
+    """
+
+    __slots__ = ("columns", "rows", "dpi", "page", "landscape", "title")
+
+    def __init__(self, columns: int = 4, rows: int = 5, dpi: int = 150, page: str = "A4",
+                 landscape: bool = False, title: str = "") -> None:
+        self.columns = max(1, int(columns))
+        self.rows = max(1, int(rows))
+        self.dpi = max(36, int(dpi))
+        self.page = page if page in PAGE_SIZES else "A4"
+        self.landscape = bool(landscape)
+        self.title = title
+
+    @property
+    def per_page(self) -> int:
+        return self.columns * self.rows
+
+    def page_count(self, count: int) -> int:
+        return max(1, math.ceil(count / self.per_page)) if count > 0 else 0
+
+    def page_size(self) -> QSize:
+        size = QPageSize(PAGE_SIZES[self.page]).sizePixels(self.dpi)
+        if self.landscape:
+            size = size.transposed()
+        return size
+
+    def caption_height(self) -> int:
+        return _pt(_CAPTION_PT, self.dpi) * 2
+
+    def cells(self) -> List[Tuple[QRect, QRect]]:
+        """每页各格子的 (缩略图区域, 文件名区域)，按行优先排列"""
+        size = self.page_size()
+        margin = _mm(_MARGIN_MM, self.dpi)
+        gap = _mm(_GAP_MM, self.dpi)
+        top = margin + _mm(_HEADER_MM, self.dpi)
+        cell_w = (size.width() - 2 * margin - gap * (self.columns - 1)) // self.columns
+        cell_h = (size.height() - top - margin - gap * (self.rows - 1)) // self.rows
+        caption = self.caption_height()
+        out = []
+        for r in range(self.rows):
+            for c in range(self.columns):
+                x = margin + c * (cell_w + gap)
+                y = top + r * (cell_h + gap)
+                out.append((QRect(x, y, cell_w, max(1, cell_h - caption)), QRect(x, y + cell_h - caption, cell_w, caption)))
+        return out
+
+    def thumb_edge(self) -> int:
+        """缩略图缓存所需边长：不小于格子中缩略图区域的长边"""
+        image_rect = self.cells()[0][0]
+        return max(image_rect.width(), image_rect.height())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def proof_page_paths(out_path: str, pages: int) -> List[str]:
+    """PNG 校样的各页文件名：单页即 out_path，多页为 名称_001.png、名称_002.png …"""
+    p = Path(out_path)
+    if pages <= 1:
+        return [str(p)]
+    return [str(p.with_name(f"{p.stem}_{n:03d}{p.suffix or '.png'}")) for n in range(1, pages + 1)]
+
+
+def _fit(thumb: QImage, rect: QRect) -> QImage:
+    if thumb.width() <= rect.width() and thumb.height() <= rect.height():
+        return thumb
+    return thumb.scaled(rect.size(), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+
+
+class _Writer:
+    """逐页输出：PDF 为同一文件中的新页，PNG 为每页一个文件"""
+
+    def __init__(self, out_path: str, sheet: ProofSheet, pages: int) -> None:
+        self.sheet = sheet
+        self.pdf = Path(out_path).suffix.lower() == ".pdf"
+        self.paths = [out_path] if self.pdf else proof_page_paths(out_path, pages)
+        self.page_no = 0
+        self.image: QImage | None = None
+        self.painter: QPainter | None = None
+        self._writer: QPdfWriter | None = None
+        if self.pdf:
+            self._writer = QPdfWriter(out_path)
+            self._writer.setResolution(sheet.dpi)
+            self._writer.setPageLayout(QPageLayout(
+                QPageSize(PAGE_SIZES[sheet.page]),
+                QPageLayout.Orientation.Landscape if sheet.landscape else QPageLayout.Orientation.Portrait,
+                QMarginsF(0, 0, 0, 0),
+            ))
+            self._writer.setTitle(sheet.title or Path(out_path).stem)
+
+    def begin_page(self) -> QPainter:
+        self.page_no += 1
+        if self.pdf:
+            if self.painter is None:
+                self.painter = QPainter(self._writer)
+            else:
+                self._writer.newPage()
+        else:
+            # PNG 每页只占一张页面大小的图像，写出后即释放
+            self.image = QImage(self.sheet.page_size(), QImage.Format_RGB32)
+            self.image.fill(Qt.GlobalColor.white)
+            self.painter = QPainter(self.image)
+        self.painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+        self.painter.setRenderHint(QPainter.RenderHint.TextAntialiasing, True)
+        self.painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, True)
+        return self.painter
+
+    def end_page(self) -> bool:
+        if self.pdf:
+            return True
+        self.painter.end()
+        self.painter = None
+        ok = self.image.save(self.paths[self.page_no - 1], "PNG")
+        self.image = None
+        if not ok:
+            self.page_no -= 1
+        return ok
+
+    def close(self) -> List[str]:
+        if self.pdf and self.painter is not None:
+            self.painter.end()
+            self.painter = None
+        return self.paths[:self.page_no] if not self.pdf else (self.paths if self.page_no else [])
+
+
+def write_proof_sheets(entries: Sequence[Tuple[str, Any]], out_path: str,
+                       layer: "QImage | LayerStack | None", sheet: ProofSheet,
+                       dimensions: Callable[[str], Tuple[int, int]], thumbs: ThumbnailCache | None = None,
+                       progress: Callable[[int, int], bool] | None = None) -> List[str]:
+    """把 (源路径, 水印规格) 列表排成校样，逐页写出 PNG 或 PDF（按 out_path 扩展名），返回写出的文件
+
+    每格的图像来自缩略图缓存（按格子大小生成，JPEG 在解码阶段即缩小），水印按原图
+    尺寸（dimensions 只读文件头）计算摆放后缩小叠加，与导出位置一致；原图从不整图
+    解码。任一时刻只持有当前页与当前格子的像素，内存与图片数量无关。
+    每格之后调用 progress(done, total)，返回 False 时在当前页写完后停止。
+    """
+    total = len(entries)
+    pages = sheet.page_count(total)
+    if pages == 0:
+        return []
+    if thumbs is None or thumbs.edge < sheet.thumb_edge():
+        thumbs = ThumbnailCache(sheet.thumb_edge())
+    overlays = ThumbnailOverlays(limit=32)
+    cells = sheet.cells()
+    dpi = sheet.dpi
+    caption_font = QFont()
+    caption_font.setPixelSize(_pt(_CAPTION_PT, dpi))
+    header_font = QFont()
+    header_font.setPixelSize(_pt(_HEADER_PT, dpi))
+    caption_metrics = QFontMetrics(caption_font)
+    margin = _mm(_MARGIN_MM, dpi)
+    page_w = sheet.page_size().width()
+    writer = _Writer(out_path, sheet, pages)
+    done = 0
+    stop = False
+    try:
+        for page in range(pages):
+            painter = writer.begin_page()
+            painter.setFont(header_font)
+            painter.setPen(QColor(60, 60, 60))
+            header = QRect(margin, margin, page_w - 2 * margin, _mm(_HEADER_MM, dpi))
+            if sheet.title:
+                painter.drawText(header, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, sheet.title)
+            painter.drawText(header, Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignTop, f"{page + 1} / {pages}")
+            painter.setFont(caption_font)
+            for (image_rect, caption_rect), (path, spec) in zip(cells, entries[page * sheet.per_page:(page + 1) * sheet.per_page]):
+                done += 1
+                thumb = thumbs.get(path)
+                if thumb is None:
+                    painter.fillRect(image_rect, QColor(235, 235, 235))
+                    painter.setPen(QColor(150, 150, 150))
+                    painter.drawText(image_rect, Qt.AlignmentFlag.AlignCenter, "无法读取")
+                else:
+                    thumb = _fit(thumb, image_rect)
+                    width, height = dimensions(path)
+                    cell_layer = layer
+                    per_image = stack_templated(spec)
+                    if per_image and cell_layer is not None:
+                        cell_layer = bind_tokens(cell_layer, spec, token_context(path, done, width, height))
+                    thumb = overlays.compose(thumb, width, height, cell_layer, spec, cache=not per_image)
+                    x = image_rect.x() + (image_rect.width() - thumb.width()) // 2
+                    y = image_rect.y() + (image_rect.height() - thumb.height()) // 2
+                    painter.drawImage(x, y, thumb)
+                    painter.setPen(QPen(QColor(200, 200, 200), 1))
+                    painter.drawRect(QRect(x, y, thumb.width(), thumb.height()).adjusted(0, 0, -1, -1))
+                painter.setPen(QColor(40, 40, 40))
+                name = caption_metrics.elidedText(Path(path).name, Qt.TextElideMode.ElideMiddle, caption_rect.width())
+                painter.drawText(caption_rect, Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignVCenter, name)
+                if progress is not None and not stop and not progress(done, total):
+                    stop = True
+            if not writer.end_page() or stop:
+                break
+    finally:
+        written = writer.close()
+    return written
@@ -0,0 +1,122 @@
+from __future__ import annotations
+import sys
+from typing import Dict
+
+import numpy as np
+from PySide6.QtGui import QImage
+
+
+# 格式 → (每像素通道数, 通道 dtype)；只支持按字节/字寻址的常用格式
+_LAYOUTS: Dict[QImage.Format, tuple] = {
+    QImage.Format_ARGB32: (4, np.uint8),
+    QImage.Format_ARGB32_Premultiplied: (4, np.uint8),
+    QImage.Format_RGB32: (4, np.uint8),
+    QImage.Format_RGBA8888: (4, np.uint8),
+    QImage.Format_RGBA8888_Premultiplied: (4, np.uint8),
+    QImage.Format_RGBX8888: (4, np.uint8),
+    QImage.Format_RGB888: (3, np.uint8),
+    QImage.Format_BGR888: (3, np.uint8),
+    QImage.Format_Grayscale8: (1, np.uint8),
+    QImage.Format_Alpha8: (1, np.uint8),
+    QImage.Format_Grayscale16: (1, np.uint16),
+    QImage.Format_RGBA64: (4, np.uint16),
+    QImage.Format_RGBA64_Premultiplied: (4, np.uint16),
+}
+
+# ARGB32/RGB32 以 32 位整数存储像素，内存中的字节顺序取决于字节序：
+# 小端为 B, G, R, A；大端为 A, R, G, B
+if sys.byteorder == "little":
+    ARGB32_CHANNELS = {"b": 0, "g": 1, "r": 2, "a": 3}
+else:
+    ARGB32_CHANNELS = {"a": 0, "r": 1, "g": 2, "b": 3}
+
+
+class QImageArray(np.ndarray):
+    """引用 QImage 像素缓冲的 ndarray
+
+    持有源 QImage 的引用，保证数组（及其切片）存活期间缓冲不被释放。
+    """
+
+    def __array_finalize__(self, obj) -> None:
+        self._qimage = getattr(obj, "_qimage", None)
+
+
+def supported(img: QImage) -> bool:
+    return img.format() in _LAYOUTS
+
+
+def qimage_view(img: QImage, writable: bool = False) -> np.ndarray:
+    """以 ndarray 访问 QImage 像素，不复制
+
+    返回形状为 (h, w, c) 的数组（单通道格式为 (h, w)），行跨度取 bytesPerLine，
+    行尾的对齐填充不会出现在数组中。writable=True 时通过 bits() 取得可写缓冲
+    （若图像与其他 QImage 共享数据，Qt 会先分离出独立副本），对数组的修改直接
+    反映到 img 上；否则返回只读视图。不支持的格式抛出 ValueError，可先
+    convertToFormat 再调用。
+    """
+    if img.isNull():
+        raise ValueError("空图像")
+    layout = _LAYOUTS.get(img.format())
+    if layout is None:
+        raise ValueError(f"不支持的图像格式: {img.format()}")
+    channels, dtype = layout
+    itemsize = np.dtype(dtype).itemsize
+    h, w, bpl = img.height(), img.width(), img.bytesPerLine()
+    buf = img.bits() if writable else img.constBits()
+    if channels == 1:
+        shape = (h, w)
+        strides = (bpl, itemsize)
+    else:
+        shape = (h, w, channels)
+        strides = (bpl, itemsize * channels, itemsize)
+    arr = np.ndarray(shape, dtype=dtype, buffer=buf, strides=strides).view(QImageArray)
+    arr._qimage = img
+    if not writable:
+        arr.flags.writeable = False
+    return arr
+
+
+def alpha_view(img: QImage) -> np.ndarray:
+    """ARGB32 系列图像 alpha 通道的只读视图 (h, w)，不复制"""
+    if img.format() not in (QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied):
+        raise ValueError(f"需要 ARGB32 格式: {img.format()}")
+    return qimage_view(img)[:, :, ARGB32_CHANNELS["a"]]
+
+
+def array_to_qimage(arr: np.ndarray, fmt: QImage.Format | None = None) -> QImage:
+    """把 ndarray 包装为 QImage，不复制
+
+    QImage 直接引用数组内存，并持有数组的引用；在 QImage 上绘制会写入数组。
+    像素在行内必须连续（行跨度可大于行宽，例如来自 qimage_view 的切片）；
+    不满足时抛出 ValueError，调用方可先 np.ascontiguousarray。
+    未指定 fmt 时：(h, w) uint8 → Grayscale8，(h, w) uint16 → Grayscale16，
+    (h, w, 3) → RGB888，(h, w, 4) → ARGB32_Premultiplied（字节序见 ARGB32_CHANNELS）。
+    """
+    if arr.ndim not in (2, 3) or (arr.ndim == 3 and arr.shape[2] not in (3, 4)):
+        raise ValueError(f"不支持的数组形状: {arr.shape}")
+    if fmt is None:
+        if arr.ndim == 2:
+            fmt = QImage.Format_Grayscale16 if arr.dtype == np.uint16 else QImage.Format_Grayscale8
+        elif arr.shape[2] == 3:
+            fmt = QImage.Format_RGB888
+        else:
+            fmt = QImage.Format_ARGB32_Premultiplied
+    layout = _LAYOUTS.get(fmt)
+    if layout is None:
+        raise ValueError(f"不支持的图像格式: {fmt}")
+    channels, dtype = layout
+    if arr.dtype != dtype or (arr.shape[2] if arr.ndim == 3 else 1) != channels:
+        raise ValueError(f"数组 {arr.dtype}{arr.shape} 与格式 {fmt} 不匹配")
+    h, w = arr.shape[0], arr.shape[1]
+    pixel = arr.itemsize * channels
+    row_ok = arr.ndim == 2 or arr.strides[2] == arr.itemsize
+    if not row_ok or arr.strides[1] != pixel or arr.strides[0] < w * pixel:
+        raise ValueError("数组行内像素不连续，无法零拷贝包装")
+    if not arr.flags.writeable:
+        raise ValueError("只读数组无法包装为 QImage")
+    # 从第一个像素起、覆盖到最后一行末尾的缓冲区
+    span = arr.strides[0] * (h - 1) + w * pixel
+    raw = arr if arr.itemsize == 1 else arr.view(np.uint8)
+    base = np.lib.stride_tricks.as_strided(raw, shape=(span,), strides=(1,))
+    # PySide 会在 QImage 存活期间持有缓冲对象（memoryview → ndarray）
+    return QImage(memoryview(base), w, h, arr.strides[0], fmt)
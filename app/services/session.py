@@ -0,0 +1,215 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from app.store import ensure_dirs, get_session_index_file, get_session_journal_file
+from .fileio import write_bytes_atomic
+from .probe import ImageInfo
+
+
+# 日志记录数超过快照记录数的倍数时压缩
+_COMPACT_RATIO = 4
+_COMPACT_MIN_RECORDS = 2000
+
+
+class SessionState:
+    """会话状态：图片列表、每图自定义坐标、导出设置与当前图片"""
+
+    def __init__(self) -> None:
+        self.paths: List[str] = []
+        self.custom_pos: Dict[str, Dict[str, Any]] = {}
+        self.export_settings: Dict[str, Any] | None = None
+        self.current: str | None = None
+
+    def apply(self, rec: Dict[str, Any]) -> None:
+        op = rec.get("op")
+        if op == "add":
+            known = set(self.paths)
+            for p in rec.get("paths", []):
+                if p not in known:
+                    known.add(p)
+                    self.paths.append(p)
+        elif op == "remove":
+            path = rec.get("path")
+            if path in self.paths:
+                self.paths.remove(path)
+            self.custom_pos.pop(path, None)
+        elif op == "clear":
+            self.paths = []
+            self.custom_pos = {}
+            self.current = None
+        elif op == "pos":
+            self.custom_pos[rec.get("path")] = dict(rec.get("pos") or {})
+        elif op == "pos_many":
+            for path, pos in (rec.get("positions") or {}).items():
+                self.custom_pos[path] = dict(pos or {})
+        elif op == "pos_all":
+            pos = dict(rec.get("pos") or {})
+            self.custom_pos = {p: dict(pos) for p in self.paths}
+        elif op == "pos_clear":
+            self.custom_pos = {}
+        elif op == "export":
+            self.export_settings = rec.get("settings")
+        elif op == "current":
+            self.current = rec.get("path")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """把状态压缩为最少的记录"""
+        records: List[Dict[str, Any]] = []
+        if self.paths:
+            records.append({"op": "add", "paths": list(self.paths)})
+        values = list(self.custom_pos.values())
+        if self.paths and len(self.custom_pos) == len(self.paths) and all(v == values[0] for v in values):
+            # 常见情形：拖拽后坐标同步到全部图片，只需一条记录
+            records.append({"op": "pos_all", "pos": values[0]})
+        else:
+            for path, pos in self.custom_pos.items():
+                records.append({"op": "pos", "path": path, "pos": pos})
+        if self.export_settings is not None:
+            records.append({"op": "export", "settings": self.export_settings})
+        if self.current:
+            records.append({"op": "current", "path": self.current})
+        return records
+
+
+def save_session_index(infos: Dict[str, ImageInfo], fingerprints: Dict[str, Tuple[Tuple[int, int], str]],
+                       path: Path | None = None) -> bool:
+    """保存会话中图片的文件头元数据与抽样指纹，下次启动恢复列表时直接预填，不再探测与读取
+
+    与会话日志分开保存：日志只记录用户操作，这里是可随时丢弃的派生数据。
+    """
+    path = Path(path) if path is not None else get_session_index_file()
+    data = {
+        "infos": [info.to_dict() for info in infos.values()],
+        "fingerprints": {p: [stamp[0], stamp[1], key] for p, (stamp, key) in fingerprints.items()},
+    }
+    try:
+        ensure_dirs()
+    except OSError:
+        return False
+    return write_bytes_atomic(path, json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def load_session_index(path: Path | None = None
+                       ) -> Tuple[Dict[str, ImageInfo], Dict[str, Tuple[Tuple[int, int], str]]]:
+    """读取 save_session_index 保存的数据；文件缺失或损坏时返回空表"""
+    path = Path(path) if path is not None else get_session_index_file()
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        infos = {}
+        for row in data.get("infos", []):
+            info = ImageInfo.from_dict(row)
+            infos[info.path] = info
+        fingerprints = {p: ((int(m), int(s)), str(key)) for p, (m, s, key) in data.get("fingerprints", {}).items()}
+    except (OSError, ValueError, TypeError, KeyError, AttributeError):
+        return {}, {}
+    return infos, fingerprints
+
+
+def _dumps(rec: Dict[str, Any]) -> str:
+    return json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class SessionJournal:
+    """只追加的会话日志（JSON Lines）
+
+    每次变更只追加一行，不重写整个会话；启动时重放日志得到状态。
+    日志增长到快照的数倍时原子地重写为快照（compact），控制文件大小与重放时间。
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = Path(path) if path is not None else get_session_journal_file()
+        self.state = SessionState()
+        self._records = 0
+        self._fh = None
+
+    def load(self) -> SessionState:
+        state = SessionState()
+        records = 0
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # 崩溃时最后一行可能不完整，忽略
+                        continue
+                    if isinstance(rec, dict):
+                        state.apply(rec)
+                        records += 1
+        except OSError:
+            pass
+        self.state = state
+        self._records = records
+        return state
+
+    def append(self, rec: Dict[str, Any]) -> None:
+        self.state.apply(rec)
+        try:
+            if self._fh is None:
+                ensure_dirs()
+                self._fh = self.path.open("a", encoding="utf-8")
+            self._fh.write(_dumps(rec))
+            self._fh.flush()
+        except OSError:
+            return
+        self._records += 1
+        snapshot_size = len(self.state.custom_pos) + 3
+        if self._records > max(_COMPACT_MIN_RECORDS, snapshot_size * _COMPACT_RATIO):
+            self.compact()
+
+    def compact(self) -> None:
+        self.close()
+        records = self.state.snapshot()
+        data = "".join(_dumps(r) for r in records).encode("utf-8")
+        try:
+            ensure_dirs()
+        except OSError:
+            return
+        if write_bytes_atomic(self.path, data):
+            self._records = len(records)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except OSError:
+                pass
+            self._fh = None
+
+    # 便捷方法
+    def add_paths(self, paths: List[str]) -> None:
+        if paths:
+            self.append({"op": "add", "paths": list(paths)})
+
+    def remove_path(self, path: str) -> None:
+        self.append({"op": "remove", "path": path})
+
+    def clear(self) -> None:
+        self.append({"op": "clear"})
+
+    def set_pos(self, path: str, pos: Dict[str, Any]) -> None:
+        if self.state.custom_pos.get(path) != pos:
+            self.append({"op": "pos", "path": path, "pos": dict(pos)})
+
+    def set_pos_many(self, positions: Dict[str, Dict[str, Any]]) -> None:
+        """一次写入多张图的坐标，只追加一行"""
+        changed = {p: dict(pos) for p, pos in positions.items() if self.state.custom_pos.get(p) != pos}
+        if changed:
+            self.append({"op": "pos_many", "positions": changed})
+
+    def set_pos_all(self, pos: Dict[str, Any]) -> None:
+        self.append({"op": "pos_all", "pos": dict(pos)})
+
+    def clear_pos(self) -> None:
+        if self.state.custom_pos:
+            self.append({"op": "pos_clear"})
+
+    def set_export_settings(self, settings: Dict[str, Any]) -> None:
+        if self.state.export_settings != settings:
+            self.append({"op": "export", "settings": settings})
+
+    def set_current(self, path: str | None) -> None:
+        if path and self.state.current != path:
+            self.append({"op": "current", "path": path})
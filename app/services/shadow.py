@@ -0,0 +1,157 @@
+from __future__ import annotations
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+import numpy as np
+from PySide6.QtCore import QPointF, QRectF
+from PySide6.QtGui import QColor, QImage, QPainter
+from PySide6.QtWidgets import QGraphicsScene, QGraphicsTextItem
+
+from .qimage_numpy import ARGB32_CHANNELS, alpha_view, array_to_qimage
+
+
+# 模糊半径 → 高斯 sigma 的换算系数，按 QGraphicsDropShadowEffect 的实际输出拟合
+BLUR_SIGMA_PER_RADIUS = 0.24
+# 三次盒式模糊逼近高斯
+_BOX_PASSES = 3
+_CACHE_LIMIT = 32
+
+
+def _box_sizes(sigma: float, passes: int = _BOX_PASSES) -> list[int]:
+    """n 次盒式模糊逼近给定 sigma 的高斯核，返回每次的（奇数）窗口宽度"""
+    ideal = math.sqrt(12.0 * sigma * sigma / passes + 1.0)
+    lower = int(math.floor(ideal))
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    m = round((12.0 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    return [lower if i < m else upper for i in range(passes)]
+
+
+def _box_blur_axis(data: np.ndarray, size: int, axis: int) -> np.ndarray:
+    """沿一个轴做定长盒式模糊（前缀和实现，整轴向量化，边界按 0 处理）"""
+    if size <= 1:
+        return data
+    r = size // 2
+    data = np.moveaxis(data, axis, 0)
+    n = data.shape[0]
+    csum = np.zeros((n + size,) + data.shape[1:], dtype=np.float32)
+    np.cumsum(data, axis=0, dtype=np.float32, out=csum[r + 1:r + 1 + n])
+    csum[r + 1 + n:] = csum[r + n]
+    out = (csum[size:] - csum[:n]) * (1.0 / size)
+    return np.moveaxis(out, 0, axis)
+
+
+def blur_alpha(alpha: np.ndarray, radius: float) -> np.ndarray:
+    """对 alpha 通道做可分离的近似高斯模糊，输入输出均为 0..1 的 float32"""
+    sigma = float(radius) * BLUR_SIGMA_PER_RADIUS
+    if sigma <= 0.0:
+        return alpha
+    out = alpha.astype(np.float32, copy=False)
+    for size in _box_sizes(sigma):
+        out = _box_blur_axis(out, size, axis=1)
+        out = _box_blur_axis(out, size, axis=0)
+    return out
+
+
+def alpha_of(img: QImage) -> np.ndarray:
+    """读取 ARGB32(_Premultiplied) 图像的 alpha 通道为 0..1 float32 数组（拷贝）"""
+    return alpha_view(img).astype(np.float32) / 255.0
+
+
+def colorize(alpha: np.ndarray, color: QColor) -> QImage:
+    """把 alpha 遮罩着色为预乘 ARGB32 图像（直接包装数组，不再拷贝）"""
+    h, w = alpha.shape
+    a = np.clip(alpha * (color.alphaF()), 0.0, 1.0)
+    out = np.empty((h, w, 4), dtype=np.uint8)
+    out[:, :, ARGB32_CHANNELS["b"]] = np.rint(a * color.blue())
+    out[:, :, ARGB32_CHANNELS["g"]] = np.rint(a * color.green())
+    out[:, :, ARGB32_CHANNELS["r"]] = np.rint(a * color.red())
+    out[:, :, ARGB32_CHANNELS["a"]] = np.rint(a * 255.0)
+    return array_to_qimage(out, QImage.Format_ARGB32_Premultiplied)
+
+
+def shadow_key(wm: Dict[str, Any]) -> Tuple:
+    """影响阴影像素的全部设置，用作缓存键"""
+    color = wm.get("shadow_color", QColor(0, 0, 0))
+    text_color = wm.get("color", QColor(0, 0, 0))
+    stroke_color = wm.get("stroke_color", QColor(255, 255, 255))
+    return (
+        wm.get("text", ""),
+        wm.get("font_family", ""),
+        int(wm.get("font_size", 32)),
+        bool(wm.get("font_bold", False)),
+        bool(wm.get("font_italic", False)),
+        bool(wm.get("stroke_enabled", False)),
+        int(wm.get("stroke_width", 2)),
+        # 遮罩只与文字、描边颜色的 alpha 有关，与色值无关
+        text_color.alpha() if isinstance(text_color, QColor) else 255,
+        stroke_color.alpha() if isinstance(stroke_color, QColor) else 255,
+        int(wm.get("shadow_blur", 5)),
+        color.name(QColor.NameFormat.HexArgb) if isinstance(color, QColor) else "#ff000000",
+    )
+
+
+class ShadowCache:
+    """文本阴影图层缓存：键为文本、字体、描边、模糊半径与阴影颜色
+
+    阴影偏移只影响绘制位置，不参与键；拖拽水印或改变透明度都不会触发重新模糊。
+    """
+
+    def __init__(self, limit: int = _CACHE_LIMIT) -> None:
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[QImage, QPointF]]" = OrderedDict()
+
+    def get(self, wm: Dict[str, Any], make_item) -> Tuple[QImage, QPointF] | None:
+        """返回 (阴影图, 阴影图左上角相对文本项原点的位置，不含偏移)
+
+        make_item() 创建与水印相同的文本项（不带阴影），用于生成遮罩。
+        """
+        if not wm.get("text", ""):
+            return None
+        key = shadow_key(wm)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                return hit
+        result = render_shadow(make_item(), int(wm.get("shadow_blur", 5)), wm.get("shadow_color", QColor(0, 0, 0)))
+        with self._lock:
+            self._entries[key] = result
+            while len(self._entries) > self.limit:
+                self._entries.popitem(last=False)
+        return result
+
+
+def render_shadow(item: QGraphicsTextItem, blur: int, color: QColor) -> Tuple[QImage, QPointF]:
+    """用文本项的 alpha 遮罩生成模糊阴影，四周留出模糊扩散的边距"""
+    if not isinstance(color, QColor):
+        color = QColor(0, 0, 0)
+    # 遮罩取文本项自身的 alpha；整体透明度由调用方统一施加
+    item.setOpacity(1.0)
+    rect = item.boundingRect()
+    pad = int(math.ceil(blur * BLUR_SIGMA_PER_RADIUS * 3.0)) + 1
+    w = int(math.ceil(rect.width())) + pad * 2
+    h = int(math.ceil(rect.height())) + pad * 2
+    mask = QImage(w, h, QImage.Format_ARGB32_Premultiplied)
+    mask.fill(0)
+    scene = QGraphicsScene()
+    scene.addItem(item)
+    painter = QPainter(mask)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    target = QRectF(pad, pad, rect.width(), rect.height())
+    scene.render(painter, target, rect)
+    painter.end()
+    scene.removeItem(item)
+    blurred = blur_alpha(alpha_of(mask), blur)
+    return colorize(blurred, color), QPointF(rect.left() - pad, rect.top() - pad)
+
+
+_shared_cache = ShadowCache()
+
+
+def shared_shadow_cache() -> ShadowCache:
+    return _shared_cache
@@ -0,0 +1,205 @@
+from __future__ import annotations
+import hashlib
+import json
+from typing import Any, Dict, Iterator, Tuple
+
+from PySide6.QtGui import QColor
+
+
+WM_TYPES = ("text", "image")
+POSITIONS = (
+    "top_left", "top_right", "bottom_left", "bottom_right", "center",
+    "top_center", "bottom_center", "center_left", "center_right",
+    "custom", "tile",
+)
+SCALE_MODES = ("proportional", "free")
+
+# 字段 → (类型, 默认值)；默认值为 None 的字段是可选的，未设置时不出现在导出的字典中，
+# 使用方仍按原来的 .get(key, 按图计算的默认值) 取值
+_FIELDS: Dict[str, Tuple[type, Any]] = {
+    "wm_type": (str, "text"),
+    "text": (str, ""),
+    "position": (str, "bottom_right"),
+    "font_family": (str, ""),
+    "font_size": (int, 32),
+    "font_bold": (bool, False),
+    "font_italic": (bool, False),
+    "opacity": (float, 0.6),
+    "margin": (int, 20),
+    "color": (QColor, "#000000"),
+    "rotation_angle": (int, 0),
+    "tile_spacing": (int, 80),
+    "tile_stagger": (bool, True),
+    "tile_angle": (int, -30),
+    "shadow_enabled": (bool, False),
+    "shadow_offset": (int, 2),
+    "shadow_blur": (int, 5),
+    "shadow_color": (QColor, "#000000"),
+    "stroke_enabled": (bool, False),
+    "stroke_width": (int, 2),
+    "stroke_color": (QColor, "#ffffff"),
+    "image_path": (str, ""),
+    "img_opacity": (float, 0.6),
+    "img_scale_mode": (str, "proportional"),
+    "img_scale_pct": (int, 100),
+    "img_width": (int, None),
+    "img_height": (int, None),
+    "pos_x": (float, None),
+    "pos_y": (float, None),
+    "pos_x_pct": (float, None),
+    "pos_y_pct": (float, None),
+    # 叠加在本层之上的附加图层（按绘制顺序），每层是不含 layers 的 WatermarkSpec
+    "layers": (tuple, None),
+}
+
+_CHOICES = {"wm_type": WM_TYPES, "position": POSITIONS, "img_scale_mode": SCALE_MODES}
+_UNIT_RANGE = ("opacity", "img_opacity")
+_COLOR_FIELDS = tuple(k for k, (t, _) in _FIELDS.items() if t is QColor)
+
+
+def _coerce(key: str, kind: type, default: Any, value: Any) -> Any:
+    """把单个字段转换为规范类型；无法转换时回退默认值"""
+    if value is None:
+        return default
+    try:
+        if kind is tuple:
+            layers = tuple(_layer_spec(v) for v in value if isinstance(v, (dict, WatermarkSpec)))
+            return layers or default
+        if kind is QColor:
+            color = value if isinstance(value, QColor) else QColor(str(value))
+            return color.name() if color.isValid() else default
+        if kind is bool:
+            return bool(value)
+        if kind is int:
+            return int(round(float(value)))
+        if kind is float:
+            number = float(value)
+            if key in _UNIT_RANGE:
+                number = max(0.0, min(1.0, number))
+            return number
+        value = str(value)
+        choices = _CHOICES.get(key)
+        if choices is not None and value not in choices:
+            return default
+        return value
+    except (TypeError, ValueError, OverflowError):
+        return default
+
+
+def _layer_spec(value: "Dict[str, Any] | WatermarkSpec") -> "WatermarkSpec":
+    """附加图层不再嵌套图层"""
+    data = value.to_dict() if isinstance(value, WatermarkSpec) else dict(value)
+    data.pop("layers", None)
+    return WatermarkSpec(**data)
+
+
+class WatermarkSpec:
+    """不可变的水印规格
+
+    在边界（面板、模板、会话）处从设置字典校验生成一次，之后在预览、合成与
+    批量导出之间直接传递。颜色以 #rrggbb 字符串保存，可哈希、可跨进程传递；
+    get() 提供与原设置字典相同的只读访问方式（颜色字段返回 QColor）。
+    layers 为叠加在本层之上的附加图层，本身即底层；stack() 按绘制顺序返回全部图层。
+    """
+
+    __slots__ = tuple(_FIELDS) + ("_hash", "_digest")
+
+    def __init__(self, **fields: Any) -> None:
+        for key, (kind, default) in _FIELDS.items():
+            object.__setattr__(self, key, _coerce(key, kind, default, fields.get(key)))
+        object.__setattr__(self, "_hash", None)
+        object.__setattr__(self, "_digest", None)
+
+    @classmethod
+    def from_settings(cls, settings: "Dict[str, Any] | WatermarkSpec | None") -> "WatermarkSpec":
+        if isinstance(settings, WatermarkSpec):
+            return settings
+        return cls(**{k: v for k, v in (settings or {}).items() if k in _FIELDS})
+
+    def __setattr__(self, key: str, value: Any) -> None:
+        raise AttributeError("WatermarkSpec 不可修改，请使用 replace()")
+
+    def replace(self, **changes: Any) -> "WatermarkSpec":
+        data = self.to_dict()
+        data.update(changes)
+        return WatermarkSpec(**data)
+
+    def stack(self) -> Tuple["WatermarkSpec", ...]:
+        """按绘制顺序返回全部图层：底层（不含 layers）在前"""
+        if not self.layers:
+            return (self,)
+        return (self.replace(layers=None),) + self.layers
+
+    def values(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, k) for k in _FIELDS)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, WatermarkSpec):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash(self.values()))
+        return self._hash
+
+    def __repr__(self) -> str:
+        return f"WatermarkSpec({self.to_json()})"
+
+    # 只读映射接口，兼容按字典读取设置的代码
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in _FIELDS:
+            return default
+        value = getattr(self, key)
+        if value is None:
+            return default
+        if key in _COLOR_FIELDS:
+            return QColor(value)
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in _FIELDS and getattr(self, key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (k for k in _FIELDS if getattr(self, k) is not None)
+
+    def keys(self):
+        return list(self)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self:
+            raise KeyError(key)
+        return self.get(key)
+
+    # 序列化
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON 可序列化的规范字典（颜色为十六进制字符串，省略未设置的可选字段）"""
+        data = {k: getattr(self, k) for k in _FIELDS if getattr(self, k) is not None}
+        if self.layers:
+            data["layers"] = [layer.to_dict() for layer in self.layers]
+        return data
+
+    def to_settings(self) -> Dict[str, Any]:
+        """面板/预览使用的设置字典（颜色为 QColor）"""
+        data = {k: self.get(k) for k in self}
+        if self.layers:
+            data["layers"] = [layer.to_settings() for layer in self.layers]
+        return data
+
+    def to_json(self) -> str:
+        """规范序列化：键排序、无多余空白，相同规格得到相同字节"""
+        return json.dumps(self.to_dict(), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+    @property
+    def digest(self) -> str:
+        """跨进程稳定的内容摘要，可用作缓存或导出清单的键"""
+        if self._digest is None:
+            object.__setattr__(self, "_digest", hashlib.blake2b(self.to_json().encode("utf-8"), digest_size=16).hexdigest())
+        return self._digest
+
+    def __reduce__(self):
+        return (_spec_from_dict, (self.to_dict(),))
+
+
+def _spec_from_dict(data: Dict[str, Any]) -> WatermarkSpec:
+    return WatermarkSpec(**data)
@@ -0,0 +1,47 @@
+from __future__ import annotations
+import json
+import os
+import sys
+import time
+from typing import Dict
+
+from app.store import ensure_dirs, get_app_data_dir
+
+
+# 只保留最近的若干次启动记录
+_MAX_RECORDS = 200
+
+
+class StartupTimer:
+    """记录启动各阶段耗时（相对进程启动的毫秒数），写入数据目录的 startup-timing.jsonl
+
+    设置环境变量 WKX_STARTUP_TIMING=1 时同时输出到标准错误。
+    """
+
+    def __init__(self, t0: float | None = None) -> None:
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self.marks: Dict[str, float] = {}
+        self.extra: Dict[str, object] = {}
+
+    def mark(self, name: str) -> float:
+        ms = round((time.perf_counter() - self.t0) * 1000.0, 1)
+        self.marks[name] = ms
+        return ms
+
+    def write(self) -> None:
+        record = {"ts": int(time.time()), "marks": self.marks}
+        record.update(self.extra)
+        if os.environ.get("WKX_STARTUP_TIMING"):
+            print("startup " + " ".join(f"{k}={v}ms" for k, v in self.marks.items()), file=sys.stderr)
+        path = get_app_data_dir() / "startup-timing.jsonl"
+        try:
+            ensure_dirs()
+            lines = []
+            if path.exists():
+                with path.open("r", encoding="utf-8") as f:
+                    lines = f.readlines()[-(_MAX_RECORDS - 1):]
+            lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+            with path.open("w", encoding="utf-8") as f:
+                f.writelines(lines)
+        except OSError:
+            pass
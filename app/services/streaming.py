@@ -0,0 +1,549 @@
+from __future__ import annotations
+import io
+import math
+import os
+import shutil
+import struct
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image, TiffImagePlugin, TiffTags
+from PySide6.QtCore import QPointF, QRect, QRectF
+from PySide6.QtGui import QImage, QPainter
+
+from .compositor import LayerStack, place_layer, plan_overlay, tile_brush
+from .encoders import pil_save_options
+from .fileio import partial_path_for
+from .qimage_numpy import array_to_qimage
+
+
+# 超过该像素数的 PNG/TIFF 在批量导出时按条带流式处理（约 480MB 的 ARGB32）
+STREAMING_MIN_PIXELS = 120_000_000
+DEFAULT_BAND_ROWS = 256
+STREAM_SUFFIXES = (".png", ".tif", ".tiff")
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 8 位 PNG 颜色类型 → Pillow 模式（原始模式与之相同）
+_PNG_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+_READ_CHUNK = 1 << 20
+_IDAT_CHUNK = 1 << 18
+
+# 解码单个条带/图块行时需要从原文件复制的 TIFF 标签
+_TIFF_COPY_TAGS = (
+    258,  # BitsPerSample
+    259,  # Compression
+    262,  # PhotometricInterpretation
+    266,  # FillOrder
+    277,  # SamplesPerPixel
+    284,  # PlanarConfiguration
+    317,  # Predictor
+    320,  # ColorMap
+    338,  # ExtraSamples
+    339,  # SampleFormat
+    347,  # JPEGTables
+    529,  # YCbCrCoefficients
+    530,  # YCbCrSubSampling
+    532,  # ReferenceBlackWhite
+)
+
+
+class BandReader:
+    """按条带读取大图：bands() 依次产出 (起始行, (h, w, c) uint8 可写数组)
+
+    c 为 3（RGB）或 4（RGBA，非预乘）；任意时刻只解码一个条带。
+    unit_rows 为文件格式决定的最小解码单位（行数），0 表示可按任意行数切分。
+    """
+
+    width = 0
+    height = 0
+    has_alpha = False
+    unit_rows = 0
+
+    def bands(self, band_rows: int) -> Iterator[Tuple[int, np.ndarray]]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+def _to_band_array(img: Image.Image, has_alpha: bool) -> np.ndarray:
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    return np.array(img)
+
+
+class PngBandReader(BandReader):
+    """非隔行 8 位 PNG 的流式读取
+
+    自行解析块并流式解压 IDAT，每个条带的扫描线交给 Pillow 的 PNG 解码器反过滤。
+    条带首行的 Up/Average/Paeth 过滤依赖上一行，因此在条带前补一行
+    “无过滤”的上一行原始像素，解码后丢弃。
+    """
+
+    def __init__(self, path: str) -> None:
+        self._fp = open(path, "rb")
+        try:
+            self._parse_header()
+        except Exception:
+            self._fp.close()
+            raise
+
+    def _read_chunk(self) -> Tuple[bytes, bytes]:
+        head = self._fp.read(8)
+        if len(head) < 8:
+            raise ValueError("PNG 数据不完整")
+        length, ctype = struct.unpack(">I4s", head)
+        if ctype == b"IDAT":
+            # IDAT 数据由 _idat_stream 按需读取
+            return ctype, b""
+        data = self._fp.read(length)
+        self._fp.read(4)  # CRC
+        return ctype, data
+
+    def _parse_header(self) -> None:
+        if self._fp.read(8) != _PNG_SIGNATURE:
+            raise ValueError("不是 PNG 文件")
+        ctype, ihdr = self._read_chunk()
+        if ctype != b"IHDR":
+            raise ValueError("缺少 IHDR")
+        w, h, depth, color, _, _, interlace = struct.unpack(">IIBBBBB", ihdr)
+        if depth != 8 or color not in _PNG_MODES or interlace:
+            raise ValueError("仅支持非隔行的 8 位 PNG")
+        self.width, self.height = w, h
+        self.mode = _PNG_MODES[color]
+        self.palette: bytes | None = None
+        self.transparency: Any = None
+        # 读到第一个 IDAT 为止，收集调色板与透明信息
+        while True:
+            pos = self._fp.tell()
+            ctype, data = self._read_chunk()
+            if ctype == b"IDAT":
+                self._fp.seek(pos)
+                break
+            if ctype == b"PLTE":
+                self.palette = data
+            elif ctype == b"tRNS":
+                self.transparency = self._parse_trns(data)
+            elif ctype == b"IEND":
+                raise ValueError("缺少 IDAT")
+        self.has_alpha = self.mode in ("LA", "RGBA") or self.transparency is not None
+        self.channels = {"L": 1, "P": 1, "LA": 2, "RGB": 3, "RGBA": 4}[self.mode]
+
+    def _parse_trns(self, data: bytes) -> Any:
+        if self.mode == "P":
+            return data
+        if self.mode == "L" and len(data) >= 2:
+            return struct.unpack(">H", data[:2])[0]
+        if self.mode == "RGB" and len(data) >= 6:
+            return struct.unpack(">HHH", data[:6])
+        return None
+
+    def _idat_stream(self) -> Iterator[bytes]:
+        while True:
+            head = self._fp.read(8)
+            if len(head) < 8:
+                return
+            length, ctype = struct.unpack(">I4s", head)
+            if ctype != b"IDAT":
+                return
+            remaining = length
+            while remaining > 0:
+                piece = self._fp.read(min(_READ_CHUNK, remaining))
+                if not piece:
+                    return
+                remaining -= len(piece)
+                yield piece
+            self._fp.read(4)
+
+    def _scanlines(self) -> Iterator[bytes]:
+        """产出带过滤字节的扫描线；解压输出按块限长，高压缩比的图也不会一次展开"""
+        stride = 1 + self.width * self.channels
+        inflater = zlib.decompressobj()
+        pending = b""
+        for piece in self._idat_stream():
+            data = piece
+            while data:
+                buf = pending + inflater.decompress(data, _READ_CHUNK * 4)
+                data = inflater.unconsumed_tail
+                count = len(buf) // stride
+                for i in range(count):
+                    yield buf[i * stride:(i + 1) * stride]
+                pending = buf[count * stride:]
+        buf = pending + inflater.flush()
+        for i in range(len(buf) // stride):
+            yield buf[i * stride:(i + 1) * stride]
+
+    def _decode(self, lines: List[bytes], prev_raw: bytes | None) -> Image.Image:
+        rows = len(lines)
+        payload = b"".join(lines)
+        if prev_raw is not None:
+            payload = b"\x00" + prev_raw + payload
+            rows += 1
+        # 存储模式（level 0）重新打包，只为满足解码器的 zlib 输入格式
+        img = Image.frombytes(self.mode, (self.width, rows), zlib.compress(payload, 0), "zip", self.mode)
+        if prev_raw is not None:
+            img = img.crop((0, 1, self.width, rows))
+        return img
+
+    def bands(self, band_rows: int) -> Iterator[Tuple[int, np.ndarray]]:
+        band_rows = max(1, int(band_rows))
+        prev_raw: bytes | None = None
+        y0 = 0
+        lines: List[bytes] = []
+        for line in self._scanlines():
+            lines.append(line)
+            if len(lines) == band_rows or y0 + len(lines) == self.height:
+                img = self._decode(lines, prev_raw)
+                prev_raw = img.crop((0, img.height - 1, self.width, img.height)).tobytes("raw", self.mode)
+                yield y0, self._to_array(img)
+                y0 += len(lines)
+                lines = []
+                if y0 >= self.height:
+                    return
+        if y0 < self.height:
+            raise ValueError("PNG 数据不完整")
+
+    def _to_array(self, img: Image.Image) -> np.ndarray:
+        if self.palette is not None and self.mode == "P":
+            img.putpalette(self.palette)
+        if self.transparency is not None:
+            img.info["transparency"] = self.transparency
+        return _to_band_array(img, self.has_alpha)
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+class TiffBandReader(BandReader):
+    """按条带（strip）或图块行（tile row）读取 TIFF
+
+    每个条带单独封装成只含该条带的内存 TIFF 交给 Pillow/libtiff 解码，
+    因此支持 libtiff 能解码的所有压缩方式（LZW、Deflate、JPEG 等），
+    而不必把整幅图解码到内存。未压缩的条带按行偏移拆成更小的条带读取（扫描仪
+    常见的单条带文件也能分段）；压缩的条带只能整条解码，unit_rows 即最高的
+    条带/图块行。不支持分平面（PlanarConfiguration=2）的文件。
+    """
+
+    def __init__(self, path: str) -> None:
+        self._fp = open(path, "rb")
+        try:
+            # 直接构造 TiffImageFile，绕过 Image.open 的解压炸弹检查：这里本就只按条带解码
+            self._tif = TiffImagePlugin.TiffImageFile(self._fp)
+            self._setup()
+        except Exception:
+            self._fp.close()
+            raise
+
+    def _setup(self) -> None:
+        tags = self._tif.tag_v2
+        self.width, self.height = self._tif.size
+        if int(tags.get(284, 1)) != 1:
+            raise ValueError("不支持分平面 TIFF")
+        self.has_alpha = "A" in self._tif.mode or "a" in self._tif.mode
+        self._prefix = tags.prefix
+        if 324 in tags:
+            tile_w, tile_h = int(tags[322]), int(tags[323])
+            across = math.ceil(self.width / tile_w)
+            offsets, counts = tags[324], tags[325]
+            self._units = [
+                (r * tile_h, tile_h, offsets[r * across:(r + 1) * across], counts[r * across:(r + 1) * across])
+                for r in range(math.ceil(self.height / tile_h))
+            ]
+            self._tile_size: Tuple[int, int] | None = (tile_w, tile_h)
+            self._row_bytes = 0
+            self.unit_rows = tile_h
+        else:
+            rows = int(tags.get(278, self.height)) or self.height
+            rows = min(rows, self.height)
+            offsets, counts = tags[273], tags[279]
+            self._units = [
+                (i * rows, min(rows, self.height - i * rows), (offsets[i],), (counts[i],))
+                for i in range(len(offsets))
+            ]
+            self._tile_size = None
+            bits = tags.get(258, (8,))
+            bits = sum(bits) if isinstance(bits, tuple) else int(bits) * int(tags.get(277, 1))
+            # 未压缩：每行字节数固定，可按行偏移切分条带
+            self._row_bytes = math.ceil(self.width * bits / 8) if int(tags.get(259, 1)) == 1 else 0
+            splittable = self._row_bytes > 0 and all(
+                count >= n * self._row_bytes for _, n, _, (count,) in self._units)
+            if not splittable:
+                self._row_bytes = 0
+            self.unit_rows = 0 if splittable else rows
+
+    def _split_units(self, band_rows: int):
+        """未压缩条带切成不超过 band_rows 行的小条带；其余单位原样产出"""
+        for y0, rows, offsets, counts in self._units:
+            if not self._row_bytes or rows <= band_rows:
+                yield y0, rows, offsets, counts
+                continue
+            for r in range(0, rows, band_rows):
+                n = min(band_rows, rows - r)
+                yield y0 + r, n, (offsets[0] + r * self._row_bytes,), (n * self._row_bytes,)
+
+    def _mini_tiff(self, rows: int, blobs: List[bytes]) -> bytes:
+        """只含一个条带/一行图块的内存 TIFF：文件头 + IFD + 像素数据"""
+        src = self._tif.tag_v2
+        ifh = self._prefix + (b"\x2a\x00" if self._prefix == b"II" else b"\x00\x2a") + b"\x00" * 4
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(ifh=ifh)
+        for tag in _TIFF_COPY_TAGS:
+            if tag in src:
+                ifd[tag] = src[tag]
+                ifd.tagtype[tag] = src.tagtype[tag]
+        ifd[256] = self.width
+        ifd[257] = rows
+        relative = []
+        pos = 0
+        for blob in blobs:
+            relative.append(pos)
+            pos += len(blob)
+        counts = tuple(len(b) for b in blobs)
+        if self._tile_size is not None:
+            ifd[322], ifd[323] = self._tile_size
+            ifd[324] = tuple(relative)
+            ifd[325] = counts
+            ifd.tagtype[324] = ifd.tagtype[325] = TiffTags.LONG
+            # 图块偏移不会被 tobytes 重定位：先按占位值求出 IFD 长度，再写绝对偏移
+            data_start = 8 + len(ifd.tobytes(8))
+            ifd[324] = tuple(data_start + r for r in relative)
+        else:
+            # 条带偏移由 tobytes 自动加上 IFD 末尾的位置
+            ifd[278] = rows
+            ifd[273] = tuple(relative)
+            ifd[279] = counts
+            ifd.tagtype[273] = ifd.tagtype[279] = TiffTags.LONG
+        endian = "<" if self._prefix == b"II" else ">"
+        header = ifh[:4] + struct.pack(endian + "L", 8)
+        return header + ifd.tobytes(8) + b"".join(blobs)
+
+    def _decode_unit(self, rows: int, offsets, counts) -> Image.Image:
+        blobs = []
+        for off, count in zip(offsets, counts):
+            self._fp.seek(off)
+            blobs.append(self._fp.read(count))
+        img = TiffImagePlugin.TiffImageFile(io.BytesIO(self._mini_tiff(rows, blobs)))
+        img.load()
+        return img
+
+    def bands(self, band_rows: int) -> Iterator[Tuple[int, np.ndarray]]:
+        # 条带大小由文件决定；多个小条带合并到接近 band_rows 再产出
+        band_rows = max(1, int(band_rows))
+        parts: List[np.ndarray] = []
+        start = 0
+        filled = 0
+        for y0, rows, offsets, counts in self._split_units(band_rows):
+            img = self._decode_unit(rows, offsets, counts)
+            valid = min(rows, self.height - y0)
+            if img.height != valid:
+                img = img.crop((0, 0, self.width, valid))
+            parts.append(_to_band_array(img, self.has_alpha))
+            filled += valid
+            if filled >= band_rows or y0 + valid >= self.height:
+                band = parts[0] if len(parts) == 1 else np.concatenate(parts)
+                yield start, band
+                start += filled
+                parts = []
+                filled = 0
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+def open_band_reader(path: str) -> BandReader | None:
+    """按扩展名打开条带读取器；格式不支持时返回 None（调用方回退到整图处理）"""
+    suffix = Path(path).suffix.lower()
+    try:
+        if suffix == ".png":
+            return PngBandReader(path)
+        if suffix in (".tif", ".tiff"):
+            return TiffBandReader(path)
+    except Exception:
+        return None
+    return None
+
+
+class PngBandWriter:
+    """流式 PNG 编码：逐条带过滤、压缩并输出 IDAT 块
+
+    每行使用 Up 过滤（与上一行逐字节相减，可整体向量化），压缩级别与策略沿用导出设置。
+    """
+
+    def __init__(self, fp, width: int, height: int, has_alpha: bool, settings: Dict[str, Any] | None = None) -> None:
+        self._fp = fp
+        self.width = width
+        self.height = height
+        self.channels = 4 if has_alpha else 3
+        opts = pil_save_options("PNG", settings)
+        self._deflater = zlib.compressobj(opts.get("compress_level", 6), zlib.DEFLATED, 15, 9,
+                                          opts.get("compress_type", zlib.Z_DEFAULT_STRATEGY))
+        self._prev: np.ndarray | None = None
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self.rows_written = 0
+        fp.write(_PNG_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6 if has_alpha else 2, 0, 0, 0))
+
+    def _chunk(self, ctype: bytes, data: bytes) -> None:
+        self._fp.write(struct.pack(">I", len(data)))
+        self._fp.write(ctype)
+        self._fp.write(data)
+        self._fp.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(ctype)) & 0xFFFFFFFF))
+
+    def _emit(self, data: bytes, force: bool = False) -> None:
+        if data:
+            self._buffer.append(data)
+            self._buffered += len(data)
+        if self._buffered >= _IDAT_CHUNK or (force and self._buffered):
+            self._chunk(b"IDAT", b"".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def write(self, band: np.ndarray) -> None:
+        rows = band.reshape(band.shape[0], -1)
+        prev = np.empty_like(rows)
+        prev[0] = self._prev if self._prev is not None else 0
+        prev[1:] = rows[:-1]
+        filtered = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        filtered[:, 0] = 2  # Up
+        np.subtract(rows, prev, out=filtered[:, 1:])
+        self._prev = rows[-1].copy()
+        self._emit(self._deflater.compress(filtered.tobytes()))
+        self.rows_written += rows.shape[0]
+
+    def close(self) -> None:
+        self._emit(self._deflater.flush(), force=True)
+        self._chunk(b"IEND", b"")
+
+
+def paint_band(band: np.ndarray, y0: int, width: int, height: int, layer: QImage,
+               wm: Dict[str, Any], brush=None, placed=None, plan=None) -> None:
+    """把水印绘制到条带上（坐标按整幅图计算，平移 -y0 后绘制）"""
+    fmt = QImage.Format_RGBA8888 if band.shape[2] == 4 else QImage.Format_RGB888
+    img = array_to_qimage(band, fmt)
+    painter = QPainter(img)
+    painter.translate(0, -y0)
+    if brush is not None:
+        painter.setRenderHint(QPainter.Antialiasing, True)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, True)
+        painter.fillRect(QRectF(0, y0, width, band.shape[0]), brush)
+    elif placed is not None:
+        drawn, x, y = placed
+        painter.drawImage(x, y, drawn)
+    elif plan is not None:
+        plan.paint(painter, QRect(0, y0, width, band.shape[0]))
+    painter.end()
+
+
+def stream_watermark(src_path: str, out_path: str | Path, layer: QImage | LayerStack | None, wm: Dict[str, Any],
+                     settings: Dict[str, Any] | None = None, band_rows: int = DEFAULT_BAND_ROWS,
+                     cancelled: Callable[[], bool] | None = None, cache: bool = True) -> bool:
+    """流式给大图加水印并输出 PNG，峰值内存只与条带大小有关
+
+    只有与水印相交的条带才会绘制（平铺模式下每个条带都绘制）；
+    输出先写入同目录的 .part 临时文件，完成后原子替换。
+    只用一次的图层传 cache=False，不进入旋转缓存。
+    """
+    reader = open_band_reader(src_path)
+    if reader is None:
+        return False
+    out_path = Path(out_path)
+    tmp = partial_path_for(out_path)
+    ok = False
+    try:
+        w, h = reader.width, reader.height
+        brush = placed = plan = None
+        top = bottom = 0
+        if layer is not None and not layer.isNull():
+            if isinstance(layer, LayerStack):
+                # 图层组：编译为一张叠加层时与单图层相同；否则每个条带逐部分绘制，
+                # 不生成整幅叠加层，峰值内存仍只与条带大小有关
+                stacked = plan_overlay(w, h, layer, wm, cache)
+                if stacked.image is not None:
+                    placed = (stacked.image, stacked.x, stacked.y)
+                    top, bottom = stacked.y, stacked.y + stacked.image.height()
+                elif stacked.parts:
+                    plan = stacked
+                    bottom = h
+            elif wm.get("position", "bottom_right") == "tile":
+                brush = tile_brush(layer, wm, QPointF(w / 2.0, h / 2.0))
+                bottom = h
+            else:
+                placed = place_layer(w, h, layer, wm, cache)
+                top, bottom = placed[2], placed[2] + placed[0].height()
+        with open(tmp, "wb") as f:
+            writer = PngBandWriter(f, w, h, reader.has_alpha, settings)
+            for y0, band in reader.bands(band_rows):
+                if cancelled is not None and cancelled():
+                    raise InterruptedError
+                if y0 < bottom and y0 + band.shape[0] > top:
+                    paint_band(band, y0, w, h, layer, wm, brush, placed, plan)
+                writer.write(band)
+            if writer.rows_written != h:
+                raise ValueError("行数不完整")
+            writer.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, out_path)
+        ok = True
+    except Exception:
+        ok = False
+    finally:
+        reader.close()
+        if not ok:
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+    return ok
+
+
+def can_stream(path: str, width: int, height: int, renditions: List[Dict[str, Any]], budget_bytes: int) -> bool:
+    """大图（超过阈值或单张超出内存预算）且所有规格都是原尺寸 PNG 时走流式导出
+
+    最后只读文件头确认条带读取器能打开该文件；16 位、隔行或分平面等不支持的
+    文件，以及整幅图只有一个压缩条带（分段读取并不省内存）的 TIFF 返回 False，
+    由调用方按整图处理。
+    """
+    if Path(path).suffix.lower() not in STREAM_SUFFIXES or not renditions:
+        return False
+    pixels = width * height
+    if pixels < STREAMING_MIN_PIXELS and pixels * 4 * 2 <= budget_bytes:
+        return False
+    if not all(r.get("format", "PNG") == "PNG" and r.get("resize_mode", "none") == "none" for r in renditions):
+        return False
+    unit_rows = stream_unit_rows(path)
+    return unit_rows is not None and unit_rows < height
+
+
+def stream_unit_rows(path: str) -> int | None:
+    """条带读取器一次至少要解码的行数（0 为可任意切分）；无法流式读取时返回 None"""
+    reader = open_band_reader(path)
+    if reader is None:
+        return None
+    unit_rows = reader.unit_rows
+    reader.close()
+    return unit_rows
+
+
+def stream_job_bytes(width: int, band_rows: int = DEFAULT_BAND_ROWS, unit_rows: int = 0) -> int:
+    """流式导出的峰值内存估算：解码、转换、过滤与压缩各持有约一个条带
+
+    不可切分的压缩条带比 band_rows 高时，条带按实际高度计算（合并时最多再多出一个单位）。
+    """
+    return width * (max(1, band_rows) + max(0, unit_rows)) * 4 * 4
+
+
+def copy_output(src: Path, dst: Path) -> bool:
+    """同一结果需要写到多个位置时直接复制已写出的文件（同样先写临时文件）"""
+    tmp = partial_path_for(dst)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+        return True
+    except OSError:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,205 @@
+from __future__ import annotations
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from app.store import ensure_dirs, get_export_history_file
+from .fileio import write_bytes_atomic
+
+# 导出历史保留的记录数
+DEFAULT_HISTORY_LIMIT = 50
+# 实时面板与历史记录中列出的最慢文件数
+_SLOWEST_KEEP = 5
+STAGES = ("read", "compose", "encode", "write")
+
+_MB = 1024 * 1024
+
+
+def _working_set_windows() -> int | None:
+    import ctypes
+    from ctypes import wintypes
+
+    class _Counters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = _Counters()
+    counters.cb = ctypes.sizeof(counters)
+    try:
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+    except (AttributeError, OSError):
+        return None
+    return int(counters.WorkingSetSize)
+
+
+def current_rss_bytes() -> int | None:
+    """进程当前常驻内存（Windows 为当前工作集）；平台不支持时返回 None
+
+    不用 ru_maxrss / PeakWorkingSetSize：那是整个进程生命周期的峰值，同一会话内
+    只增不减，无法反映单次导出的内存占用。
+    """
+    if sys.platform == "win32":
+        return _working_set_windows()
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            resident = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident * os.sysconf("SC_PAGE_SIZE")
+
+
+class ExportTelemetry:
+    """批量导出的运行时统计：吞吐、各阶段忙碌时间、最慢文件
+
+    流水线各线程调用 add_* 累加，界面线程定期调用 snapshot() 读取；
+    所有计数在同一把锁下更新，开销只是几次加法。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished: float | None = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.images_done = 0
+        self.busy: Dict[str, float] = {s: 0.0 for s in STAGES}
+        self.threads: Dict[str, int] = {s: 1 for s in STAGES}
+        # (耗时, 文件名) 的小顶堆，只保留最慢的若干个
+        self._slowest: List[tuple] = []
+        # 本次导出期间采样到的最大常驻内存（平台不支持时为 None）
+        self.peak_rss: int | None = None
+        self.sample_rss()
+
+    def set_threads(self, stage: str, count: int) -> None:
+        self.threads[stage] = max(1, int(count))
+
+    def add_busy(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.busy[stage] += seconds
+
+    def add_read(self, nbytes: int, seconds: float) -> None:
+        with self._lock:
+            self.bytes_read += nbytes
+            self.busy["read"] += seconds
+
+    def add_written(self, nbytes: int, seconds: float) -> None:
+        with self._lock:
+            self.bytes_written += nbytes
+            self.busy["write"] += seconds
+
+    def add_file(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.images_done += 1
+            item = (seconds, name)
+            if len(self._slowest) < _SLOWEST_KEEP:
+                heapq.heappush(self._slowest, item)
+            elif item > self._slowest[0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def sample_rss(self) -> None:
+        """采样一次进程当前常驻内存，记录本次导出的最大值（由进度轮询定期调用）"""
+        rss = current_rss_bytes()
+        if rss is not None:
+            with self._lock:
+                self.peak_rss = rss if self.peak_rss is None else max(self.peak_rss, rss)
+
+    def finish(self) -> None:
+        self.finished = time.perf_counter()
+
+    def elapsed(self) -> float:
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return max(1e-6, end - self.started)
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = self.elapsed()
+        with self._lock:
+            return {
+                "elapsed_s": round(elapsed, 2),
+                "images": self.images_done,
+                "images_per_s": round(self.images_done / elapsed, 2),
+                "read_mb_s": round(self.bytes_read / _MB / elapsed, 2),
+                "write_mb_s": round(self.bytes_written / _MB / elapsed, 2),
+                "read_mb": round(self.bytes_read / _MB, 1),
+                "write_mb": round(self.bytes_written / _MB, 1),
+                # 利用率 = 忙碌时间 / (耗时 × 线程数)
+                "utilization": {
+                    s: round(min(1.0, self.busy[s] / (elapsed * self.threads[s])), 2) for s in STAGES
+                },
+                "slowest": [(name, round(sec, 2)) for sec, name in sorted(self._slowest, reverse=True)],
+                "peak_rss_mb": round(self.peak_rss / _MB, 1) if self.peak_rss is not None else None,
+            }
+
+
+class ExportHistory:
+    """最近 N 次批量导出的摘要，保存在数据目录的 export-history.json
+
+    用于对比不同模板或存储位置下的吞吐变化。
+    """
+
+    def __init__(self, path: Path | None = None, limit: int = DEFAULT_HISTORY_LIMIT) -> None:
+        self.path = Path(path) if path is not None else get_export_history_file()
+        self.limit = max(1, int(limit))
+        self._records: List[Dict[str, Any]] | None = None
+
+    def records(self) -> List[Dict[str, Any]]:
+        if self._records is None:
+            try:
+                with self.path.open("r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._records = [r for r in data if isinstance(r, dict)] if isinstance(data, list) else []
+            except (OSError, ValueError):
+                self._records = []
+        return list(self._records)
+
+    def append(self, record: Dict[str, Any]) -> None:
+        records = self.records()
+        records.append(record)
+        self._records = records[-self.limit:]
+        try:
+            ensure_dirs()
+        except OSError:
+            return
+        data = json.dumps(self._records, ensure_ascii=False, indent=1).encode("utf-8")
+        write_bytes_atomic(self.path, data, fsync=False)
+
+
+def history_record(telemetry: ExportTelemetry, *, total: int, ok: int, failed: int, cancelled: bool,
+                   workers: int, peak_budget_bytes: int, template: str = "", out_dir: str = "") -> Dict[str, Any]:
+    """把一次导出的统计整理为历史记录"""
+    snap = telemetry.snapshot()
+    return {
+        "ts": int(time.time()),
+        "total": total,
+        "ok": ok,
+        "failed": failed,
+        "cancelled": cancelled,
+        "workers": workers,
+        "elapsed_s": snap["elapsed_s"],
+        "images_per_s": snap["images_per_s"],
+        "read_mb_s": snap["read_mb_s"],
+        "write_mb_s": snap["write_mb_s"],
+        "peak_budget_mb": round(peak_budget_bytes / _MB, 1),
+        # 本次导出期间的常驻内存峰值（采样所得），不是进程生命周期的峰值
+        "peak_rss_mb": snap["peak_rss_mb"],
+        "utilization": snap["utilization"],
+        "slowest": snap["slowest"][:3],
+        "template": template,
+        "out_dir": out_dir,
+    }
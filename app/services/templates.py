@@ -1,47 +1,176 @@
 from __future__ import annotations
 from pathlib import Path
 import json
-from typing import Any, Dict, List
+import os
+import threading
+from typing import Any, Dict, List, Tuple
 
 from . import normalize_settings_for_save, normalize_settings_for_load
 from app.store import ensure_dirs, get_templates_dir, get_last_session_file
 
 
+_dirs_ready = False
+
+
+def _ensure_dirs_once() -> None:
+    # 目录只需创建一次；模板目录位于网络盘时每次 mkdir 都是一次往返
+    global _dirs_ready
+    if not _dirs_ready:
+        ensure_dirs()
+        _dirs_ready = True
+
+
 def _safe_name(name: str) -> str:
     return "".join(c for c in name.strip() if c not in "\\/:*?\"<>|") or "template"
 
 
+def _read_template_file(path: Path) -> Dict[str, Any] | None:
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            return None
+        return normalize_settings_for_load(data)
+    except Exception:
+        return None
+
+
+class TemplateCatalog:
+    """模板目录的内存索引：名称 → (mtime, 大小, 已解析并规范化的设置)
+
+    refresh() 用 os.scandir 扫描目录，只重新解析 mtime 或大小变化的文件，
+    删除的文件从索引移除；加载、列表与搜索都直接走内存索引。
+    """
+
+    def __init__(self, tpl_dir: Path | None = None) -> None:
+        self._dir = tpl_dir
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Tuple[int, int], Dict[str, Any] | None, str]] = {}
+        self._scanned = False
+
+    @property
+    def directory(self) -> Path:
+        return self._dir if self._dir is not None else get_templates_dir()
+
+    def refresh(self) -> None:
+        """增量刷新索引"""
+        seen: Dict[str, Tuple[Tuple[int, int], Path]] = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(".json") or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    seen[entry.name[:-5]] = ((st.st_mtime_ns, st.st_size), Path(entry.path))
+        except OSError:
+            seen = {}
+        with self._lock:
+            for name in list(self._entries):
+                if name not in seen:
+                    del self._entries[name]
+            for name, (stamp, path) in seen.items():
+                old = self._entries.get(name)
+                if old is not None and old[0] == stamp:
+                    continue
+                self._entries[name] = self._build_entry(name, stamp, path)
+            self._scanned = True
+
+    def _build_entry(self, name: str, stamp: Tuple[int, int], path: Path):
+        data = _read_template_file(path)
+        # 搜索文本：名称 + 水印文字 + 图片水印文件名
+        text = name
+        if data:
+            text = " ".join([name, str(data.get("text", "")), Path(str(data.get("image_path", "") or "")).name])
+        return stamp, data, text.lower()
+
+    def _ensure_scanned(self) -> None:
+        if not self._scanned:
+            self.refresh()
+
+    def names(self) -> List[str]:
+        self._ensure_scanned()
+        with self._lock:
+            return sorted(self._entries)
+
+    def get(self, name: str) -> Dict[str, Any] | None:
+        """返回模板设置的副本；单独校验该文件是否变化，避免读到过期内容"""
+        self._ensure_scanned()
+        path = self.directory / (name + ".json")
+        try:
+            st = path.stat()
+        except OSError:
+            with self._lock:
+                self._entries.pop(name, None)
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != stamp:
+                entry = self._build_entry(name, stamp, path)
+                self._entries[name] = entry
+            data = entry[1]
+        return dict(data) if data is not None else None
+
+    def search(self, query: str) -> List[str]:
+        """按名称或水印文字做不区分大小写的子串匹配，多个关键词需同时命中"""
+        self._ensure_scanned()
+        words = [w for w in str(query or "").lower().split() if w]
+        with self._lock:
+            return sorted(name for name, (_, _, text) in self._entries.items()
+                          if all(w in text for w in words))
+
+    def forget(self, name: str) -> None:
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def update(self, name: str) -> None:
+        """保存或重命名后只刷新该模板，不重新扫描整个目录"""
+        path = self.directory / (name + ".json")
+        try:
+            st = path.stat()
+        except OSError:
+            self.forget(name)
+            return
+        with self._lock:
+            self._entries[name] = self._build_entry(name, (st.st_mtime_ns, st.st_size), path)
+
+
+_catalog: TemplateCatalog | None = None
+
+
+def get_catalog() -> TemplateCatalog:
+    global _catalog
+    if _catalog is None:
+        _ensure_dirs_once()
+        _catalog = TemplateCatalog()
+    return _catalog
+
+
 def save_template(name: str, settings: Dict[str, Any]) -> Path:
-    ensure_dirs()
+    _ensure_dirs_once()
     tpl_dir = get_templates_dir()
     fname = _safe_name(name) + ".json"
     path = tpl_dir / fname
     data = normalize_settings_for_save(settings)
     with path.open("w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+    get_catalog().update(path.stem)
     return path
 
 
 def load_template(name: str) -> Dict[str, Any] | None:
-    tpl_dir = get_templates_dir()
-    path = tpl_dir / (name + ".json")
-    if not path.exists():
-        return None
-    try:
-        with path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
-        return normalize_settings_for_load(data)
-    except Exception:
-        return None
+    return get_catalog().get(name)
 
 
-def list_templates() -> List[str]:
-    ensure_dirs()
-    tpl_dir = get_templates_dir()
-    names: List[str] = []
-    for p in tpl_dir.glob("*.json"):
-        names.append(p.stem)
-    return sorted(names)
+def list_templates(refresh: bool = True) -> List[str]:
+    catalog = get_catalog()
+    if refresh:
+        catalog.refresh()
+    return catalog.names()
+
+
+def search_templates(query: str) -> List[str]:
+    return get_catalog().search(query)
 
 
 def rename_template(old_name: str, new_name: str) -> bool:
@@ -54,6 +183,9 @@ def rename_template(old_name: str, new_name: str) -> bool:
         # 若目标已存在，视为失败以避免覆盖
         return False
     old.rename(new)
+    catalog = get_catalog()
+    catalog.forget(old_name)
+    catalog.update(new.stem)
     return True
 
 
@@ -64,13 +196,14 @@ def delete_template(name: str) -> bool:
         return False
     try:
         path.unlink()
+        get_catalog().forget(name)
         return True
     except Exception:
         return False
 
 
 def save_last_session(settings: Dict[str, Any]) -> Path:
-    ensure_dirs()
+    _ensure_dirs_once()
     path = get_last_session_file()
     data = normalize_settings_for_save(settings)
     with path.open("w", encoding="utf-8") as f:
@@ -0,0 +1,138 @@
+from __future__ import annotations
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from PySide6.QtCore import QBuffer, QByteArray, QIODevice, QRect, QSize, Qt
+from PySide6.QtGui import QImage, QImageReader, QPainter
+
+from app.store import get_thumbnails_dir
+from .compositor import LayerStack, placement_key, plan_overlay
+from .image_cache import file_stamp
+
+
+class ThumbnailCache:
+    """列表缩略图的磁盘缓存
+
+    以 (路径, mtime, 大小, 边长) 的哈希为文件名，源文件变化后自然失效；
+    生成时用 QImageReader.setScaledSize 让 JPEG 等格式在解码阶段直接缩小，
+    不必解码整张原图。
+    设置 catalog（LibraryCatalog）后，图库中的图片改为把缩略图存入图库数据库，
+    其余图片仍使用磁盘缓存目录。
+    """
+
+    def __init__(self, edge: int = 48, cache_dir: Path | None = None) -> None:
+        self.edge = max(8, int(edge))
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else get_thumbnails_dir()
+        self.catalog = None
+        self._dir_ready = False
+
+    def _key_path(self, path: str, stamp) -> Path:
+        key = f"{path}|{stamp[0]}|{stamp[1]}|{self.edge}".encode("utf-8")
+        return self.cache_dir / (hashlib.sha1(key).hexdigest() + ".png")
+
+    def get(self, path: str) -> QImage | None:
+        stamp = file_stamp(path)
+        if stamp is None:
+            return None
+        if self.catalog is not None:
+            data = self.catalog.thumbnail(path, self.edge, stamp)
+            if data:
+                img = QImage.fromData(data)
+                if not img.isNull():
+                    return img
+        cached = self._key_path(path, stamp)
+        if cached.exists():
+            img = QImage(str(cached))
+            if not img.isNull():
+                return img
+        img = self.generate(path)
+        if img is None:
+            return None
+        if self.catalog is not None and self.catalog.put_thumbnail(path, self.edge, stamp, png_bytes(img)):
+            return img
+        try:
+            if not self._dir_ready:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                self._dir_ready = True
+            img.save(str(cached), "PNG")
+        except OSError:
+            pass
+        return img
+
+    def generate(self, path: str) -> QImage | None:
+        reader = QImageReader(path)
+        size = reader.size()
+        if size.isValid() and (size.width() > self.edge or size.height() > self.edge):
+            reader.setScaledSize(size.scaled(QSize(self.edge * 2, self.edge * 2), Qt.AspectRatioMode.KeepAspectRatio))
+        img = reader.read()
+        if img.isNull():
+            return None
+        return img.scaled(self.edge, self.edge, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+
+
+class ThumbnailOverlays:
+    """缩略图上的水印：按 (图层, 原图尺寸, 缩略图尺寸, 摆放设置) 缓存缩小后的叠加层
+
+    摆放方案与导出相同（compositor.plan_overlay 按原图尺寸计算锚点、旋转与
+    平铺），只在绘制时整体缩到缩略图大小。同一批尺寸相同的图片共用一张
+    缩略图大小的叠加层，每张缩略图只需一次 drawImage，原图不解码。
+    """
+
+    def __init__(self, limit: int = 256) -> None:
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, QImage]" = OrderedDict()
+
+    def overlay(self, width: int, height: int, size: QSize, layer: "QImage | LayerStack",
+                wm: Dict[str, Any], cache: bool = True) -> QImage:
+        """原图 width×height 上的水印缩到 size 后的透明叠加层"""
+        key = (layer.cacheKey(), width, height, size.width(), size.height(), placement_key(wm))
+        if cache:
+            with self._lock:
+                hit = self._entries.get(key)
+                if hit is not None:
+                    self._entries.move_to_end(key)
+                    return hit
+        overlay = QImage(size, QImage.Format_ARGB32_Premultiplied)
+        overlay.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(overlay)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+        plan_overlay(width, height, layer, wm, cache).paint_scaled(
+            painter, QRect(0, 0, width, height), size.width() / width, size.height() / height)
+        painter.end()
+        if cache:
+            with self._lock:
+                self._entries[key] = overlay
+                while len(self._entries) > self.limit:
+                    self._entries.popitem(last=False)
+        return overlay
+
+    def compose(self, thumb: QImage, width: int, height: int, layer: "QImage | LayerStack | None",
+                wm: Dict[str, Any], cache: bool = True) -> QImage:
+        """返回贴好水印的缩略图副本；原图尺寸未知或无水印时返回原缩略图
+
+        逐图渲染的图层（含令牌的文本）只用一次，cache=False 时不进入缓存。
+        """
+        if layer is None or layer.isNull() or width <= 0 or height <= 0 or thumb.isNull():
+            return thumb
+        out = thumb.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        painter = QPainter(out)
+        painter.drawImage(0, 0, self.overlay(width, height, thumb.size(), layer, wm, cache))
+        painter.end()
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def png_bytes(img: QImage) -> bytes:
+    data = QByteArray()
+    buf = QBuffer(data)
+    buf.open(QIODevice.OpenModeFlag.WriteOnly)
+    img.save(buf, "PNG")
+    buf.close()
+    return bytes(data)
@@ -0,0 +1,159 @@
+from __future__ import annotations
+import re
+import string
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from PIL import Image
+
+from .image_cache import file_stamp
+
+
+# 水印文本中可用的令牌；格式说明与 str.format 相同，如 {date:%Y-%m-%d}、{index:03}
+TOKENS = {
+    "filename": "文件名（含扩展名）",
+    "stem": "文件名（不含扩展名）",
+    "ext": "扩展名",
+    "folder": "所在文件夹名",
+    "index": "在本次导出中的序号（从 1 开始）",
+    "date": "拍摄时间（EXIF，缺失时为文件修改时间）",
+    "camera": "相机（厂商 + 型号）",
+    "make": "相机厂商",
+    "model": "相机型号",
+    "width": "宽度（像素）",
+    "height": "高度（像素）",
+    "dimensions": "尺寸，如 6000x4000",
+}
+
+_TOKEN_RE = re.compile(r"\{(" + "|".join(TOKENS) + r")(?:[:!][^{}]*)?\}")
+
+_EXIF_IFD = 0x8769
+_DATETIME_ORIGINAL = 0x9003
+_DATETIME = 0x0132
+_MAKE = 0x010F
+_MODEL = 0x0110
+_EXIF_CACHE_LIMIT = 4096
+
+
+def has_tokens(text: Any) -> bool:
+    return isinstance(text, str) and "{" in text and _TOKEN_RE.search(text) is not None
+
+
+def templated(wm: Dict[str, Any]) -> bool:
+    """该图层是否为含令牌的文本水印（每张图的文字不同）"""
+    return wm.get("wm_type", "text") == "text" and has_tokens(wm.get("text", ""))
+
+
+def stack_templated(wm: Dict[str, Any]) -> bool:
+    """底层或任一附加图层含令牌"""
+    return templated(wm) or any(templated(layer) for layer in (wm.get("layers") or ()))
+
+
+class _Formatter(string.Formatter):
+    """未知令牌原样保留；格式说明不适用时退回不带格式的值"""
+
+    def get_value(self, key, args, kwargs):
+        if isinstance(key, str) and key in kwargs:
+            return kwargs[key]
+        raise KeyError(key)
+
+    def format_field(self, value, format_spec):
+        try:
+            return super().format_field(value, format_spec)
+        except (ValueError, TypeError):
+            return str(value)
+
+
+_formatter = _Formatter()
+
+
+def expand(text: str, context: Dict[str, Any]) -> str:
+    """展开 text 中的令牌；只替换已知令牌，其余花括号内容保持原样"""
+    if not has_tokens(text):
+        return text
+
+    def sub(match: "re.Match[str]") -> str:
+        try:
+            return _formatter.vformat(match.group(0), (), context)
+        except (KeyError, IndexError, ValueError, AttributeError):
+            return match.group(0)
+
+    return _TOKEN_RE.sub(sub, text)
+
+
+def _parse_exif_time(value: Any) -> datetime | None:
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "ignore")
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip("\x00 ")[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", "ignore")
+    return str(value).strip("\x00 ") if value is not None else ""
+
+
+_exif_lock = threading.Lock()
+_exif_cache: "OrderedDict[Tuple[str, Tuple[int, int]], Dict[str, Any]]" = OrderedDict()
+
+
+def read_exif_fields(path: str) -> Dict[str, Any]:
+    """只读文件头取拍摄时间、厂商与型号；结果按 mtime 与大小缓存"""
+    stamp = file_stamp(path)
+    if stamp is None:
+        return {}
+    key = (path, stamp)
+    with _exif_lock:
+        hit = _exif_cache.get(key)
+        if hit is not None:
+            return hit
+    fields: Dict[str, Any] = {}
+    try:
+        with Image.open(path) as im:
+            exif = im.getexif()
+            shot = _parse_exif_time(exif.get_ifd(_EXIF_IFD).get(_DATETIME_ORIGINAL)) or _parse_exif_time(exif.get(_DATETIME))
+            if shot is not None:
+                fields["date"] = shot
+            fields["make"] = _text(exif.get(_MAKE))
+            fields["model"] = _text(exif.get(_MODEL))
+    except Exception:
+        pass
+    if "date" not in fields:
+        fields["date"] = datetime.fromtimestamp(stamp[0] / 1e9)
+    with _exif_lock:
+        _exif_cache[key] = fields
+        while len(_exif_cache) > _EXIF_CACHE_LIMIT:
+            _exif_cache.popitem(last=False)
+    return fields
+
+
+def token_context(path: str, index: int = 1, width: int = 0, height: int = 0) -> Dict[str, Any]:
+    """一张图片的令牌取值；width/height 为实际绘制水印的图像尺寸"""
+    p = Path(path)
+    exif = read_exif_fields(path)
+    make = exif.get("make", "")
+    model = exif.get("model", "")
+    # 多数相机的型号已包含厂商名，避免重复
+    camera = model if make and model.lower().startswith(make.split()[0].lower()) else " ".join(x for x in (make, model) if x)
+    return {
+        "filename": p.name,
+        "stem": p.stem,
+        "ext": p.suffix.lstrip("."),
+        "folder": p.parent.name,
+        "index": int(index),
+        "date": exif.get("date") or datetime.now(),
+        "camera": camera,
+        "make": make,
+        "model": model,
+        "width": int(width),
+        "height": int(height),
+        "dimensions": f"{int(width)}x{int(height)}",
+    }
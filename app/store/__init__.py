@@ -13,6 +13,21 @@ def get_templates_dir() -> Path:
 def get_last_session_file() -> Path:
     return get_app_data_dir() / "last-session.json"
 
+def get_session_journal_file() -> Path:
+    return get_app_data_dir() / "session.jsonl"
+
+def get_session_index_file() -> Path:
+    return get_app_data_dir() / "session-index.json"
+
+def get_thumbnails_dir() -> Path:
+    return get_app_data_dir() / "thumbnails"
+
+def get_export_history_file() -> Path:
+    return get_app_data_dir() / "export-history.json"
+
+def get_library_db_file() -> Path:
+    return get_app_data_dir() / "library.sqlite3"
+
 def ensure_dirs() -> None:
     app_dir = get_app_data_dir()
     tpl_dir = get_templates_dir()
@@ -7,8 +7,20 @@ from PySide6.QtWidgets import (
     QSlider,
     QLabel,
     QHBoxLayout,
+    QCheckBox,
+    QGroupBox,
+    QLineEdit,
+    QListWidget,
+    QListWidgetItem,
+    QMessageBox,
+    QPushButton,
 )
 
+from app.services.encoders import ENCODER_PRESETS, PNG_STRATEGIES, JPEG_SUBSAMPLINGS
+from app.services.pipeline import DEFAULT_MEMORY_BUDGET_MB
+from app.services.image_cache import DEFAULT_PREVIEW_CACHE_MB
+from app.services.export import NAMING_MODES, describe_rendition, normalize_rendition, rendition_from_settings, same_output
+
 
 class _NoWheelMixin:
     def wheelEvent(self, event):
@@ -26,17 +38,55 @@ class NoWheelComboBox(_NoWheelMixin, QComboBox):
 class ExportPanel(QWidget):
     settingsChanged = Signal(dict)
 
+    # 编码预设下拉框索引与预设名的映射（0 为自定义）
+    _PRESET_KEYS = ["custom", "fast", "balanced", "small"]
+    _FORMATS = ["PNG", "JPEG", "WEBP"]
+
     def __init__(self, parent=None) -> None:
         super().__init__(parent)
+        self._applying_preset = False
 
         # 导出格式（保持与 MainWindow 期望的字段名一致）
         self.format = NoWheelComboBox()
-        self.format.addItems(["PNG", "JPEG"])  # index: 0->PNG, 1->JPEG
+        self.format.addItems(["PNG", "JPEG", "WebP"])  # index: 0->PNG, 1->JPEG, 2->WEBP
         # JPEG 质量
         self.quality = NoWheelSlider(Qt.Orientation.Horizontal)
         self.quality.setRange(0, 100)
         self.quality.setValue(90)
 
+        # 编码预设：速度优先/均衡/体积优先，手动修改编码参数后回到“自定义”
+        self.encoder_preset = NoWheelComboBox()
+        self.encoder_preset.addItems(["自定义", "速度优先", "均衡", "体积优先"])
+
+        # PNG：压缩级别与压缩策略
+        self.png_level = NoWheelSpinBox()
+        self.png_level.setRange(0, 9)
+        self.png_level.setValue(6)
+        self.png_strategy = NoWheelComboBox()
+        self.png_strategy.addItems(["默认", "快速", "最小体积"])  # 与 PNG_STRATEGIES 顺序一致
+
+        # JPEG：渐进式、哈夫曼优化、色度抽样
+        self.jpeg_progressive = QCheckBox("渐进式")
+        self.jpeg_optimize = QCheckBox("优化编码")
+        jpeg_opts_layout = QHBoxLayout()
+        jpeg_opts_layout.setContentsMargins(0, 0, 0, 0)
+        jpeg_opts_layout.addWidget(self.jpeg_progressive)
+        jpeg_opts_layout.addWidget(self.jpeg_optimize)
+        self.jpeg_opts_widget = QWidget()
+        self.jpeg_opts_widget.setLayout(jpeg_opts_layout)
+        self.jpeg_subsampling = NoWheelComboBox()
+        self.jpeg_subsampling.addItems(list(JPEG_SUBSAMPLINGS))
+        self.jpeg_subsampling.setCurrentIndex(2)
+
+        # WebP：有损/无损、质量、压缩方法（0 最快，6 最小）
+        self.webp_lossless = QCheckBox("无损")
+        self.webp_quality = NoWheelSlider(Qt.Orientation.Horizontal)
+        self.webp_quality.setRange(0, 100)
+        self.webp_quality.setValue(85)
+        self.webp_method = NoWheelSpinBox()
+        self.webp_method.setRange(0, 6)
+        self.webp_method.setValue(4)
+
         # 尺寸调整模式：与 MainWindow 的索引映射保持一致
         # 0:none, 1:width, 2:height, 3:percent
         self.resize_mode = NoWheelComboBox()
@@ -45,41 +95,263 @@ class ExportPanel(QWidget):
         self.resize_value.setRange(1, 10000)
         self.resize_value.setValue(100)
 
+        # 批量导出性能：在途像素内存预算与并发数（0 为按预算与 CPU 自动）
+        self.memory_budget = NoWheelSpinBox()
+        self.memory_budget.setRange(256, 65536)
+        self.memory_budget.setSingleStep(256)
+        self.memory_budget.setSuffix(" MB")
+        self.memory_budget.setValue(DEFAULT_MEMORY_BUDGET_MB)
+        self.max_workers = NoWheelSpinBox()
+        self.max_workers.setRange(0, 64)
+        self.max_workers.setSpecialValueText("自动")
+        self.max_workers.setValue(0)
+        # 预览已解码图片缓存上限（0 为不缓存）
+        self.preview_cache = NoWheelSpinBox()
+        self.preview_cache.setRange(0, 16384)
+        self.preview_cache.setSingleStep(128)
+        self.preview_cache.setSuffix(" MB")
+        self.preview_cache.setValue(DEFAULT_PREVIEW_CACHE_MB)
+
         layout = QFormLayout(self)
         layout.addRow("导出格式", self.format)
+        layout.addRow("编码预设", self.encoder_preset)
         layout.addRow("JPEG质量", self.quality)
+        layout.addRow("JPEG选项", self.jpeg_opts_widget)
+        layout.addRow("色度抽样", self.jpeg_subsampling)
+        layout.addRow("PNG压缩级别", self.png_level)
+        layout.addRow("PNG压缩策略", self.png_strategy)
+        layout.addRow("WebP模式", self.webp_lossless)
+        layout.addRow("WebP质量", self.webp_quality)
+        layout.addRow("WebP压缩方法", self.webp_method)
         layout.addRow("尺寸调整", self.resize_mode)
         layout.addRow("调整值", self.resize_value)
 
+        # 多规格导出：每个规格记录格式、编码、尺寸、命名与子文件夹，
+        # 批量导出时每张源图只解码合成一次，再扇出到所有规格
+        self.rend_name = QLineEdit()
+        self.rend_name.setPlaceholderText("规格名称，如 web")
+        self.rend_naming = NoWheelComboBox()
+        self.rend_naming.addItems(["保留原文件名", "添加前缀", "添加后缀"])  # 与 NAMING_MODES 顺序一致
+        self.rend_naming_value = QLineEdit()
+        self.rend_naming_value.setPlaceholderText("前缀/后缀")
+        self.rend_subdir = QLineEdit()
+        self.rend_subdir.setPlaceholderText("子文件夹（可留空）")
+        self.rend_list = QListWidget()
+        self.rend_list.setMaximumHeight(110)
+        self.rend_add_btn = QPushButton("以当前设置添加规格")
+        self.rend_remove_btn = QPushButton("移除选中规格")
+        rend_btn_layout = QHBoxLayout()
+        rend_btn_layout.setContentsMargins(0, 0, 0, 0)
+        rend_btn_layout.addWidget(self.rend_add_btn)
+        rend_btn_layout.addWidget(self.rend_remove_btn)
+
+        rend_layout = QFormLayout()
+        rend_layout.addRow("名称", self.rend_name)
+        rend_layout.addRow("命名", self.rend_naming)
+        rend_layout.addRow("前缀/后缀", self.rend_naming_value)
+        rend_layout.addRow("子文件夹", self.rend_subdir)
+        rend_layout.addRow(rend_btn_layout)
+        rend_layout.addRow(self.rend_list)
+        rend_layout.addRow(QLabel("未添加规格时按上方设置导出单一规格"))
+        rend_group = QGroupBox("多规格导出")
+        rend_group.setLayout(rend_layout)
+        layout.addRow(rend_group)
+        layout.addRow("内存预算", self.memory_budget)
+        layout.addRow("并发数", self.max_workers)
+        layout.addRow("预览缓存", self.preview_cache)
+
         self.format.currentIndexChanged.connect(self._emit)
+        self.format.currentIndexChanged.connect(self._update_visibility)
         self.quality.valueChanged.connect(self._emit)
         self.resize_mode.currentIndexChanged.connect(self._emit)
         self.resize_value.valueChanged.connect(self._emit)
+        self.encoder_preset.currentIndexChanged.connect(self._on_preset_changed)
+
+        # 编码参数：手动修改时切回“自定义”预设
+        for sig in (
+            self.png_level.valueChanged,
+            self.png_strategy.currentIndexChanged,
+            self.jpeg_progressive.stateChanged,
+            self.jpeg_optimize.stateChanged,
+            self.jpeg_subsampling.currentIndexChanged,
+            self.webp_method.valueChanged,
+        ):
+            sig.connect(self._on_encoder_option_changed)
+        self.webp_lossless.stateChanged.connect(self._emit)
+        self.webp_quality.valueChanged.connect(self._emit)
+
+        self.memory_budget.valueChanged.connect(self._emit)
+        self.max_workers.valueChanged.connect(self._emit)
+        self.preview_cache.valueChanged.connect(self._emit)
+        self.rend_add_btn.clicked.connect(self._on_add_rendition)
+        self.rend_remove_btn.clicked.connect(self._on_remove_rendition)
+
+        self._update_visibility()
+
+    def _update_visibility(self, *args) -> None:
+        # 整行（含左侧标签）一起隐藏，不留空白标签
+        fmt = self._FORMATS[self.format.currentIndex()]
+        layout = self.layout()
+        for widget, owner in (
+            (self.quality, "JPEG"),
+            (self.jpeg_opts_widget, "JPEG"),
+            (self.jpeg_subsampling, "JPEG"),
+            (self.png_level, "PNG"),
+            (self.png_strategy, "PNG"),
+            (self.webp_lossless, "WEBP"),
+            (self.webp_quality, "WEBP"),
+            (self.webp_method, "WEBP"),
+        ):
+            layout.setRowVisible(widget, fmt == owner)
+
+    def _on_preset_changed(self, index: int) -> None:
+        preset = ENCODER_PRESETS.get(self._PRESET_KEYS[index])
+        if preset:
+            self._applying_preset = True
+            try:
+                self._apply_encoder_options(preset)
+            finally:
+                self._applying_preset = False
+        self._emit()
+
+    def _on_encoder_option_changed(self, *args) -> None:
+        if not self._applying_preset and self.encoder_preset.currentIndex() != 0:
+            self.encoder_preset.blockSignals(True)
+            self.encoder_preset.setCurrentIndex(0)
+            self.encoder_preset.blockSignals(False)
+        if not self._applying_preset:
+            self._emit()
+
+    def _on_add_rendition(self) -> None:
+        rend = rendition_from_settings(
+            self.get_settings(),
+            name=self.rend_name.text().strip(),
+            naming_mode=NAMING_MODES[self.rend_naming.currentIndex()],
+            naming_value=self.rend_naming_value.text(),
+            subdir=self.rend_subdir.text(),
+        )
+        # 输出路径相同的两个规格会互相覆盖，要求以前缀/后缀或子文件夹区分
+        for other in self.get_renditions():
+            if same_output(rend, other):
+                QMessageBox.warning(self, "规格重复", f"与已有规格“{describe_rendition(other)}”的输出文件同名，"
+                                    "会互相覆盖。\n请设置不同的前缀/后缀或子文件夹。")
+                return
+        self._add_rendition_item(rend)
+        self._emit()
+
+    def _on_remove_rendition(self) -> None:
+        row = self.rend_list.currentRow()
+        if row >= 0:
+            self.rend_list.takeItem(row)
+            self._emit()
+
+    def _add_rendition_item(self, rend: dict) -> None:
+        item = QListWidgetItem(describe_rendition(rend))
+        item.setData(Qt.ItemDataRole.UserRole, dict(rend))
+        self.rend_list.addItem(item)
+
+    def get_renditions(self) -> list[dict]:
+        renditions = []
+        for i in range(self.rend_list.count()):
+            data = self.rend_list.item(i).data(Qt.ItemDataRole.UserRole)
+            if isinstance(data, dict):
+                renditions.append(dict(data))
+        return renditions
 
     def _emit(self, *args) -> None:
         self.settingsChanged.emit(self.get_settings())
 
     def get_settings(self) -> dict:
         return {
-            "format": "PNG" if self.format.currentIndex() == 0 else "JPEG",
+            "format": self._FORMATS[self.format.currentIndex()],
             "jpeg_quality": self.quality.value(),
+            "encoder_preset": self._PRESET_KEYS[self.encoder_preset.currentIndex()],
+            "png_compress_level": self.png_level.value(),
+            "png_strategy": PNG_STRATEGIES[self.png_strategy.currentIndex()],
+            "jpeg_progressive": self.jpeg_progressive.isChecked(),
+            "jpeg_optimize": self.jpeg_optimize.isChecked(),
+            "jpeg_subsampling": self.jpeg_subsampling.currentText(),
+            "webp_lossless": self.webp_lossless.isChecked(),
+            "webp_quality": self.webp_quality.value(),
+            "webp_method": self.webp_method.value(),
             "resize_mode": ["none", "width", "height", "percent"][self.resize_mode.currentIndex()],
             "resize_value": self.resize_value.value(),
+            "renditions": self.get_renditions(),
+            "memory_budget_mb": self.memory_budget.value(),
+            "max_workers": self.max_workers.value(),
+            "preview_cache_mb": self.preview_cache.value(),
         }
 
+    def _apply_encoder_options(self, settings: dict) -> None:
+        level = settings.get("png_compress_level")
+        if isinstance(level, int):
+            self.png_level.setValue(level)
+        strategy = settings.get("png_strategy")
+        if strategy in PNG_STRATEGIES:
+            self.png_strategy.setCurrentIndex(PNG_STRATEGIES.index(strategy))
+        progressive = settings.get("jpeg_progressive")
+        if isinstance(progressive, bool):
+            self.jpeg_progressive.setChecked(progressive)
+        optimize = settings.get("jpeg_optimize")
+        if isinstance(optimize, bool):
+            self.jpeg_optimize.setChecked(optimize)
+        subsampling = settings.get("jpeg_subsampling")
+        if subsampling in JPEG_SUBSAMPLINGS:
+            self.jpeg_subsampling.setCurrentIndex(JPEG_SUBSAMPLINGS.index(subsampling))
+        method = settings.get("webp_method")
+        if isinstance(method, int):
+            self.webp_method.setValue(method)
+
     def apply_settings(self, settings: dict) -> None:
         # 应用导出设置
         fmt = settings.get("format", "PNG")
-        self.format.setCurrentIndex(1 if fmt == "JPEG" else 0)
-        
+        self.format.setCurrentIndex(self._FORMATS.index(fmt) if fmt in self._FORMATS else 0)
+
         quality = settings.get("jpeg_quality", 90)
         if isinstance(quality, int):
             self.quality.setValue(quality)
-        
+
+        # 先应用具体编码参数，再恢复预设名（避免参数变化把预设重置为自定义）
+        self._applying_preset = True
+        try:
+            self._apply_encoder_options(settings)
+        finally:
+            self._applying_preset = False
+        preset = settings.get("encoder_preset", "custom")
+        self.encoder_preset.blockSignals(True)
+        self.encoder_preset.setCurrentIndex(
+            self._PRESET_KEYS.index(preset) if preset in self._PRESET_KEYS else 0
+        )
+        self.encoder_preset.blockSignals(False)
+
+        webp_lossless = settings.get("webp_lossless")
+        if isinstance(webp_lossless, bool):
+            self.webp_lossless.setChecked(webp_lossless)
+        webp_quality = settings.get("webp_quality")
+        if isinstance(webp_quality, int):
+            self.webp_quality.setValue(webp_quality)
+
         resize_mode = settings.get("resize_mode", "none")
         mode_index = {"none": 0, "width": 1, "height": 2, "percent": 3}.get(resize_mode, 0)
         self.resize_mode.setCurrentIndex(mode_index)
-        
+
         resize_value = settings.get("resize_value", 100)
         if isinstance(resize_value, int):
-            self.resize_value.setValue(resize_value)
\ No newline at end of file
+            self.resize_value.setValue(resize_value)
+
+        memory_budget = settings.get("memory_budget_mb")
+        if isinstance(memory_budget, int):
+            self.memory_budget.setValue(memory_budget)
+        max_workers = settings.get("max_workers")
+        if isinstance(max_workers, int):
+            self.max_workers.setValue(max_workers)
+        preview_cache = settings.get("preview_cache_mb")
+        if isinstance(preview_cache, int):
+            self.preview_cache.setValue(preview_cache)
+
+        renditions = settings.get("renditions")
+        if isinstance(renditions, list):
+            self.rend_list.clear()
+            for rend in renditions:
+                if isinstance(rend, dict):
+                    self._add_rendition_item(normalize_rendition(rend))
@@ -1,6 +1,8 @@
 from pathlib import Path
-from PySide6.QtCore import Qt, QSize
-from PySide6.QtGui import QAction, QKeySequence, QIcon, QPixmap
+import sqlite3
+import time
+from PySide6.QtCore import Qt, QSize, QEvent, QPoint, QTimer
+from PySide6.QtGui import QAction, QActionGroup, QBrush, QKeySequence, QIcon, QImage, QPalette, QPixmap
 from PySide6.QtWidgets import (
     QMainWindow,
     QFileDialog,
@@ -11,11 +13,30 @@ from PySide6.QtWidgets import (
     QDockWidget,
     QInputDialog,
     QScrollArea,
+    QProgressDialog,
+    QApplication,
 )
 
 from .preview_view import PreviewView
 from .watermark_panel import WatermarkPanel
 from .export_panel import ExportPanel
+from .telemetry_panel import TelemetryPanel
+from app.services.encoders import extension_for, format_for_suffix, save_qimage
+from app.services.export import rendition_from_settings, resize_qimage
+from app.services.compositor import bind_tokens, render_stack
+from app.services.pipeline import DEFAULT_MEMORY_BUDGET_MB, BatchExporter, run_with_progress
+from app.services.streaming import can_stream
+from app.services.image_cache import DecodedImageCache
+from app.services.prefetch import ImagePrefetcher
+from app.services.spec import WatermarkSpec
+from app.services.session import SessionJournal, load_session_index, save_session_index
+from app.services.thumbnails import ThumbnailCache, ThumbnailOverlays
+from app.services.proof import ProofSheet, write_proof_sheets
+from app.services.telemetry import ExportHistory, history_record
+from app.services.fingerprint import FingerprintIndex, collapse_duplicates
+from app.services.probe import MetadataIndex
+from app.services.library import LibraryCatalog
+from app.services.tokens import stack_templated, token_context
 
 
 class MainWindow(QMainWindow):
@@ -77,16 +98,73 @@ class MainWindow(QMainWindow):
         export_dock.setAllowedAreas(Qt.DockWidgetArea.RightDockWidgetArea | Qt.DockWidgetArea.LeftDockWidgetArea)
         self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, export_dock)
 
+        # 导出监控面板：与导出设置同列，以标签页切换
+        self.telemetry_panel = TelemetryPanel(self)
+        telemetry_dock = QDockWidget("导出监控", self)
+        telemetry_dock.setObjectName("DockTelemetry")
+        telemetry_dock.setWidget(self.telemetry_panel)
+        telemetry_dock.setMaximumWidth(380)
+        telemetry_dock.setAllowedAreas(Qt.DockWidgetArea.RightDockWidgetArea | Qt.DockWidgetArea.LeftDockWidgetArea)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, telemetry_dock)
+        self.tabifyDockWidget(export_dock, telemetry_dock)
+        export_dock.raise_()
+        self._export_history = ExportHistory()
+        self.telemetry_panel.set_history(self._export_history.records())
+
         # 当前选中图片路径与每图自定义位置映射（会话内保存）
         self._current_image_path: str | None = None
         self._per_image_custom_pos: dict[str, dict] = {}
+        # 已解码图片缓存（与预取线程共用）；后台预解码相邻图片，记录上次行号以判断浏览方向
+        self._image_cache = DecodedImageCache(self.export_panel.get_settings()["preview_cache_mb"] * 1024 * 1024)
+        self._prefetcher = ImagePrefetcher(self._image_cache)
+        self._last_row: int = -1
+        self._browse_step: int = 1
+        # 会话日志（图片列表、每图坐标、导出设置）与缩略图磁盘缓存
+        self._session = SessionJournal()
+        self._thumbs = ThumbnailCache(self.list_widget.iconSize().width())
+        # 缩略图按需分批生成：优先可见行，其余在空闲时补齐
+        self._icon_row: int = 0
+        # 路径 → 图标绘制时的代数；水印设置变化后代数加一，各行按需重绘
+        self._icon_done: dict[str, int] = {}
+        self._icon_gen: int = 0
+        self._icon_timer = QTimer(self)
+        self._icon_timer.setInterval(0)
+        self._icon_timer.timeout.connect(self._fill_icons)
+        # 可选：缩略图上叠加当前水印。原始缩略图留在内存中，设置变化时只重新贴叠加层
+        self._thumb_images: dict[str, QImage | None] = {}
+        self._thumb_overlays = ThumbnailOverlays()
+        self._icon_wm_enabled = False
+        self._icon_wm_spec: WatermarkSpec | None = None
+        self._icon_wm_layer = None
+        self._icon_wm_specs: dict[tuple, WatermarkSpec] = {}
+        self._icon_wm_timer = QTimer(self)
+        self._icon_wm_timer.setSingleShot(True)
+        self._icon_wm_timer.setInterval(300)
+        self._icon_wm_timer.timeout.connect(self._refresh_icon_watermarks)
+        # 后台计算内容指纹，标记换名或重复导入的同一张照片（重复路径 → 最先导入的路径）
+        self._fingerprints = FingerprintIndex()
+        self._dup_of: dict[str, str] = {}
+        self._dup_timer = QTimer(self)
+        self._dup_timer.setInterval(200)
+        self._dup_timer.timeout.connect(self._poll_duplicates)
+        # 导入时只读文件头记录尺寸、格式、方向等元数据，供排序、筛选与导出调度使用
+        self._metadata = MetadataIndex()
+        # 列表筛选条件（MetadataIndex.filter 的参数）；None 表示显示全部
+        self._list_filter: dict | None = None
+        # 可选的 SQLite 图库：用户首次“加入图库”时创建，之后启动时直接打开
+        self._catalog: LibraryCatalog | None = None
+        if LibraryCatalog.exists():
+            try:
+                self._catalog = LibraryCatalog()
+            except sqlite3.Error:
+                self._catalog = None
+        self._thumbs.catalog = self._catalog
 
         self._setup_actions()
         self._setup_connections()
         
         # 启动时自动加载上次会话
         # 延迟调用，确保UI已完全初始化
-        from PySide6.QtCore import QTimer
         QTimer.singleShot(100, self._load_last_session_on_start)
 
     def _setup_actions(self) -> None:
@@ -110,6 +188,10 @@ class MainWindow(QMainWindow):
         export_all_action.setStatusTip("对列表中所有图片进行带水印导出到指定文件夹")
         export_all_action.triggered.connect(self._on_export_all)
 
+        proof_action = QAction("导出校样...", self)
+        proof_action.setStatusTip("把列表中的图片连同水印排成带文件名的缩略图校样（PDF 或 PNG）")
+        proof_action.triggered.connect(self._on_export_proof)
+
         exit_action = QAction("退出", self)
         exit_action.triggered.connect(self.close)
 
@@ -121,6 +203,7 @@ class MainWindow(QMainWindow):
         menu.addSeparator()
         menu.addAction(export_action)
         menu.addAction(export_all_action)
+        menu.addAction(proof_action)
         menu.addSeparator()
         menu.addAction(exit_action)
 
@@ -128,6 +211,12 @@ class MainWindow(QMainWindow):
         view_menu = self.menuBar().addMenu("视图")
         view_menu.addAction(self.findChild(QDockWidget, "DockWatermark").toggleViewAction())
         view_menu.addAction(self.findChild(QDockWidget, "DockExport").toggleViewAction())
+        view_menu.addAction(self.findChild(QDockWidget, "DockTelemetry").toggleViewAction())
+        icon_wm_action = QAction("缩略图显示水印", self)
+        icon_wm_action.setCheckable(True)
+        icon_wm_action.setStatusTip("在列表缩略图上按导出时的位置叠加当前水印")
+        icon_wm_action.toggled.connect(self._on_icon_watermark_toggled)
+        view_menu.addAction(icon_wm_action)
         # 缩放相关操作
         zoom_in_action = QAction("放大", self)
         # 兼容不同键盘布局：标准ZoomIn、Ctrl++、Ctrl+=
@@ -149,6 +238,38 @@ class MainWindow(QMainWindow):
         reset_zoom_action.setStatusTip("重置为按窗口适配")
         reset_zoom_action.triggered.connect(self.preview.reset_zoom)
 
+        # 列表排序：只读元数据表，不解码像素
+        sort_menu = view_menu.addMenu("列表排序")
+        for label, key, reverse in (
+            ("按文件名", "name", False),
+            ("按修改时间（新→旧）", "mtime", True),
+            ("按文件大小（大→小）", "file_size", True),
+            ("按像素数（大→小）", "pixels", True),
+            ("按格式", "format", False),
+        ):
+            act = QAction(label, self)
+            act.triggered.connect(lambda _=False, k=key, r=reverse: self._sort_list(k, r))
+            sort_menu.addAction(act)
+
+        # 列表筛选：同样只读元数据表，只隐藏列表行，不影响批量导出的范围
+        filter_menu = view_menu.addMenu("列表筛选")
+        filter_group = QActionGroup(self)
+        for label, criteria in (
+            ("显示全部", None),
+            ("仅 JPEG", {"formats": ["JPEG"]}),
+            ("仅 PNG", {"formats": ["PNG"]}),
+            ("仅 TIFF", {"formats": ["TIFF"]}),
+            ("仅横图", {"shape": "landscape"}),
+            ("仅竖图", {"shape": "portrait"}),
+            ("仅方图", {"shape": "square"}),
+        ):
+            act = QAction(label, self)
+            act.setCheckable(True)
+            act.setChecked(criteria is None)
+            act.triggered.connect(lambda _=False, c=criteria: self._set_list_filter(c))
+            filter_group.addAction(act)
+            filter_menu.addAction(act)
+
         view_menu.addSeparator()
         view_menu.addAction(zoom_in_action)
         view_menu.addAction(zoom_out_action)
@@ -173,11 +294,52 @@ class MainWindow(QMainWindow):
         tpl_menu.addAction(act_rename_tpl)
         tpl_menu.addAction(act_delete_tpl)
 
+        # 图库菜单
+        lib_menu = self.menuBar().addMenu("图库")
+        act_lib_add = QAction("将列表加入图库", self)
+        act_lib_add.setStatusTip("把当前列表中的图片（含元数据与自定义坐标）保存到本地图库")
+        act_lib_add.triggered.connect(self._on_library_add)
+        act_lib_folder = QAction("打开图库文件夹...", self)
+        act_lib_folder.setStatusTip("从图库载入某个文件夹（含子文件夹）中的图片")
+        act_lib_folder.triggered.connect(self._on_library_open_folder)
+        act_lib_pending = QAction("载入尚未导出的图片", self)
+        act_lib_pending.setStatusTip("从图库载入从未导出过的图片")
+        act_lib_pending.triggered.connect(self._on_library_pending)
+        act_lib_all = QAction("载入全部图库图片", self)
+        act_lib_all.triggered.connect(self._on_library_all)
+        act_lib_history = QAction("当前图片的导出记录...", self)
+        act_lib_history.setStatusTip("查看当前图片在图库中记录的历次导出")
+        act_lib_history.triggered.connect(self._on_library_history)
+        act_lib_reset = QAction("将选中图片标记为未导出", self)
+        act_lib_reset.setStatusTip("清除选中图片的导出状态，导出记录保留")
+        act_lib_reset.triggered.connect(self._on_library_reset_exported)
+        lib_menu.addAction(act_lib_add)
+        lib_menu.addSeparator()
+        lib_menu.addAction(act_lib_folder)
+        lib_menu.addAction(act_lib_pending)
+        lib_menu.addAction(act_lib_all)
+        lib_menu.addSeparator()
+        lib_menu.addAction(act_lib_history)
+        lib_menu.addAction(act_lib_reset)
+
     def _setup_connections(self) -> None:
         self.list_widget.itemSelectionChanged.connect(self._on_list_selection_changed)
         self.wm_panel.settingsChanged.connect(self.preview.set_watermark_settings)
+        self.wm_panel.settingsChanged.connect(self._schedule_icon_watermarks)
         # 拖拽释放后坐标改变信号：同步到所有图片
         self.preview.positionChanged.connect(self._on_preview_position_changed)
+        self.export_panel.settingsChanged.connect(self._on_export_settings_changed)
+        self.list_widget.verticalScrollBar().valueChanged.connect(self._schedule_icons)
+
+    def _on_export_settings_changed(self, settings: dict) -> None:
+        self._image_cache.set_max_bytes(int(settings.get("preview_cache_mb", 0)) * 1024 * 1024)
+        self._session.set_export_settings(settings)
+
+    def changeEvent(self, event) -> None:
+        # 窗口最小化时把预览缓存收缩到四分之一，把内存让给其他程序
+        if event.type() == QEvent.Type.WindowStateChange and self.isMinimized():
+            self._image_cache.trim(0.25)
+        super().changeEvent(event)
 
     def _on_open_images(self) -> None:
         files, _ = QFileDialog.getOpenFileNames(
@@ -192,12 +354,28 @@ class MainWindow(QMainWindow):
 
     def _on_clear_list(self) -> None:
         self.list_widget.clear()
+        self._fingerprints.clear()
+        self._dup_of.clear()
+        self._metadata.clear()
+        self._icon_row = 0
+        self._icon_done.clear()
+        self._thumb_images.clear()
+        self._per_image_custom_pos.clear()
+        self._session.clear()
 
     def _on_remove_selected(self) -> None:
         row = self.list_widget.currentRow()
         if row >= 0:
             item = self.list_widget.takeItem(row)
+            path = item.data(Qt.ItemDataRole.UserRole)
+            self._per_image_custom_pos.pop(path, None)
+            self._session.remove_path(path)
+            self._icon_row = min(self._icon_row, row)
+            self._icon_done.pop(path, None)
+            self._thumb_images.pop(path, None)
             del item
+            self._forget_duplicate_source(path)
+            self._metadata.forget([path])
 
     def _load_last_session_on_start(self):
         from app.services.templates import load_last_session
@@ -208,6 +386,32 @@ class MainWindow(QMainWindow):
             # 应用到面板与预览
             self.wm_panel.apply_settings(data)
             self.preview.set_watermark_settings(data)
+        self._restore_session()
+        # 首帧之后在后台线程枚举系统字体并刷新快照；结果到达前下拉列表显示快照
+        self.wm_panel.font_family.load_in_background()
+
+    def _restore_session(self) -> None:
+        """重放会话日志：列表项立即恢复，缩略图与预览按需延后加载"""
+        state = self._session.load()
+        if state.export_settings:
+            self.export_panel.apply_settings(state.export_settings)
+        if state.paths:
+            # 上次退出时保存的元数据与指纹直接预填，恢复的图片不再探测文件头、不再读取内容；
+            # 文件在两次启动之间被修改时，按 mtime 与大小在使用时重算
+            infos, fingerprints = load_session_index()
+            listed = set(state.paths)
+            for path, info in infos.items():
+                if path in listed:
+                    self._metadata.put(info)
+            self._fingerprints.seed({p: v for p, v in fingerprints.items() if p in listed})
+            # 不逐个检查文件是否存在，失效路径在选中时才提示
+            self._add_files_to_list(state.paths, check_exists=False, record=False)
+        self._per_image_custom_pos.update({p: dict(v) for p, v in state.custom_pos.items() if v})
+        if state.current:
+            for i in range(self.list_widget.count()):
+                if self.list_widget.item(i).data(Qt.ItemDataRole.UserRole) == state.current:
+                    self.list_widget.setCurrentRow(i)
+                    break
     
     def _on_list_selection_changed(self) -> None:
         items = self.list_widget.selectedItems()
@@ -230,17 +434,24 @@ class MainWindow(QMainWindow):
                     saved["pos_y_pct"] = prev.get("pos_y_pct")
                 if saved:
                     self._per_image_custom_pos[self._current_image_path] = saved
+                    self._session.set_pos(self._current_image_path, saved)
         # 更新当前路径
         self._current_image_path = file_path
+        self._session.set_current(file_path)
         
-        if not self.preview.load_image(file_path):
+        row = self.list_widget.row(item)
+        # 文本令牌 {index} 在预览中按列表序号展开，与导出一致
+        self.preview.token_index = row + 1
+        if not self.preview.load_image(file_path, self._prefetcher.load(file_path)):
+            self._prefetch_neighbors(row)
             QMessageBox.warning(self, "加载失败", "无法加载所选图片，请检查格式或文件是否损坏。")
         else:
             # 列表选择变化后，重新应用当前水印设置
             panel_settings = self.wm_panel.get_settings()
             # 优先恢复该图片的自定义位置（若曾保存）
             saved_pos = self._per_image_custom_pos.get(file_path)
-            if isinstance(saved_pos, dict):
+            # 平铺模式覆盖整图，不受单图自定义坐标影响
+            if isinstance(saved_pos, dict) and panel_settings.get("position") != "tile":
                 panel_settings["position"] = "custom"
                 if "pos_x" in saved_pos and "pos_y" in saved_pos:
                     panel_settings["pos_x"] = saved_pos.get("pos_x")
@@ -250,26 +461,343 @@ class MainWindow(QMainWindow):
                     panel_settings["pos_y_pct"] = saved_pos.get("pos_y_pct")
             # 注意：仅当该图片确有自定义坐标时才强制 position=custom，否则保留面板当前的 position 设置
             self.preview.set_watermark_settings(panel_settings)
+            self._prefetch_neighbors(row)
 
-    def _add_files_to_list(self, files: list[str]) -> None:
+    def _prefetch_neighbors(self, row: int) -> None:
+        """预取当前行的前后图片，以及浏览方向上再往前一张"""
+        if self._last_row >= 0 and row != self._last_row:
+            self._browse_step = 1 if row > self._last_row else -1
+        self._last_row = row
+        step = self._browse_step
+        paths = []
+        for r in (row + step, row - step, row + 2 * step):
+            item = self.list_widget.item(r) if 0 <= r < self.list_widget.count() else None
+            if item is not None:
+                paths.append(item.data(Qt.ItemDataRole.UserRole))
+        self._prefetcher.prefetch(paths)
+
+    def _add_files_to_list(self, files: list[str], check_exists: bool = True, record: bool = True) -> None:
         exts = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff"}
-        for f in files:
-            p = Path(f)
-            if not p.exists():
-                continue
-            if p.suffix.lower() not in exts:
-                continue
-            item = QListWidgetItem(p.name)
-            item.setToolTip(str(p))
-            item.setData(Qt.ItemDataRole.UserRole, str(p))
-            # 生成缩略图作为图标（保持比例，平滑缩放）
-            pix = QPixmap(str(p))
-            if not pix.isNull():
-                thumb = pix.scaled(self.list_widget.iconSize(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                item.setIcon(QIcon(thumb))
-            # 设置统一的行高（更紧凑：图标高度 + 边距6）
-            item.setSizeHint(QSize(0, self.list_widget.iconSize().height() + 6))
-            self.list_widget.addItem(item)
+        added: list[str] = []
+        # 同一路径只保留一项；内容相同但路径不同的图片由指纹索引在后台标记
+        listed = {self.list_widget.item(i).data(Qt.ItemDataRole.UserRole) for i in range(self.list_widget.count())}
+        row_height = QSize(0, self.list_widget.iconSize().height() + 6)
+        # 大批量添加时暂停重绘；缩略图不在此处解码，由 _fill_icons 分批补齐
+        self.list_widget.setUpdatesEnabled(False)
+        try:
+            for f in files:
+                p = Path(f)
+                if p.suffix.lower() not in exts:
+                    continue
+                if check_exists and not p.exists():
+                    continue
+                if str(p) in listed:
+                    continue
+                listed.add(str(p))
+                item = QListWidgetItem(p.name)
+                item.setToolTip(str(p))
+                item.setData(Qt.ItemDataRole.UserRole, str(p))
+                # 设置统一的行高（更紧凑：图标高度 + 边距6）
+                item.setSizeHint(row_height)
+                self.list_widget.addItem(item)
+                added.append(str(p))
+        finally:
+            self.list_widget.setUpdatesEnabled(True)
+        if record:
+            self._session.add_paths(added)
+        self._schedule_icons()
+        if added:
+            self._metadata.submit(added)
+            self._fingerprints.submit(added)
+            self._dup_timer.start()
+            if self._list_filter is not None:
+                self._apply_list_filter()
+
+    def _sort_list(self, key: str, reverse: bool = False) -> None:
+        """按元数据重排列表；从末尾逐个取出列表项，避免大列表反复搬移"""
+        lw = self.list_widget
+        current = self._current_image_path
+        paths = [lw.item(i).data(Qt.ItemDataRole.UserRole) for i in range(lw.count())]
+        self._metadata.ensure(paths)
+        lw.setUpdatesEnabled(False)
+        lw.blockSignals(True)
+        try:
+            items = [lw.takeItem(i) for i in range(lw.count() - 1, -1, -1)]
+            by_path = {item.data(Qt.ItemDataRole.UserRole): item for item in items}
+            for path in self._metadata.sorted_paths(by_path, key, reverse):
+                lw.addItem(by_path[path])
+            if current in by_path:
+                lw.setCurrentItem(by_path[current])
+        finally:
+            lw.blockSignals(False)
+            lw.setUpdatesEnabled(True)
+        self._icon_row = 0
+        self._schedule_icons()
+        # 取出再放回的列表项会丢失隐藏状态
+        if self._list_filter is not None:
+            self._apply_list_filter()
+
+    def _set_list_filter(self, criteria: dict | None) -> None:
+        self._list_filter = criteria
+        self._apply_list_filter()
+
+    def _apply_list_filter(self) -> None:
+        """按当前筛选条件隐藏不符合的列表行；条件为 None 时全部显示"""
+        lw = self.list_widget
+        paths = [lw.item(i).data(Qt.ItemDataRole.UserRole) for i in range(lw.count())]
+        if self._list_filter is None:
+            visible = set(paths)
+        else:
+            self._metadata.ensure(paths)
+            visible = set(self._metadata.filter(paths, **self._list_filter))
+        lw.setUpdatesEnabled(False)
+        try:
+            for i, path in enumerate(paths):
+                lw.setRowHidden(i, path not in visible)
+        finally:
+            lw.setUpdatesEnabled(True)
+
+    def _library(self) -> LibraryCatalog | None:
+        """打开（必要时创建）图库；失败时提示并返回 None"""
+        if self._catalog is None:
+            try:
+                self._catalog = LibraryCatalog()
+            except (OSError, sqlite3.Error) as e:
+                QMessageBox.warning(self, "图库不可用", f"无法打开图库数据库：\n{e}")
+                return None
+            self._thumbs.catalog = self._catalog
+        return self._catalog
+
+    def _list_paths(self) -> list[str]:
+        return [self.list_widget.item(i).data(Qt.ItemDataRole.UserRole) for i in range(self.list_widget.count())]
+
+    def _sync_library_placements(self) -> None:
+        """把每图自定义坐标写回图库（只更新图库中已有的图片）"""
+        if self._catalog is None:
+            return
+        placements: dict[str, dict | None] = {p: None for p in self._list_paths()}
+        placements.update(self._per_image_custom_pos)
+        try:
+            self._catalog.set_placements(placements)
+        except sqlite3.Error:
+            pass
+
+    def _on_library_add(self) -> None:
+        paths = self._list_paths()
+        if not paths:
+            QMessageBox.information(self, "列表为空", "请先导入图片。")
+            return
+        catalog = self._library()
+        if catalog is None:
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            # 后台探测通常已完成，这里只补齐剩余的文件头
+            self._metadata.ensure(paths)
+            infos = {p: info for p in paths if (info := self._metadata.get(p)) is not None}
+            # 只保存与所记元数据同一版本文件的指纹，重新载入时据此跳过重算
+            fingerprints = {
+                p: key for p, (stamp, key) in self._fingerprints.quick_keys(infos).items()
+                if stamp == (infos[p].mtime_ns, infos[p].file_size)
+            }
+            catalog.add(paths, infos, fingerprints)
+            self._sync_library_placements()
+        finally:
+            QApplication.restoreOverrideCursor()
+        QMessageBox.information(self, "已加入图库", f"已将 {len(paths)} 张图片加入图库（共 {len(catalog)} 张）。")
+
+    def _on_library_open_folder(self) -> None:
+        if self._library() is None:
+            return
+        folder = QFileDialog.getExistingDirectory(self, "选择图库文件夹", str(Path.home()))
+        if folder:
+            self._load_from_library(self._catalog.query(folder=folder))
+
+    def _on_library_pending(self) -> None:
+        if self._library() is not None:
+            self._load_from_library(self._catalog.query(exported=False))
+
+    def _on_library_all(self) -> None:
+        if self._library() is not None:
+            self._load_from_library(self._catalog.query())
+
+    def _load_from_library(self, infos) -> None:
+        """用图库查询结果替换当前列表
+
+        元数据、内容指纹与坐标直接取自图库：已记录的图片不再探测文件头、不再读取
+        内容计算指纹，坐标只追加一条会话日志。
+        """
+        if not infos:
+            QMessageBox.information(self, "图库", "没有符合条件的图片。")
+            return
+        self._sync_library_placements()
+        self._on_clear_list()
+        for info in infos:
+            if info.width > 0:
+                self._metadata.put(info)
+        paths = [info.path for info in infos]
+        self._fingerprints.seed(self._catalog.fingerprints(paths))
+        self._add_files_to_list(paths, check_exists=False)
+        placements = self._catalog.placements(paths)
+        for path, pos in placements.items():
+            self._per_image_custom_pos[path] = dict(pos)
+        self._session.set_pos_many(placements)
+
+    def _on_library_history(self) -> None:
+        """显示当前图片在图库中的导出记录"""
+        path = self._current_image_path
+        if not path:
+            QMessageBox.information(self, "导出记录", "请先在列表中选择图片。")
+            return
+        if self._library() is None:
+            return
+        history = self._catalog.export_history(path)
+        if not history:
+            QMessageBox.information(self, "导出记录", f"{Path(path).name} 没有导出记录（或不在图库中）。")
+            return
+        lines = [
+            f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(ts))}  {out}" + (f"  [{tpl[:8]}]" if tpl else "")
+            for ts, out, tpl in history[:20]
+        ]
+        if len(history) > 20:
+            lines.append(f"……共 {len(history)} 条")
+        QMessageBox.information(self, "导出记录", f"{Path(path).name}\n\n" + "\n".join(lines))
+
+    def _on_library_reset_exported(self) -> None:
+        """把选中的图片重新标记为未导出，使其出现在“尚未导出”中"""
+        paths = [item.data(Qt.ItemDataRole.UserRole) for item in self.list_widget.selectedItems()]
+        if not paths:
+            QMessageBox.information(self, "未选择", "请先在列表中选择图片。")
+            return
+        if self._library() is None:
+            return
+        try:
+            self._catalog.reset_export_status(paths)
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "图库", f"无法更新图库：\n{e}")
+
+    def _items_by_path(self, paths) -> dict[str, QListWidgetItem]:
+        wanted = set(paths)
+        found: dict[str, QListWidgetItem] = {}
+        for i in range(self.list_widget.count()):
+            item = self.list_widget.item(i)
+            path = item.data(Qt.ItemDataRole.UserRole)
+            if path in wanted:
+                found[path] = item
+        return found
+
+    def _poll_duplicates(self) -> None:
+        """取回后台发现的重复图片并在列表中标记；指纹全部算完后停止轮询"""
+        events = self._fingerprints.drain()
+        if events:
+            items = self._items_by_path(p for p, _ in events)
+            for path, original in events:
+                item = items.get(path)
+                if item is None:
+                    continue
+                self._dup_of[path] = original
+                item.setText(f"{Path(path).name}（重复）")
+                item.setToolTip(f"{path}\n与 {original} 内容相同，导出时只渲染一次")
+                item.setForeground(self.list_widget.palette().brush(QPalette.ColorGroup.Disabled, QPalette.ColorRole.Text))
+        if not self._fingerprints.pending():
+            self._dup_timer.stop()
+
+    def _forget_duplicate_source(self, path: str) -> None:
+        """移除列表项后，以它为原图的重复项需要重新比对"""
+        self._fingerprints.forget([path])
+        self._dup_of.pop(path, None)
+        orphans = [p for p, original in self._dup_of.items() if original == path]
+        if not orphans:
+            return
+        for p, item in self._items_by_path(orphans).items():
+            self._dup_of.pop(p, None)
+            item.setText(Path(p).name)
+            item.setToolTip(p)
+            item.setForeground(QBrush())
+        self._fingerprints.forget(orphans)
+        self._fingerprints.submit(orphans)
+        self._dup_timer.start()
+
+    def _schedule_icons(self, *args) -> None:
+        if not self._icon_timer.isActive():
+            self._icon_timer.start()
+
+    def _visible_rows(self) -> range:
+        lw = self.list_widget
+        top = lw.indexAt(QPoint(0, 0)).row()
+        bottom = lw.indexAt(QPoint(0, lw.viewport().height() - 1)).row()
+        if top < 0:
+            return range(0)
+        if bottom < 0:
+            bottom = lw.count() - 1
+        return range(top, bottom + 1)
+
+    def _load_icon(self, row: int) -> None:
+        # 本代已处理的路径不再重试（包括生成失败的）
+        item = self.list_widget.item(row)
+        path = item.data(Qt.ItemDataRole.UserRole)
+        if self._icon_done.get(path) == self._icon_gen:
+            return
+        self._icon_done[path] = self._icon_gen
+        if path in self._thumb_images:
+            thumb = self._thumb_images[path]
+        else:
+            thumb = self._thumb_images[path] = self._thumbs.get(path)
+        if thumb is None:
+            return
+        if self._icon_wm_layer is not None:
+            thumb = self._watermarked_thumb(path, row, thumb)
+        item.setIcon(QIcon(QPixmap.fromImage(thumb)))
+
+    def _watermarked_thumb(self, path: str, row: int, thumb: QImage) -> QImage:
+        """按导出时的摆放方式（原图尺寸取自元数据表）在缩略图上贴水印"""
+        width, height = self._metadata.dimensions(path)
+        spec = self._spec_for_path(path, self._icon_wm_spec, self._icon_wm_specs)
+        layer = self._icon_wm_layer
+        per_image = stack_templated(spec)
+        if per_image:
+            layer = bind_tokens(layer, spec, token_context(path, row + 1, width, height))
+        return self._thumb_overlays.compose(thumb, width, height, layer, spec, cache=not per_image)
+
+    def _on_icon_watermark_toggled(self, checked: bool) -> None:
+        self._icon_wm_enabled = checked
+        self._icon_wm_timer.stop()
+        self._refresh_icon_watermarks(force=True)
+
+    def _schedule_icon_watermarks(self, *args) -> None:
+        """水印设置或坐标变化后延迟刷新，拖动滑块时只在停下后重绘一次"""
+        if self._icon_wm_enabled:
+            self._icon_wm_timer.start()
+
+    def _refresh_icon_watermarks(self, force: bool = False) -> None:
+        """设置确有变化时图标代数加一，由 _fill_icons 先可见行、后其余行逐步重绘"""
+        spec = self.wm_panel.get_spec() if self._icon_wm_enabled else None
+        if not force and spec == self._icon_wm_spec:
+            return
+        self._icon_wm_spec = spec
+        self._icon_wm_specs = {}
+        self._icon_wm_layer = render_stack(spec) if spec is not None else None
+        if self._icon_wm_layer is not None and self._icon_wm_layer.isNull():
+            self._icon_wm_layer = None
+        self._thumb_overlays.clear()
+        self._icon_gen += 1
+        self._icon_row = 0
+        self._schedule_icons()
+
+    def _fill_icons(self) -> None:
+        """每次定时器回调最多占用约 15ms，先处理可见行，再顺序补齐其余行"""
+        deadline = time.perf_counter() + 0.015
+        for row in self._visible_rows():
+            self._load_icon(row)
+            if time.perf_counter() > deadline:
+                return
+        count = self.list_widget.count()
+        while self._icon_row < count:
+            self._load_icon(self._icon_row)
+            self._icon_row += 1
+            if time.perf_counter() > deadline:
+                return
+        self._icon_timer.stop()
 
     def _collect_current_settings(self) -> dict:
         # 从面板收集设置，并合并预览中的自定义位置（若存在）
@@ -292,6 +820,18 @@ class MainWindow(QMainWindow):
         from app.services.templates import save_last_session
         data = self._collect_current_settings()
         save_last_session(data)
+        # 退出时把会话日志压缩为快照，下次启动只需重放少量记录
+        self._session.compact()
+        self._session.close()
+        paths = self._list_paths()
+        save_session_index({p: info for p in paths if (info := self._metadata.get(p)) is not None},
+                           self._fingerprints.quick_keys(paths))
+        self._prefetcher.close()
+        self._fingerprints.close()
+        self._metadata.close()
+        if self._catalog is not None:
+            self._sync_library_placements()
+            self._catalog.close()
         super().closeEvent(event)
 
     def _on_save_template(self) -> None:
@@ -310,25 +850,21 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "保存失败", f"保存模板时出错：\n{str(e)}")
 
     def _on_load_template(self) -> None:
-        from app.services.templates import list_templates, load_template
+        from app.services.templates import get_catalog, list_templates, load_template
+        from .template_dialog import TemplatePickerDialog
         
-        # 获取模板列表
+        # 增量刷新模板索引（只解析有变化的文件）
         templates = list_templates()
         if not templates:
             QMessageBox.information(self, "无模板", "没有找到可用的模板。请先保存一个模板。")
             return
             
-        # 显示模板选择对话框
-        name, ok = QInputDialog.getItem(
-            self, 
-            "选择模板", 
-            "请选择要加载的模板：", 
-            templates, 
-            0, 
-            False
-        )
-        
-        if not ok or not name:
+        # 显示可搜索的模板选择对话框
+        dialog = TemplatePickerDialog(get_catalog(), "选择模板", self)
+        if dialog.exec() != TemplatePickerDialog.DialogCode.Accepted:
+            return
+        name = dialog.selected_name()
+        if not name:
             return
             
         # 加载模板
@@ -365,9 +901,11 @@ class MainWindow(QMainWindow):
                         path = item.data(Qt.ItemDataRole.UserRole)
                         if path:
                             self._per_image_custom_pos[path] = dict(saved)
+                    self._session.set_pos_all(saved)
             else:
                 # 非 custom 位置：清空所有图片的自定义坐标，确保九宫格等模板位置生效
                 self._per_image_custom_pos.clear()
+                self._session.clear_pos()
         
         QMessageBox.information(self, "已加载", f"模板已加载：\n{name}")
 
@@ -413,6 +951,42 @@ class MainWindow(QMainWindow):
         else:
             event.ignore()
 
+    def _spec_for_path(self, path: str, base_spec: WatermarkSpec,
+                       custom_specs: dict[tuple, WatermarkSpec]) -> WatermarkSpec:
+        """某张图片实际使用的水印规格：基础规格合并该图的自定义坐标
+
+        当前预览图片优先使用预览中的坐标；相同坐标的图片共用 custom_specs 中的同一个规格。
+        """
+        prev = getattr(self.preview, "_wm_settings", None)
+        pos_source = None
+        if base_spec.position == "tile":
+            # 平铺模式覆盖整图，不合并自定义坐标
+            pass
+        elif (
+            isinstance(prev, dict) and prev.get("position") == "custom" and
+            self._current_image_path and path == self._current_image_path
+        ):
+            pos_source = prev
+        else:
+            # 否则，如果曾为该图片保存过自定义坐标，则合并之
+            saved_pos = self._per_image_custom_pos.get(path)
+            if isinstance(saved_pos, dict):
+                pos_source = saved_pos
+        if pos_source is None:
+            return base_spec
+        changes = {"position": "custom"}
+        if "pos_x" in pos_source and "pos_y" in pos_source:
+            changes["pos_x"] = pos_source.get("pos_x")
+            changes["pos_y"] = pos_source.get("pos_y")
+        if "pos_x_pct" in pos_source and "pos_y_pct" in pos_source:
+            changes["pos_x_pct"] = pos_source.get("pos_x_pct")
+            changes["pos_y_pct"] = pos_source.get("pos_y_pct")
+        key = tuple(sorted(changes.items()))
+        spec = custom_specs.get(key)
+        if spec is None:
+            spec = custom_specs[key] = base_spec.replace(**changes)
+        return spec
+
     def _on_export_all(self) -> None:
         count = self.list_widget.count()
         if count == 0:
@@ -422,119 +996,107 @@ class MainWindow(QMainWindow):
         if not out_dir:
             return
 
-        # 获取导出设置
+        # 获取导出设置：已定义多规格时按规格导出，否则按面板设置导出单一规格
         export_settings = self.export_panel.get_settings()
-        fmt = export_settings["format"]
-        ext = ".png" if fmt == "PNG" else ".jpg"
+        renditions = export_settings.get("renditions") or []
 
-        # 选择命名规则（保留原名/添加前缀/添加后缀）
-        mode_label, ok = QInputDialog.getItem(
-            self,
-            "文件命名规则",
-            "命名：",
-            ["保留原文件名", "添加前缀", "添加后缀"],
-            0,
-            False,
-        )
-        if not ok:
-            return
-        mode = "keep"
-        value = ""
-        if mode_label == "添加前缀":
-            mode = "prefix"
-            value, ok = QInputDialog.getText(self, "输入前缀", "前缀：", text="wm_")
-            if not ok:
-                return
-        elif mode_label == "添加后缀":
-            mode = "suffix"
-            value, ok = QInputDialog.getText(self, "输入后缀", "后缀：", text="_watermarked")
+        if not renditions:
+            # 选择命名规则（保留原名/添加前缀/添加后缀）
+            mode_label, ok = QInputDialog.getItem(
+                self,
+                "文件命名规则",
+                "命名：",
+                ["保留原文件名", "添加前缀", "添加后缀"],
+                0,
+                False,
+            )
             if not ok:
                 return
+            mode = "keep"
+            value = ""
+            if mode_label == "添加前缀":
+                mode = "prefix"
+                value, ok = QInputDialog.getText(self, "输入前缀", "前缀：", text="wm_")
+                if not ok:
+                    return
+            elif mode_label == "添加后缀":
+                mode = "suffix"
+                value, ok = QInputDialog.getText(self, "输入后缀", "后缀：", text="_watermarked")
+                if not ok:
+                    return
+            renditions = [rendition_from_settings(export_settings, naming_mode=mode, naming_value=value)]
 
         # 使用合并了预览自定义位置的设置，确保批量导出与预览一致
         # 注意：需要为每张图片单独合并自定义坐标，避免所有图片共享同一坐标
-        ok_count = 0
-        fail_items: list[str] = []
+        # 基础水印规格只从面板读取一次；相同坐标的图片共用同一个不可变规格
+        base_spec = self.wm_panel.get_spec()
+        custom_specs: dict[tuple, WatermarkSpec] = {}
+        tasks: list[tuple[str, WatermarkSpec]] = []
         for i in range(count):
-            item = self.list_widget.item(i)
-            src_path = Path(item.data(Qt.ItemDataRole.UserRole))
-            # 从面板获取基础水印参数
-            per_settings = dict(self.wm_panel.get_settings())
-            src_path_str = str(src_path)
-            # 如果是当前预览图片且存在自定义坐标，优先使用当前预览中的坐标
-            prev = getattr(self.preview, "_wm_settings", None)
-            if (
-                isinstance(prev, dict) and prev.get("position") == "custom" and
-                self._current_image_path and src_path_str == self._current_image_path
-            ):
-                per_settings["position"] = "custom"
-                if "pos_x" in prev and "pos_y" in prev:
-                    per_settings["pos_x"] = prev.get("pos_x")
-                    per_settings["pos_y"] = prev.get("pos_y")
-                if "pos_x_pct" in prev and "pos_y_pct" in prev:
-                    per_settings["pos_x_pct"] = prev.get("pos_x_pct")
-                    per_settings["pos_y_pct"] = prev.get("pos_y_pct")
-            else:
-                # 否则，如果曾为该图片保存过自定义坐标，则合并之
-                saved_pos = self._per_image_custom_pos.get(src_path_str)
-                if isinstance(saved_pos, dict):
-                    per_settings["position"] = "custom"
-                    if "pos_x" in saved_pos and "pos_y" in saved_pos:
-                        per_settings["pos_x"] = saved_pos.get("pos_x")
-                        per_settings["pos_y"] = saved_pos.get("pos_y")
-                    if "pos_x_pct" in saved_pos and "pos_y_pct" in saved_pos:
-                        per_settings["pos_x_pct"] = saved_pos.get("pos_x_pct")
-                        per_settings["pos_y_pct"] = saved_pos.get("pos_y_pct")
-            img = self.preview.compose_qimage_for_path(src_path_str, per_settings)
-            if img is None:
-                fail_items.append(src_path.name)
-                continue
-                
-            # 应用尺寸调整
-            if export_settings["resize_mode"] != "none":
-                resize_mode = export_settings["resize_mode"]
-                resize_value = export_settings["resize_value"]
-                
-                # 获取原始尺寸
-                original_width = img.width()
-                original_height = img.height()
-                
-                if resize_mode == "width":
-                    new_width = resize_value
-                    new_height = int(original_height * (new_width / original_width))
-                    img = img.scaled(new_width, new_height, Qt.AspectRatioMode.KeepAspectRatio)
-                elif resize_mode == "height":
-                    new_height = resize_value
-                    new_width = int(original_width * (new_height / original_height))
-                    img = img.scaled(new_width, new_height, Qt.AspectRatioMode.KeepAspectRatio)
-                elif resize_mode == "percent":
-                    scale_factor = resize_value / 100.0
-                    new_width = int(original_width * scale_factor)
-                    new_height = int(original_height * scale_factor)
-                    img = img.scaled(new_width, new_height, Qt.AspectRatioMode.KeepAspectRatio)
-                
-            # 根据命名规则生成输出文件名
-            stem = src_path.stem
-            if mode == "prefix":
-                new_name = f"{value}{stem}{ext}"
-            elif mode == "suffix":
-                new_name = f"{stem}{value}{ext}"
-            else:
-                new_name = f"{stem}{ext}"
-            out_path = Path(out_dir) / new_name
-            
-            # 保存图片，应用JPEG质量设置
-            if fmt == "JPEG":
-                quality = export_settings["jpeg_quality"]
-                if img.save(str(out_path), fmt, quality):
-                    ok_count += 1
-                else:
-                    fail_items.append(src_path.name)
-            else:
-                if img.save(str(out_path), fmt):
-                    ok_count += 1
-                else:
-                    fail_items.append(src_path.name)
+            src_path_str = str(Path(self.list_widget.item(i).data(Qt.ItemDataRole.UserRole)))
+            spec = self._spec_for_path(src_path_str, base_spec, custom_specs)
+            tasks.append((src_path_str, spec))
+
+        # 内容与规格都相同的图片只渲染一次，其余输出由流水线链接或复制；
+        # 含令牌的文字逐图不同（文件名、序号），不能合并
+        if stack_templated(base_spec):
+            aliases = {}
+        else:
+            tasks, aliases = collapse_duplicates(tasks, self._fingerprints)
+
+        # 水印图层只在 GUI 线程渲染一次；后台线程在内存预算内并行解码、贴图层并扇出到各规格
+        layer = render_stack(base_spec)
+        # 批量导出需要大量像素内存：先清空预览缓存，只保留当前图由预览项持有
+        self._image_cache.clear()
+        exporter = BatchExporter(
+            tasks,
+            layer,
+            out_dir,
+            renditions,
+            memory_budget_mb=export_settings.get("memory_budget_mb", DEFAULT_MEMORY_BUDGET_MB),
+            max_workers=export_settings.get("max_workers", 0),
+            aliases=aliases,
+            metadata=self._metadata,
+        )
+        progress = QProgressDialog("正在导出...", "取消", 0, exporter.total, self)
+        progress.setWindowTitle("批量导出")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(300)
+        # 监控面板约每 250ms 刷新一次
+        last_refresh = [0.0]
+
+        def on_tick(done: int, total: int) -> bool:
+            progress.setValue(done)
+            now = time.monotonic()
+            if now - last_refresh[0] >= 0.25 or done >= total:
+                last_refresh[0] = now
+                self.telemetry_panel.update_live(exporter.snapshot())
+            QApplication.processEvents()
+            return not progress.wasCanceled()
+
+        run_with_progress(exporter, on_tick)
+        progress.close()
+        ok_count = exporter.ok_count
+        fail_items = exporter.fail_items
+        self.telemetry_panel.update_live(exporter.snapshot())
+        template_label = base_spec.text if base_spec.wm_type == "text" else Path(base_spec.image_path).name
+        self._export_history.append(history_record(
+            exporter.telemetry,
+            total=exporter.total,
+            ok=ok_count,
+            failed=len(fail_items),
+            cancelled=exporter.cancelled,
+            workers=exporter.workers,
+            peak_budget_bytes=exporter.budget.peak,
+            template=f"{template_label[:16]} #{base_spec.digest[:6]}",
+            out_dir=out_dir,
+        ))
+        self.telemetry_panel.set_history(self._export_history.records())
+        if self._catalog is not None and exporter.written:
+            try:
+                self._catalog.record_exports(exporter.written, template=base_spec.digest)
+            except sqlite3.Error:
+                pass
 
         if fail_items:
             QMessageBox.warning(
@@ -543,7 +1105,58 @@ class MainWindow(QMainWindow):
                 f"成功 {ok_count} 项，失败 {len(fail_items)} 项：\n" + "\n".join(fail_items)
             )
         else:
-            QMessageBox.information(self, "导出完成", f"成功导出 {ok_count} 项到：\n{out_dir}")
+            dup_count = sum(len(dups) for dups in aliases.values())
+            note = f"\n其中 {dup_count} 张重复图片未重新渲染，输出为链接或副本" if dup_count else ""
+            QMessageBox.information(self, "导出完成", f"成功导出 {ok_count} 项到：\n{out_dir}{note}")
+
+    def _on_export_proof(self) -> None:
+        count = self.list_widget.count()
+        if count == 0:
+            QMessageBox.information(self, "列表为空", "请先导入图片。")
+            return
+        out_path, selected = QFileDialog.getSaveFileName(
+            self,
+            "导出校样",
+            str(Path.home() / "proof.pdf"),
+            "PDF 文件 (*.pdf);;PNG 图片 (*.png)",
+        )
+        if not out_path:
+            return
+        if Path(out_path).suffix.lower() not in (".pdf", ".png"):
+            out_path += ".png" if "PNG" in selected else ".pdf"
+        grids = {"3 × 4": (3, 4), "4 × 5": (4, 5), "5 × 7": (5, 7), "6 × 8": (6, 8)}
+        label, ok = QInputDialog.getItem(self, "校样版式", "每页（列 × 行）：", list(grids), 1, False)
+        if not ok:
+            return
+        columns, rows = grids[label]
+        base_spec = self.wm_panel.get_spec()
+        sheet = ProofSheet(columns, rows, title=Path(out_path).stem)
+        custom_specs: dict[tuple, WatermarkSpec] = {}
+        entries = [(path, self._spec_for_path(path, base_spec, custom_specs)) for path in self._list_paths()]
+        # 校样缩略图按格子大小单独缓存（与列表图标的边长不同），同样可存入图库
+        thumbs = ThumbnailCache(sheet.thumb_edge())
+        thumbs.catalog = self._catalog
+        progress = QProgressDialog("正在生成校样...", "取消", 0, count, self)
+        progress.setWindowTitle("导出校样")
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(300)
+
+        def on_tick(done: int, total: int) -> bool:
+            progress.setValue(done)
+            QApplication.processEvents()
+            return not progress.wasCanceled()
+
+        written = write_proof_sheets(entries, out_path, render_stack(base_spec), sheet,
+                                     self._metadata.dimensions, thumbs, on_tick)
+        cancelled = progress.wasCanceled()
+        progress.close()
+        if not written:
+            QMessageBox.warning(self, "导出失败", f"无法写入校样：\n{out_path}")
+            return
+        where = written[0] if len(written) == 1 else f"{len(written)} 个文件：\n{written[0]} …"
+        note = "（已取消，只写出了取消前完成的页）" if cancelled else ""
+        QMessageBox.information(self, "校样已导出",
+                                f"共 {count} 张图片、{sheet.page_count(count)} 页{note}，已写入 {where}")
 
     def dropEvent(self, event):
         md = event.mimeData()
@@ -566,8 +1179,13 @@ class MainWindow(QMainWindow):
         item = items[0]
         src_path = Path(item.data(Qt.ItemDataRole.UserRole))
 
-        composed = self.preview.compose_qimage()
-        if composed is None:
+        # 超大 PNG/TIFF 无法整图解码，改为导出时按条带流式处理
+        width, height = self._metadata.dimensions(str(src_path))
+        budget_mb = int(self.export_panel.get_settings().get("memory_budget_mb", DEFAULT_MEMORY_BUDGET_MB))
+        streaming = can_stream(str(src_path), width, height, [{"format": "PNG", "resize_mode": "none"}],
+                               budget_mb * 1024 * 1024)
+        composed = None if streaming else self.preview.compose_qimage()
+        if composed is None and not streaming:
             QMessageBox.warning(self, "无法导出", "当前没有可导出的预览内容或图片未加载。")
             return
 
@@ -598,7 +1216,7 @@ class MainWindow(QMainWindow):
         # 获取导出设置
         export_settings = self.export_panel.get_settings()
         fmt = export_settings["format"]
-        ext = ".png" if fmt == "PNG" else ".jpg"
+        ext = extension_for(fmt)
 
         # 默认使用设置中的扩展名
         if mode == "prefix":
@@ -612,47 +1230,32 @@ class MainWindow(QMainWindow):
             self,
             "导出图片",
             str(src_path.with_name(default_name)),
-            "PNG 图像 (*.png);;JPEG 图像 (*.jpg *.jpeg)"
+            "PNG 图像 (*.png);;JPEG 图像 (*.jpg *.jpeg);;WebP 图像 (*.webp)"
         )
         if not save_path_str:
             return
 
         save_path = Path(save_path_str)
-        fmt = "PNG"
-        if save_path.suffix.lower() in {".jpg", ".jpeg"}:
-            fmt = "JPEG"
-            
-        # 应用尺寸调整
-        if export_settings["resize_mode"] != "none":
-            resize_mode = export_settings["resize_mode"]
-            resize_value = export_settings["resize_value"]
+        fmt = format_for_suffix(save_path.suffix) or "PNG"
             
-            # 获取原始尺寸
-            original_width = composed.width()
-            original_height = composed.height()
-            
-            if resize_mode == "width":
-                new_width = resize_value
-                new_height = int(original_height * (new_width / original_width))
-                composed = composed.scaled(new_width, new_height, Qt.AspectRatioMode.KeepAspectRatio)
-            elif resize_mode == "height":
-                new_height = resize_value
-                new_width = int(original_width * (new_height / original_height))
-                composed = composed.scaled(new_width, new_height, Qt.AspectRatioMode.KeepAspectRatio)
-            elif resize_mode == "percent":
-                scale_factor = resize_value / 100.0
-                new_width = int(original_width * scale_factor)
-                new_height = int(original_height * scale_factor)
-                composed = composed.scaled(new_width, new_height, Qt.AspectRatioMode.KeepAspectRatio)
-
-        # 保存图片，应用JPEG质量设置
-        if fmt == "JPEG":
-            quality = export_settings["jpeg_quality"]
-            ok = composed.save(str(save_path), fmt, quality)
+        if streaming:
+            if fmt != "PNG" or export_settings["resize_mode"] != "none":
+                QMessageBox.warning(self, "无法导出", "超大图片仅支持以原尺寸导出为 PNG（按条带流式处理）。")
+                return
+            ok = self.preview.stream_export_for_path(str(src_path), save_path, None, export_settings)
         else:
-            ok = composed.save(str(save_path), fmt)
-            
+            # 应用尺寸调整
+            composed = resize_qimage(composed, export_settings["resize_mode"], export_settings["resize_value"])
+
+            # 保存图片，应用编码参数
+            ok = save_qimage(composed, save_path, fmt, export_settings)
+
         if ok:
+            if self._catalog is not None:
+                try:
+                    self._catalog.record_exports([(str(src_path), str(save_path))])
+                except sqlite3.Error:
+                    pass
             QMessageBox.information(self, "导出成功", f"已保存到：\n{save_path}")
         else:
             QMessageBox.warning(self, "导出失败", "保存文件失败，请检查路径或权限。")
@@ -686,6 +1289,11 @@ class MainWindow(QMainWindow):
             path = item.data(Qt.ItemDataRole.UserRole)
             if path:
                 self._per_image_custom_pos[path] = dict(saved)
+        # 同步到所有图片只记一条日志
+        self._session.set_pos_all(saved)
+        if self._icon_wm_enabled:
+            self._icon_wm_spec = None
+            self._schedule_icon_watermarks()
         # 直接应用到预览（保持position=custom）
         apply_settings = dict(saved)
         apply_settings["position"] = "custom"
@@ -1,80 +1,125 @@
-from PySide6.QtGui import QPixmap, QFont, QColor, QTransform, QFontDatabase, QImage, QPainter, QFontMetricsF, QPen
-from PySide6.QtCore import Qt, QRect, Signal
+import os
+import sys
+import time
+from collections import deque
+
+from PySide6.QtGui import QPixmap, QFont, QColor, QTransform, QFontDatabase, QImage, QImageReader, QBrush, QPainter
+from PySide6.QtCore import Qt, QEvent, QRectF, QTimer, Signal
 from PySide6.QtWidgets import (
     QGraphicsScene,
     QGraphicsView,
     QGraphicsPixmapItem,
     QGraphicsTextItem,
     QGraphicsItem,
-    QGraphicsDropShadowEffect,
 )
 import shiboken6
 
+from app.services.compositor import (
+    LayerStack,
+    StrokedTextItem,
+    add_shadow_item,
+    bind_tokens,
+    compose_image_file,
+    plan_overlay,
+    render_layer,
+    render_stack,
+    tile_brush,
+)
+from app.services.streaming import stream_watermark
+from app.services.spec import WatermarkSpec
+from app.services.tokens import expand, stack_templated, templated, token_context
+
+
+class TiledWatermarkItem(QGraphicsItem):
+    """平铺水印项：覆盖整幅图片，用纹理画刷一次绘制所有副本"""
 
-class StrokedTextItem(QGraphicsTextItem):
-    """带描边效果的文本项"""
-    
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.stroke_width = 0
-        self.stroke_color = QColor(255, 255, 255)
-    
-    def set_stroke(self, width, color):
-        """设置描边宽度和颜色"""
-        self.stroke_width = width
-        self.stroke_color = color
+        self._rect = QRectF()
+        self._brush = QBrush()
+        # 不拦截鼠标，保留视图的拖拽平移
+        self.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+
+    def set_tiling(self, rect: QRectF, layer: QImage, settings: dict) -> None:
+        self.prepareGeometryChange()
+        self._rect = QRectF(rect)
+        self._brush = tile_brush(layer, settings, self._rect.center())
         self.update()
-    
+
+    def boundingRect(self):
+        return self._rect
+
     def paint(self, painter, option, widget=None):
-        """重写绘制方法以添加描边效果"""
-        if self.stroke_width > 0:
-            # 保存原始设置
-            original_pen = painter.pen()
-            original_brush = painter.brush()
-            
-            # 获取文本路径
-            path = self.textPath()
-            
-            # 绘制描边 - 使用较粗的笔绘制路径轮廓
-            stroke_pen = QPen(self.stroke_color, self.stroke_width * 2)
-            stroke_pen.setJoinStyle(Qt.RoundJoin)
-            stroke_pen.setCapStyle(Qt.RoundCap)
-            painter.setPen(stroke_pen)
-            painter.setBrush(Qt.NoBrush)
-            painter.drawPath(path)
-            
-            # 绘制文本填充
-            painter.setPen(Qt.NoPen)
-            painter.setBrush(self.defaultTextColor())
-            painter.drawPath(path)
-            
-            # 恢复原始设置
-            painter.setPen(original_pen)
-            painter.setBrush(original_brush)
-        else:
-            # 没有描边时使用默认绘制
-            super().paint(painter, option, widget)
-    
+        painter.fillRect(self._rect, self._brush)
+
+
+class LayerStackItem(QGraphicsItem):
+    """附加图层项：底层之上的各图层编译为一个摆放方案，一次绘制
+
+    与导出使用同一套摆放与编译逻辑；不拦截鼠标，拖拽只作用于底层水印。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rect = QRectF()
+        self._plan = None
+        self.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+
+    def set_plan(self, rect: QRectF, plan) -> None:
+        self.prepareGeometryChange()
+        self._rect = QRectF(rect)
+        self._plan = plan
+        self.update()
+
     def boundingRect(self):
-        """重写边界矩形以包含描边"""
-        rect = super().boundingRect()
-        if self.stroke_width > 0:
-            # 为描边预留额外空间
-            extra = self.stroke_width
-            rect = rect.adjusted(-extra, -extra, extra, extra)
-        return rect
-    
-    def textPath(self):
-        """获取文本路径"""
-        from PySide6.QtGui import QPainterPath
-        path = QPainterPath()
-        font = self.font()
-        text = self.toPlainText()
-        # 使用QFontMetricsF获取更准确的基线位置
-        metrics = QFontMetricsF(font)
-        baseline_y = metrics.ascent()
-        path.addText(0, baseline_y, font, text)
-        return path
+        return self._rect
+
+    def paint(self, painter, option, widget=None):
+        if self._plan is None:
+            return
+        painter.save()
+        painter.setClipRect(self._rect)
+        self._plan.paint(painter, self._rect.toRect())
+        painter.restore()
+
+
+# 交互（拖拽、缩放）结束后恢复全质量渲染的空闲时间
+INTERACTIVE_IDLE_MS = 250
+# 交互期间关闭的视图提示（空闲时保持视图原有的提示不变）
+_INTERACTIVE_OFF_HINTS = QPainter.RenderHint.Antialiasing | QPainter.RenderHint.SmoothPixmapTransform
+
+
+class FrameTimer:
+    """记录预览每帧的绘制耗时，按交互/全质量分别统计最近若干帧
+
+    设置环境变量 WKX_FRAME_TIMING=1 时，每次交互结束把统计输出到标准错误。
+    """
+
+    def __init__(self, keep: int = 240) -> None:
+        self.frames = {"interactive": deque(maxlen=keep), "full": deque(maxlen=keep)}
+
+    def add(self, interactive: bool, ms: float) -> None:
+        self.frames["interactive" if interactive else "full"].append(ms)
+
+    def summary(self) -> dict:
+        result = {}
+        for kind, values in self.frames.items():
+            if not values:
+                continue
+            ordered = sorted(values)
+            result[kind] = {
+                "frames": len(ordered),
+                "avg_ms": round(sum(ordered) / len(ordered), 2),
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+                "max_ms": round(ordered[-1], 2),
+            }
+        return result
+
+    def report(self) -> None:
+        if os.environ.get("WKX_FRAME_TIMING"):
+            parts = [f"{kind} avg={s['avg_ms']}ms p95={s['p95_ms']}ms n={s['frames']}"
+                     for kind, s in self.summary().items()]
+            print("frames " + " | ".join(parts), file=sys.stderr)
 
 
 class PreviewView(QGraphicsView):
@@ -83,14 +128,31 @@ class PreviewView(QGraphicsView):
         super().__init__(parent)
         self._scene = QGraphicsScene(self)
         self.setScene(self._scene)
-        self.setRenderHints(self.renderHints())
+        self._idle_hints = self.renderHints()
         self.setDragMode(QGraphicsView.ScrollHandDrag)
+        # 交互模式：拖拽/缩放期间缓存水印图元，松开或空闲后恢复
+        self._interactive: bool = False
+        self._interactive_zoom: bool = False
+        self._interactive_timer = QTimer(self)
+        self._interactive_timer.setSingleShot(True)
+        self._interactive_timer.setInterval(INTERACTIVE_IDLE_MS)
+        self._interactive_timer.timeout.connect(self._end_interactive)
+        self.frame_timer = FrameTimer()
         self._image_item: QGraphicsPixmapItem | None = None
         self._wm_item: QGraphicsTextItem | None = None
         # 图片水印项与当前拖拽项
         self._wm_img_item: QGraphicsPixmapItem | None = None
+        # 平铺水印项（单个项覆盖整图，不为每个副本创建图元）
+        self._wm_tile_item: TiledWatermarkItem | None = None
+        # 附加图层项及其对应的 (图层规格, 图片尺寸)，未变化时不重新渲染
+        self._wm_layers_item: LayerStackItem | None = None
+        self._wm_layers_key = None
+        # 文本水印的阴影子项
+        self._wm_shadow_item: QGraphicsPixmapItem | None = None
         self._drag_item: QGraphicsItem | None = None
         self._wm_settings: dict | None = None
+        # 当前设置对应的规格：设置未变化时跳过重绘
+        self._wm_spec: WatermarkSpec | None = None
         # 缩放相关状态
         self._zoom: float = 1.0
         self._user_zoom_active: bool = False
@@ -101,17 +163,81 @@ class PreviewView(QGraphicsView):
         self._dragging_wm: bool = False
         # 当前预览图片路径
         self._current_path: str | None = None
+        # 刚换图（复用了图元），下一次刷新水印时按新图重新定位
+        self._image_swapped: bool = False
+        # 当前图片在列表中的序号（令牌 {index}），由主窗口在换图前设置
+        self.token_index: int = 1
+        self._token_cache = None
 
     def zoom_in(self) -> None:
-        self._user_zoom_active = True
-        self._zoom = min(self._max_zoom, self._zoom * self._zoom_step)
-        self._apply_transform()
+        self.zoom_by(self._zoom_step)
 
 
     def zoom_out(self) -> None:
+        self.zoom_by(1.0 / self._zoom_step)
+
+
+    def zoom_by(self, factor: float) -> None:
+        self._begin_interactive(zooming=True)
         self._user_zoom_active = True
-        self._zoom = max(self._min_zoom, self._zoom / self._zoom_step)
+        self._zoom = max(self._min_zoom, min(self._max_zoom, self._zoom * factor))
         self._apply_transform()
+        # 连续缩放期间保持快速渲染，停顿后恢复全质量
+        self._interactive_timer.start()
+
+    def wheelEvent(self, event):
+        # Ctrl + 滚轮缩放，其余滚轮行为保持默认（滚动）
+        if event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            delta = event.angleDelta().y()
+            if delta:
+                self.zoom_by(self._zoom_step ** (delta / 120.0))
+            event.accept()
+            return
+        super().wheelEvent(event)
+
+    def viewportEvent(self, event):
+        # 触控板捏合缩放
+        if event.type() == QEvent.Type.NativeGesture and event.gestureType() == Qt.NativeGestureType.ZoomNativeGesture:
+            self.zoom_by(1.0 + event.value())
+            return True
+        return super().viewportEvent(event)
+
+    def paintEvent(self, event):
+        t0 = time.perf_counter()
+        super().paintEvent(event)
+        self.frame_timer.add(self._interactive, (time.perf_counter() - t0) * 1000.0)
+
+    def _watermark_items(self):
+        items = (self._wm_item, self._wm_img_item, self._wm_shadow_item, self._wm_layers_item)
+        return [it for it in items if it is not None and shiboken6.isValid(it)]
+
+    def _begin_interactive(self, zooming: bool = False) -> None:
+        """进入快速渲染：水印图元缓存为位图，并确保不做平滑缩放与抗锯齿
+
+        拖拽时用设备坐标缓存（平移不失效），每帧只贴一次缓存位图，不再重绘
+        描边路径与阴影；缩放时设备缓存每步都会失效，改用图元坐标缓存，
+        代价是缩放过程中水印略微发虚。
+        """
+        if self._interactive and (self._interactive_zoom or not zooming):
+            return
+        self._interactive = True
+        self._interactive_zoom = zooming
+        self.setRenderHints(self._idle_hints & ~_INTERACTIVE_OFF_HINTS)
+        mode = QGraphicsItem.CacheMode.ItemCoordinateCache if zooming else QGraphicsItem.CacheMode.DeviceCoordinateCache
+        for item in self._watermark_items():
+            item.setCacheMode(mode)
+
+    def _end_interactive(self) -> None:
+        self._interactive_timer.stop()
+        if not self._interactive:
+            return
+        self._interactive = False
+        self._interactive_zoom = False
+        self.setRenderHints(self._idle_hints)
+        for item in self._watermark_items():
+            item.setCacheMode(QGraphicsItem.CacheMode.NoCache)
+        self.viewport().update()
+        self.frame_timer.report()
 
 
     def reset_zoom(self) -> None:
@@ -129,17 +255,22 @@ class PreviewView(QGraphicsView):
         self.setTransform(t)
 
 
-    def load_image(self, file_path: str) -> bool:
-        pix = QPixmap(file_path)
+    def load_image(self, file_path: str, image: QImage | None = None) -> bool:
+        # image 为后台预解码的结果，存在时只需在主线程转换为 QPixmap
+        if image is not None and not image.isNull():
+            pix = QPixmap.fromImage(image)
+        else:
+            pix = QPixmap(file_path)
         if pix.isNull():
             return False
 
-        self._scene.clear()
-        # 清空场景后，之前的水印项会被删除，避免悬空引用
-        self._wm_item = None
-        self._wm_img_item = None
-        self._image_item = QGraphicsPixmapItem(pix)
-        self._scene.addItem(self._image_item)
+        # 复用已有的图片项与水印项，只替换像素；水印由 _apply_watermark 按新尺寸重新定位
+        if self._image_item is not None and shiboken6.isValid(self._image_item):
+            self._image_item.setPixmap(pix)
+        else:
+            self._image_item = QGraphicsPixmapItem(pix)
+            self._scene.addItem(self._image_item)
+        self._image_swapped = True
         self._scene.setSceneRect(pix.rect())
         # 记录当前图片路径，供导出当前使用
         self._current_path = file_path
@@ -165,7 +296,9 @@ class PreviewView(QGraphicsView):
                 self._base_transform = self.transform()
                 self._apply_transform()
 
-    def set_watermark_settings(self, settings: dict) -> None:
+    def set_watermark_settings(self, settings) -> None:
+         if isinstance(settings, WatermarkSpec):
+             settings = settings.to_settings()
          # 读取旧设置
          prev = self._wm_settings or {}
 
@@ -191,7 +324,12 @@ class PreviewView(QGraphicsView):
                  if k in merged:
                      merged.pop(k)
 
+         # 合并结果与当前规格相同（如面板重复发出同样的设置）时无需重建水印项
+         spec = WatermarkSpec.from_settings(merged)
+         if spec == self._wm_spec and self._wm_settings is not None:
+             return
          # 应用合并后的设置
+         self._wm_spec = spec
          self._wm_settings = merged
          self._apply_watermark()
 
@@ -201,6 +339,9 @@ class PreviewView(QGraphicsView):
             self._wm_item = None
         if self._wm_img_item is not None and not shiboken6.isValid(self._wm_img_item):
             self._wm_img_item = None
+        if self._wm_tile_item is not None and not shiboken6.isValid(self._wm_tile_item):
+            self._wm_tile_item = None
+        self._apply_extra_layers()
         if not self._wm_settings:
             # 无设置，移除所有水印项
             if self._wm_item is not None:
@@ -209,14 +350,21 @@ class PreviewView(QGraphicsView):
             if self._wm_img_item is not None:
                 self._scene.removeItem(self._wm_img_item)
                 self._wm_img_item = None
+            self._remove_tile_item()
             return
         if self._image_item is None:
             return
 
+        # 平铺模式：渲染一次图层，由单个平铺项用纹理画刷铺满整图
+        if self._wm_settings.get("position") == "tile":
+            self._apply_tiled_watermark()
+            return
+        self._remove_tile_item()
+
         wm_type = self._wm_settings.get("wm_type", "text")
         # 其余逻辑在后续代码中按类型分别处理
 
-        text = self._wm_settings.get("text", "")
+        text = self._display_settings(self._wm_settings).get("text", "")
         font_size = int(self._wm_settings.get("font_size", 32))
         opacity = float(self._wm_settings.get("opacity", 0.6))
         margin = int(self._wm_settings.get("margin", 20))
@@ -227,10 +375,6 @@ class PreviewView(QGraphicsView):
         # 读取阴影与描边配置
         shadow_enabled = bool(self._wm_settings.get("shadow_enabled", False))
         shadow_offset = int(self._wm_settings.get("shadow_offset", 2))
-        shadow_blur = int(self._wm_settings.get("shadow_blur", 5))
-        shadow_color = self._wm_settings.get("shadow_color", QColor(0, 0, 0))
-        if not isinstance(shadow_color, QColor):
-            shadow_color = QColor(0, 0, 0)
         stroke_enabled = bool(self._wm_settings.get("stroke_enabled", False))
         stroke_width = int(self._wm_settings.get("stroke_width", 2))
         stroke_color = self._wm_settings.get("stroke_color", QColor(255, 255, 255))
@@ -246,7 +390,9 @@ class PreviewView(QGraphicsView):
         rotation_angle = float(self._wm_settings.get("rotation_angle", 0.0))
 
         # 新建项标志：用于区分场景清空后新创建的水印项是否应直接使用旧位置
-        just_created = False
+        # 换图后复用的水印项同样视为新建，不沿用上一张图上的位置
+        just_created = self._image_swapped
+        self._image_swapped = False
 
         # 创建或更新水印项（文本分支保留，图片分支在后续处理）
         if wm_type == "text":
@@ -312,15 +458,13 @@ class PreviewView(QGraphicsView):
             self._wm_item.setTransformOriginPoint(rect.center())
             self._wm_item.setRotation(rotation_angle)
 
-            # 设置阴影效果
+            # 设置阴影效果：使用缓存的预模糊阴影子项，拖拽与重绘时不再重新模糊
+            if self._wm_shadow_item is not None and shiboken6.isValid(self._wm_shadow_item):
+                self._scene.removeItem(self._wm_shadow_item)
+            self._wm_shadow_item = None
             if shadow_enabled:
-                shadow_effect = QGraphicsDropShadowEffect()
-                shadow_effect.setOffset(shadow_offset, shadow_offset)
-                shadow_effect.setBlurRadius(shadow_blur)
-                shadow_effect.setColor(shadow_color if isinstance(shadow_color, QColor) else QColor(0, 0, 0))
-                self._wm_item.setGraphicsEffect(shadow_effect)
-            else:
-                self._wm_item.setGraphicsEffect(None)
+                self._wm_shadow_item = add_shadow_item(self._wm_item, self._display_settings(self._wm_settings),
+                                                       shadow_offset)
 
             # 位置计算（文本水印）：支持枚举与自定义坐标/百分比
             img_rect = self._scene.sceneRect()
@@ -590,6 +734,72 @@ class PreviewView(QGraphicsView):
                     y = max(min_y, min(max_y, cy))
                 self._wm_img_item.setPos(x, y)
 
+    def _apply_extra_layers(self) -> None:
+        """显示底层之上的附加图层（整组编译为一个图元，位置按图片尺寸计算）"""
+        if self._wm_layers_item is not None and not shiboken6.isValid(self._wm_layers_item):
+            self._wm_layers_item = None
+        layers = WatermarkSpec.from_settings(self._wm_settings).layers if self._wm_settings else None
+        if layers:
+            layers = tuple(self._display_settings(layer) for layer in layers)
+        rect = self._scene.sceneRect()
+        if not layers or self._image_item is None:
+            if self._wm_layers_item is not None:
+                self._scene.removeItem(self._wm_layers_item)
+                self._wm_layers_item = None
+            self._wm_layers_key = None
+            return
+        key = (layers, int(rect.width()), int(rect.height()))
+        if key == self._wm_layers_key and self._wm_layers_item is not None:
+            return
+        stack = LayerStack(None, [(render_layer(layer), layer) for layer in layers])
+        if self._wm_layers_item is None:
+            self._wm_layers_item = LayerStackItem()
+            self._wm_layers_item.setZValue(1002)
+            self._scene.addItem(self._wm_layers_item)
+        plan = plan_overlay(key[1], key[2], stack, {}) if not stack.isNull() else None
+        self._wm_layers_item.set_plan(rect, plan)
+        self._wm_layers_key = key
+
+    def token_context(self) -> dict:
+        """当前图片的令牌取值（按路径、序号与尺寸缓存）"""
+        rect = self._scene.sceneRect()
+        key = (self._current_path, self.token_index, int(rect.width()), int(rect.height()))
+        if self._token_cache is None or self._token_cache[0] != key:
+            self._token_cache = (key, token_context(self._current_path or "", *key[1:]))
+        return self._token_cache[1]
+
+    def _display_settings(self, wm):
+        """含令牌的文本按当前图片展开后用于显示；其余设置原样返回"""
+        if not self._current_path or not templated(wm):
+            return wm
+        text = expand(wm.get("text", ""), self.token_context())
+        if isinstance(wm, WatermarkSpec):
+            return wm.replace(text=text)
+        return dict(wm, text=text)
+
+    def _remove_tile_item(self) -> None:
+        if self._wm_tile_item is not None:
+            self._scene.removeItem(self._wm_tile_item)
+            self._wm_tile_item = None
+
+    def _apply_tiled_watermark(self) -> None:
+        # 平铺模式下移除单个水印项
+        if self._wm_item is not None:
+            self._scene.removeItem(self._wm_item)
+            self._wm_item = None
+        if self._wm_img_item is not None:
+            self._scene.removeItem(self._wm_img_item)
+            self._wm_img_item = None
+        layer = render_layer(self._display_settings(self._wm_settings))
+        if layer is None or layer.isNull():
+            self._remove_tile_item()
+            return
+        if self._wm_tile_item is None:
+            self._wm_tile_item = TiledWatermarkItem()
+            self._wm_tile_item.setZValue(1001)
+            self._scene.addItem(self._wm_tile_item)
+        self._wm_tile_item.set_tiling(self._scene.sceneRect(), layer, self._wm_settings)
+
     def mousePressEvent(self, event):
         item = self.itemAt(event.pos())
         # 如果点中任一水印，则临时关闭视图拖拽，交由水印自身拖拽
@@ -604,10 +814,13 @@ class PreviewView(QGraphicsView):
             self._dragging_wm = False
             self._drag_item = None
             self.setDragMode(QGraphicsView.ScrollHandDrag)
+        if event.button() == Qt.MouseButton.LeftButton:
+            self._begin_interactive()
         super().mousePressEvent(event)
 
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
+        self._end_interactive()
         if self._dragging_wm and self._drag_item is not None and shiboken6.isValid(self._drag_item):
             pos = self._drag_item.pos()
             if self._wm_settings is None:
@@ -619,6 +832,8 @@ class PreviewView(QGraphicsView):
             if rect.width() > 0 and rect.height() > 0:
                 self._wm_settings["pos_x_pct"] = float((pos.x() - rect.left()) / rect.width())
                 self._wm_settings["pos_y_pct"] = float((pos.y() - rect.top()) / rect.height())
+            # 设置已被就地修改，作废缓存的规格
+            self._wm_spec = None
             # 发射位置变化信号，供主窗口同步到所有图片
             self.positionChanged.emit({
                 "position": "custom",
@@ -627,9 +842,6 @@ class PreviewView(QGraphicsView):
                 "pos_x_pct": self._wm_settings.get("pos_x_pct"),
                 "pos_y_pct": self._wm_settings.get("pos_y_pct"),
             })
-            # 控制台日志，便于核对坐标写回情况
-            print(f"[WM drag] pos_x={self._wm_settings.get('pos_x')}, pos_y={self._wm_settings.get('pos_y')}, "
-                  f"pos_x_pct={self._wm_settings.get('pos_x_pct')}, pos_y_pct={self._wm_settings.get('pos_y_pct')}")
         self.setDragMode(QGraphicsView.ScrollHandDrag)
         self._dragging_wm = False
         self._drag_item = None
@@ -643,453 +855,18 @@ class PreviewView(QGraphicsView):
             return self.compose_qimage_for_path(self._current_path, None)
         return None
 
-    def compose_qimage_for_path(self, path: str, settings: dict | None = None):
+    def compose_qimage_for_path(self, path: str, settings: dict | WatermarkSpec | None = None):
         # 离屏合成：直接从文件读取为 QImage 并绘制水印
-        if not path:
-            return None
-        img = QImage(path)
-        if img.isNull():
-            return None
-        img = img.convertToFormat(QImage.Format_ARGB32)
+        context = self.token_context() if path == self._current_path else None
+        return compose_image_file(path, settings or self._wm_settings or {}, context)
 
+    def stream_export_for_path(self, path: str, out_path, settings: dict | WatermarkSpec | None = None,
+                               encoder_settings: dict | None = None) -> bool:
+        # 超大 PNG/TIFF：不整图解码，按条带贴水印并流式写出 PNG
         wm = settings or self._wm_settings or {}
-        wm_type = wm.get("wm_type", "text")
-        rotation_angle = float(wm.get("rotation_angle", 0.0))
-        if wm_type == "image":
-            # 图片水印导出
-            img_path = wm.get("image_path", "")
-            if not img_path:
-                return img
-            wm_img = QImage(img_path)
-            if wm_img.isNull():
-                return img
-            opacity = float(wm.get("img_opacity", 0.6))
-            margin = int(wm.get("margin", 20))
-            scale_mode = wm.get("img_scale_mode", "proportional")
-            if scale_mode == "proportional":
-                pct = int(wm.get("img_scale_pct", 100))
-                target_w = max(1, int(wm_img.width() * pct / 100.0))
-                target_h = max(1, int(wm_img.height() * pct / 100.0))
-                wm_scaled = wm_img.scaled(target_w, target_h, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-            else:
-                target_w = max(1, int(wm.get("img_width", wm_img.width())))
-                target_h = max(1, int(wm.get("img_height", wm_img.height())))
-                wm_scaled = wm_img.scaled(target_w, target_h, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
-
-            painter = QPainter(img)
-            painter.setRenderHint(QPainter.Antialiasing, True)
-            painter.setOpacity(opacity)
-            wm_w = wm_scaled.width()
-            wm_h = wm_scaled.height()
-            position = wm.get("position", "bottom_right")
-            if position == "custom":
-                if "pos_x_pct" in wm and "pos_y_pct" in wm:
-                    cx = float(wm.get("pos_x_pct", 0.0)) * img.width()
-                    cy = float(wm.get("pos_y_pct", 0.0)) * img.height()
-                else:
-                    cx = float(wm.get("pos_x", margin))
-                    cy = float(wm.get("pos_y", margin))
-                # 与预览保持一致：自定义位置按图像边界夹紧（不使用 margin）
-                min_x = 0
-                min_y = 0
-                max_x = img.width() - wm_w
-                max_y = img.height() - wm_h
-                x = max(min_x, min(max_x, cx))
-                y = max(min_y, min(max_y, cy))
-                if rotation_angle:
-                    painter.save()
-                    painter.translate(int(x + wm_w / 2), int(y + wm_h / 2))
-                    painter.rotate(rotation_angle)
-                    painter.drawImage(int(-wm_w / 2), int(-wm_h / 2), wm_scaled)
-                    painter.restore()
-                else:
-                    painter.drawImage(int(x), int(y), wm_scaled)
-            else:
-                content_rect = img.rect().adjusted(margin, margin, -margin, -margin)
-                if position == "top_left":
-                    x = content_rect.left()
-                    y = content_rect.top()
-                elif position == "top_right":
-                    x = content_rect.right() - wm_w
-                    y = content_rect.top()
-                elif position == "bottom_left":
-                    x = content_rect.left()
-                    y = content_rect.bottom() - wm_h
-                elif position == "bottom_right":
-                    x = content_rect.right() - wm_w
-                    y = content_rect.bottom() - wm_h
-                elif position == "top_center":
-                    x = content_rect.center().x() - wm_w // 2
-                    y = content_rect.top()
-                elif position == "bottom_center":
-                    x = content_rect.center().x() - wm_w // 2
-                    y = content_rect.bottom() - wm_h
-                elif position == "center_left":
-                    x = content_rect.left()
-                    y = content_rect.center().y() - wm_h // 2
-                elif position == "center_right":
-                    x = content_rect.right() - wm_w
-                    y = content_rect.center().y() - wm_h // 2
-                else:
-                    x = content_rect.center().x() - wm_w // 2
-                    y = content_rect.center().y() - wm_h // 2
-                if rotation_angle:
-                    painter.save()
-                    painter.translate(int(x + wm_w / 2), int(y + wm_h / 2))
-                    painter.rotate(rotation_angle)
-                    painter.drawImage(int(-wm_w / 2), int(-wm_h / 2), wm_scaled)
-                    painter.restore()
-                else:
-                    painter.drawImage(int(x), int(y), wm_scaled)
-            painter.end()
-            return img
-
-        text = wm.get("text", "")
-        if not text:
-            return img
-        font_size = int(wm.get("font_size", 32))
-        opacity = float(wm.get("opacity", 0.6))
-        margin = int(wm.get("margin", 20))
-        position = wm.get("position", "bottom_right")
-        color = wm.get("color", QColor(0, 0, 0))
-        if not isinstance(color, QColor):
-            color = QColor(0, 0, 0)
-
-        shadow_enabled = bool(wm.get("shadow_enabled", False))
-        shadow_offset = int(wm.get("shadow_offset", 2))
-        shadow_blur = int(wm.get("shadow_blur", 5))
-        shadow_color = wm.get("shadow_color", QColor(0, 0, 0))
-        if not isinstance(shadow_color, QColor):
-            shadow_color = QColor(0, 0, 0)
-        stroke_enabled = bool(wm.get("stroke_enabled", False))
-        stroke_width = int(wm.get("stroke_width", 2))
-        stroke_color = wm.get("stroke_color", QColor(255, 255, 255))
-        if not isinstance(stroke_color, QColor):
-            stroke_color = QColor(255, 255, 255)
-
-        font_family = wm.get("font_family", "")
-        font_bold = bool(wm.get("font_bold", False))
-        font_italic = bool(wm.get("font_italic", False))
-        if font_family:
-            font = QFont(font_family)
-        else:
-            font = QFontDatabase.systemFont(QFontDatabase.GeneralFont)
-        font.setPointSize(font_size)
-        font.setBold(font_bold)
-        font.setItalic(font_italic)
-
-        text_scene = QGraphicsScene()
-        if stroke_enabled:
-            text_item = StrokedTextItem()
-            text_item.set_stroke(stroke_width, stroke_color)
-        else:
-            text_item = QGraphicsTextItem()
-        text_item.setPlainText(text)
-        text_item.setDefaultTextColor(color)
-        text_item.setFont(font)
-        text_item.setOpacity(opacity)
-        if shadow_enabled:
-            eff = QGraphicsDropShadowEffect()
-            eff.setOffset(shadow_offset, shadow_offset)
-            eff.setBlurRadius(shadow_blur)
-            eff.setColor(shadow_color)
-            text_item.setGraphicsEffect(eff)
-        text_scene.addItem(text_item)
-        text_rect = text_scene.itemsBoundingRect()
-        text_scene.setSceneRect(text_rect)
-        text_img = QImage(int(text_rect.width()), int(text_rect.height()), QImage.Format_ARGB32)
-        text_img.fill(QColor(0, 0, 0, 0))
-        painter_layer = QPainter(text_img)
-        text_item.setPos(text_item.pos() - text_rect.topLeft())
-        text_scene.render(painter_layer)
-        painter_layer.end()
-
-        # 位置计算与绘制
-        painter = QPainter(img)
-        painter.setRenderHint(QPainter.Antialiasing, True)
-        painter.setRenderHint(QPainter.TextAntialiasing, True)
-        text_w = text_img.width()
-        text_h = text_img.height()
-        if position == "custom":
-            if "pos_x_pct" in wm and "pos_y_pct" in wm:
-                cx = float(wm.get("pos_x_pct", 0.0)) * img.width()
-                cy = float(wm.get("pos_y_pct", 0.0)) * img.height()
-            else:
-                cx = float(wm.get("pos_x", margin))
-                cy = float(wm.get("pos_y", margin))
-            # 与预览保持一致：边界夹紧按图像边界而非margin
-            min_x = 0
-            min_y = 0
-            max_x = img.width() - text_w
-            max_y = img.height() - text_h
-            x = max(min_x, min(max_x, cx))
-            y = max(min_y, min(max_y, cy))
-            if rotation_angle:
-                painter.save()
-                painter.translate(int(x + text_w / 2), int(y + text_h / 2))
-                painter.rotate(rotation_angle)
-                painter.drawImage(int(-text_w / 2), int(-text_h / 2), text_img)
-                painter.restore()
-            else:
-                painter.drawImage(int(x), int(y), text_img)
-        else:
-            content_rect = img.rect().adjusted(margin, margin, -margin, -margin)
-            if position == "top_left":
-                x = content_rect.left()
-                y = content_rect.top()
-            elif position == "top_right":
-                x = content_rect.right() - text_w
-                y = content_rect.top()
-            elif position == "bottom_left":
-                x = content_rect.left()
-                y = content_rect.bottom() - text_h
-            elif position == "bottom_right":
-                x = content_rect.right() - text_w
-                y = content_rect.bottom() - text_h
-            elif position == "top_center":
-                x = content_rect.center().x() - text_w // 2
-                y = content_rect.top()
-            elif position == "bottom_center":
-                x = content_rect.center().x() - text_w // 2
-                y = content_rect.bottom() - text_h
-            elif position == "center_left":
-                x = content_rect.left()
-                y = content_rect.center().y() - text_h // 2
-            elif position == "center_right":
-                x = content_rect.right() - text_w
-                y = content_rect.center().y() - text_h // 2
-            else:  # center
-                x = content_rect.center().x() - text_w // 2
-                y = content_rect.center().y() - text_h // 2
-            painter.drawImage(int(x), int(y), text_img)
-        painter.end()
-        return img
-
-
-    def compose_qimage_for_path_duplicate(self, path: str, settings: dict | None = None):
-        # 离屏合成：直接从文件读取为 QImage 并绘制水印
-        if not path:
-            return None
-        img = QImage(path)
-        if img.isNull():
-            return None
-        img = img.convertToFormat(QImage.Format_ARGB32)
-
-        wm = settings or self._wm_settings or {}
-        wm_type = wm.get("wm_type", "text")
-        if wm_type == "image":
-            # 图片水印导出
-            img_path = wm.get("image_path", "")
-            if not img_path:
-                return img
-            wm_img = QImage(img_path)
-            if wm_img.isNull():
-                return img
-            opacity = float(wm.get("img_opacity", 0.6))
-            margin = int(wm.get("margin", 20))
-            scale_mode = wm.get("img_scale_mode", "proportional")
-            if scale_mode == "proportional":
-                pct = int(wm.get("img_scale_pct", 100))
-                target_w = max(1, int(wm_img.width() * pct / 100.0))
-                target_h = max(1, int(wm_img.height() * pct / 100.0))
-                wm_scaled = wm_img.scaled(target_w, target_h, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-            else:
-                target_w = max(1, int(wm.get("img_width", wm_img.width())))
-                target_h = max(1, int(wm.get("img_height", wm_img.height())))
-                wm_scaled = wm_img.scaled(target_w, target_h, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
-
-            painter = QPainter(img)
-            painter.setRenderHint(QPainter.Antialiasing, True)
-            painter.setOpacity(opacity)
-            wm_w = wm_scaled.width()
-            wm_h = wm_scaled.height()
-            rotation_angle = float(wm.get("rotation_angle", 0.0))
-            position = wm.get("position", "bottom_right")
-            if position == "custom":
-                if "pos_x_pct" in wm and "pos_y_pct" in wm:
-                    cx = float(wm.get("pos_x_pct", 0.0)) * img.width()
-                    cy = float(wm.get("pos_y_pct", 0.0)) * img.height()
-                else:
-                    cx = float(wm.get("pos_x", margin))
-                    cy = float(wm.get("pos_y", margin))
-                # 与预览保持一致：自定义位置按图像边界夹紧（不使用 margin）
-                min_x = 0
-                min_y = 0
-                max_x = img.width() - wm_w
-                max_y = img.height() - wm_h
-                x = max(min_x, min(max_x, cx))
-                y = max(min_y, min(max_y, cy))
-                if rotation_angle:
-                    painter.save()
-                    painter.translate(int(x + wm_w / 2), int(y + wm_h / 2))
-                    painter.rotate(rotation_angle)
-                    painter.drawImage(int(-wm_w / 2), int(-wm_h / 2), wm_scaled)
-                    painter.restore()
-                else:
-                    painter.drawImage(int(x), int(y), wm_scaled)
-            else:
-                content_rect = img.rect().adjusted(margin, margin, -margin, -margin)
-                if position == "top_left":
-                    x = content_rect.left()
-                    y = content_rect.top()
-                elif position == "top_right":
-                    x = content_rect.right() - wm_w
-                    y = content_rect.top()
-                elif position == "bottom_left":
-                    x = content_rect.left()
-                    y = content_rect.bottom() - wm_h
-                elif position == "bottom_right":
-                    x = content_rect.right() - wm_w
-                    y = content_rect.bottom() - wm_h
-                elif position == "top_center":
-                    x = content_rect.center().x() - wm_w // 2
-                    y = content_rect.top()
-                elif position == "bottom_center":
-                    x = content_rect.center().x() - wm_w // 2
-                    y = content_rect.bottom() - wm_h
-                elif position == "center_left":
-                    x = content_rect.left()
-                    y = content_rect.center().y() - wm_h // 2
-                elif position == "center_right":
-                    x = content_rect.right() - wm_w
-                    y = content_rect.center().y() - wm_h // 2
-                else:
-                    x = content_rect.center().x() - wm_w // 2
-                    y = content_rect.center().y() - wm_h // 2
-                if rotation_angle:
-                    painter.save()
-                    painter.translate(int(x + wm_w / 2), int(y + wm_h / 2))
-                    painter.rotate(rotation_angle)
-                    painter.drawImage(int(-wm_w / 2), int(-wm_h / 2), wm_scaled)
-                    painter.restore()
-                else:
-                    painter.drawImage(int(x), int(y), wm_scaled)
-            painter.end()
-            return img
-
-        text = wm.get("text", "")
-        if not text:
-            return img
-        font_size = int(wm.get("font_size", 32))
-        opacity = float(wm.get("opacity", 0.6))
-        margin = int(wm.get("margin", 20))
-        position = wm.get("position", "bottom_right")
-        color = wm.get("color", QColor(0, 0, 0))
-        if not isinstance(color, QColor):
-            color = QColor(0, 0, 0)
-
-        shadow_enabled = bool(wm.get("shadow_enabled", False))
-        shadow_offset = int(wm.get("shadow_offset", 2))
-        shadow_blur = int(wm.get("shadow_blur", 5))
-        shadow_color = wm.get("shadow_color", QColor(0, 0, 0))
-        if not isinstance(shadow_color, QColor):
-            shadow_color = QColor(0, 0, 0)
-        stroke_enabled = bool(wm.get("stroke_enabled", False))
-        stroke_width = int(wm.get("stroke_width", 2))
-        stroke_color = wm.get("stroke_color", QColor(255, 255, 255))
-        if not isinstance(stroke_color, QColor):
-            stroke_color = QColor(255, 255, 255)
-
-        font_family = wm.get("font_family", "")
-        font_bold = bool(wm.get("font_bold", False))
-        font_italic = bool(wm.get("font_italic", False))
-        if font_family:
-            font = QFont(font_family)
-        else:
-            font = QFontDatabase.systemFont(QFontDatabase.GeneralFont)
-        font.setPointSize(font_size)
-        font.setBold(font_bold)
-        font.setItalic(font_italic)
-
-        text_scene = QGraphicsScene()
-        if stroke_enabled:
-            text_item = StrokedTextItem()
-            text_item.set_stroke(stroke_width, stroke_color)
-        else:
-            text_item = QGraphicsTextItem()
-        text_item.setPlainText(text)
-        text_item.setDefaultTextColor(color)
-        text_item.setFont(font)
-        text_item.setOpacity(opacity)
-        if shadow_enabled:
-            eff = QGraphicsDropShadowEffect()
-            eff.setOffset(shadow_offset, shadow_offset)
-            eff.setBlurRadius(shadow_blur)
-            eff.setColor(shadow_color)
-            text_item.setGraphicsEffect(eff)
-        text_scene.addItem(text_item)
-        text_rect = text_scene.itemsBoundingRect()
-        text_scene.setSceneRect(text_rect)
-        text_img = QImage(int(text_rect.width()), int(text_rect.height()), QImage.Format_ARGB32)
-        text_img.fill(QColor(0, 0, 0, 0))
-        painter_layer = QPainter(text_img)
-        text_item.setPos(text_item.pos() - text_rect.topLeft())
-        text_scene.render(painter_layer)
-        painter_layer.end()
-
-        # 位置计算与绘制
-        painter = QPainter(img)
-        painter.setRenderHint(QPainter.Antialiasing, True)
-        painter.setRenderHint(QPainter.TextAntialiasing, True)
-        text_w = text_img.width()
-        text_h = text_img.height()
-        if position == "custom":
-            if "pos_x_pct" in wm and "pos_y_pct" in wm:
-                cx = float(wm.get("pos_x_pct", 0.0)) * img.width()
-                cy = float(wm.get("pos_y_pct", 0.0)) * img.height()
-            else:
-                cx = float(wm.get("pos_x", margin))
-                cy = float(wm.get("pos_y", margin))
-            min_x = margin
-            min_y = margin
-            max_x = img.width() - margin - text_w
-            max_y = img.height() - margin - text_h
-            x = max(min_x, min(max_x, cx))
-            y = max(min_y, min(max_y, cy))
-            if rotation_angle:
-                painter.save()
-                painter.translate(int(x + text_w / 2), int(y + text_h / 2))
-                painter.rotate(rotation_angle)
-                painter.drawImage(int(-text_w / 2), int(-text_h / 2), text_img)
-                painter.restore()
-            else:
-                painter.drawImage(int(x), int(y), text_img)
-        else:
-            content_rect = img.rect().adjusted(margin, margin, -margin, -margin)
-            if position == "top_left":
-                x = content_rect.left()
-                y = content_rect.top()
-            elif position == "top_right":
-                x = content_rect.right() - text_w
-                y = content_rect.top()
-            elif position == "bottom_left":
-                x = content_rect.left()
-                y = content_rect.bottom() - text_h
-            elif position == "bottom_right":
-                x = content_rect.right() - text_w
-                y = content_rect.bottom() - text_h
-            elif position == "top_center":
-                x = content_rect.center().x() - text_w // 2
-                y = content_rect.top()
-            elif position == "bottom_center":
-                x = content_rect.center().x() - text_w // 2
-                y = content_rect.bottom() - text_h
-            elif position == "center_left":
-                x = content_rect.left()
-                y = content_rect.center().y() - text_h // 2
-            elif position == "center_right":
-                x = content_rect.right() - text_w
-                y = content_rect.center().y() - text_h // 2
-            else:  # center
-                x = content_rect.center().x() - text_w // 2
-                y = content_rect.center().y() - text_h // 2
-            if rotation_angle:
-                painter.save()
-                painter.translate(int(x + text_w / 2), int(y + text_h / 2))
-                painter.rotate(rotation_angle)
-                painter.drawImage(int(-text_w / 2), int(-text_h / 2), text_img)
-                painter.restore()
-            else:
-                painter.drawImage(int(x), int(y), text_img)
-        painter.end()
-        return img
\ No newline at end of file
+        layer = render_stack(wm)
+        if stack_templated(wm):
+            size = QImageReader(path).size()
+            index = self.token_index if path == self._current_path else 1
+            layer = bind_tokens(layer, wm, token_context(path, index, size.width(), size.height()))
+        return stream_watermark(path, out_path, layer, wm, encoder_settings, cache=False)
@@ -0,0 +1,91 @@
+import time
+from typing import Any, Dict, List
+
+from PySide6.QtWidgets import (
+    QFormLayout,
+    QGroupBox,
+    QLabel,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+
+
+_STAGE_LABELS = {"read": "读取", "compose": "合成", "encode": "编码", "write": "写入"}
+_HISTORY_COLUMNS = ("时间", "张数", "张/秒", "读 MB/s", "写 MB/s", "峰值 MB", "耗时", "模板")
+
+
+class TelemetryPanel(QWidget):
+    """批量导出监控：实时吞吐、队列深度、线程利用率、最慢文件与最近导出历史"""
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self.progress = QLabel("—")
+        self.throughput = QLabel("—")
+        self.io_rate = QLabel("—")
+        self.queues = QLabel("—")
+        self.utilization = QLabel("—")
+        self.memory = QLabel("—")
+        self.slowest = QLabel("—")
+        self.slowest.setWordWrap(True)
+
+        live = QGroupBox("当前导出")
+        form = QFormLayout(live)
+        form.addRow("进度", self.progress)
+        form.addRow("速度", self.throughput)
+        form.addRow("读 / 写", self.io_rate)
+        form.addRow("队列", self.queues)
+        form.addRow("利用率", self.utilization)
+        form.addRow("内存", self.memory)
+        form.addRow("最慢文件", self.slowest)
+
+        self.history = QTableWidget(0, len(_HISTORY_COLUMNS))
+        self.history.setHorizontalHeaderLabels(list(_HISTORY_COLUMNS))
+        self.history.verticalHeader().setVisible(False)
+        self.history.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.history.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        history_box = QGroupBox("最近导出")
+        history_layout = QVBoxLayout(history_box)
+        history_layout.addWidget(self.history)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(live)
+        layout.addWidget(history_box, 1)
+
+    def update_live(self, snap: Dict[str, Any]) -> None:
+        """刷新实时统计；snap 来自 BatchExporter.snapshot()"""
+        self.progress.setText(f"{snap.get('done', 0)} / {snap.get('total', 0)}  ·  {snap.get('elapsed_s', 0)} 秒")
+        self.throughput.setText(f"{snap.get('images_per_s', 0)} 张/秒  ·  {snap.get('workers', 0)} 线程")
+        self.io_rate.setText(f"{snap.get('read_mb_s', 0)} / {snap.get('write_mb_s', 0)} MB/s")
+        queues = snap.get("queues", {})
+        self.queues.setText("  ".join(f"{_STAGE_LABELS.get(k, k)} {v}" for k, v in queues.items()))
+        util = snap.get("utilization", {})
+        self.utilization.setText("  ".join(f"{_STAGE_LABELS.get(k, k)} {int(v * 100)}%" for k, v in util.items()))
+        rss = snap.get("peak_rss_mb")
+        text = f"在途 {snap.get('in_flight_mb', 0)} MB · 预算峰值 {snap.get('peak_budget_mb', 0)} MB"
+        if rss is not None:
+            text += f" · 本次常驻峰值 {int(rss)} MB"
+        self.memory.setText(text)
+        slowest = snap.get("slowest", [])
+        self.slowest.setText("\n".join(f"{name}  {sec} 秒" for name, sec in slowest) or "—")
+
+    def set_history(self, records: List[Dict[str, Any]]) -> None:
+        """按时间倒序显示历史记录"""
+        rows = list(reversed(records))
+        self.history.setRowCount(len(rows))
+        for r, rec in enumerate(rows):
+            values = (
+                time.strftime("%m-%d %H:%M", time.localtime(rec.get("ts", 0))),
+                f"{rec.get('ok', 0)}/{rec.get('total', 0)}" + ("（取消）" if rec.get("cancelled") else ""),
+                rec.get("images_per_s", 0),
+                rec.get("read_mb_s", 0),
+                rec.get("write_mb_s", 0),
+                rec.get("peak_rss_mb") if rec.get("peak_rss_mb") is not None else rec.get("peak_budget_mb", 0),
+                f"{rec.get('elapsed_s', 0)} 秒",
+                rec.get("template", ""),
+            )
+            for c, value in enumerate(values):
+                self.history.setItem(r, c, QTableWidgetItem(str(value)))
+        self.history.resizeColumnsToContents()
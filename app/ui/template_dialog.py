@@ -0,0 +1,56 @@
+from PySide6.QtCore import Qt
+from PySide6.QtWidgets import (
+    QDialog,
+    QDialogButtonBox,
+    QLineEdit,
+    QListWidget,
+    QVBoxLayout,
+)
+
+from app.services.templates import TemplateCatalog
+
+
+class TemplatePickerDialog(QDialog):
+    """带搜索框的模板选择对话框，过滤直接走模板索引，不读磁盘"""
+
+    def __init__(self, catalog: TemplateCatalog, title: str = "选择模板", parent=None) -> None:
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.resize(360, 420)
+        self._catalog = catalog
+
+        self.search = QLineEdit()
+        self.search.setPlaceholderText("搜索模板名称或水印文字")
+        self.search.setClearButtonEnabled(True)
+        self.list = QListWidget()
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.search)
+        layout.addWidget(self.list)
+        layout.addWidget(buttons)
+
+        self.search.textChanged.connect(self._refill)
+        self.list.itemDoubleClicked.connect(lambda _: self.accept())
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        self._refill("")
+        self.search.setFocus()
+
+    def _refill(self, text: str) -> None:
+        self.list.clear()
+        self.list.addItems(self._catalog.search(text))
+        if self.list.count():
+            self.list.setCurrentRow(0)
+
+    def selected_name(self) -> str:
+        item = self.list.currentItem()
+        return item.text() if item is not None else ""
+
+    def keyPressEvent(self, event):
+        # 搜索框中按上下键直接移动列表选择
+        if event.key() in (Qt.Key.Key_Up, Qt.Key.Key_Down) and self.list.count():
+            row = self.list.currentRow() + (1 if event.key() == Qt.Key.Key_Down else -1)
+            self.list.setCurrentRow(max(0, min(self.list.count() - 1, row)))
+            return
+        super().keyPressEvent(event)
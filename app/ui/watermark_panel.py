@@ -1,5 +1,8 @@
+import os
+import threading
+
 from PySide6.QtCore import Signal, Qt
-from PySide6.QtGui import QColor, QFont, QFontDatabase
+from PySide6.QtGui import QColor, QFont
 from PySide6.QtWidgets import (
     QWidget,
     QFormLayout,
@@ -15,8 +18,13 @@ from PySide6.QtWidgets import (
     QVBoxLayout,
     QFileDialog,
     QLabel,
+    QListWidget,
 )
 
+from app.services.fonts import enumerate_families, load_family_snapshot
+from app.services.spec import WatermarkSpec
+from app.services.tokens import TOKENS
+
 
 class _NoWheelMixin:
     """Mixin to disable wheel events on controls to prevent accidental changes."""
@@ -34,6 +42,78 @@ class NoWheelComboBox(_NoWheelMixin, QComboBox):
     pass
 
 
+class FontFamilyComboBox(NoWheelComboBox):
+    """字体下拉框：启动时用上次的字体族快照填充，系统字体只在后台线程枚举
+
+    load_in_background() 在后台线程枚举，结果经排队信号回到界面线程刷新列表；
+    界面线程从不同步枚举，结果到达前展开的下拉列表显示快照。
+    """
+
+    familiesLoaded = Signal(list)
+
+    def __init__(self, parent=None) -> None:
+        super().__init__(parent)
+        self._enumerated = False
+        self._loading = False
+        self.familiesLoaded.connect(self._apply_families)
+        families = load_family_snapshot()
+        if families:
+            self.addItems(families)
+        self.select_family(QFont().family())
+
+    def select_family(self, family: str) -> None:
+        # 快照中没有的字体（如模板中的字体）先追加到列表，保证可选中
+        if not family:
+            return
+        index = self.findText(family)
+        if index < 0:
+            self.addItem(family)
+            index = self.count() - 1
+        self.setCurrentIndex(index)
+
+    def load_in_background(self) -> None:
+        if self._enumerated or self._loading:
+            return
+        self._loading = True
+        threading.Thread(target=self._enumerate, name="font-families", daemon=True).start()
+
+    def _enumerate(self) -> None:
+        families = enumerate_families()
+        try:
+            self.familiesLoaded.emit(families)
+        except RuntimeError:
+            # 窗口已关闭，控件已销毁
+            pass
+
+    def _apply_families(self, families: list) -> None:
+        self._loading = False
+        self._enumerated = True
+        current = self.currentText()
+        existing = [self.itemText(i) for i in range(self.count())]
+        if families == existing:
+            return
+        self.blockSignals(True)
+        self.clear()
+        self.addItems(families)
+        self.blockSignals(False)
+        self.select_family(current)
+
+    def showPopup(self) -> None:
+        # 启动时通常已开始枚举；此处只是兜底，不会阻塞界面
+        self.load_in_background()
+        super().showPopup()
+
+
+# 阴影与描边区在首次展开（或设置中启用）前不创建控件，取值使用以下默认值
+_EFFECT_DEFAULTS = {
+    "shadow_enabled": False,
+    "shadow_offset": 2,
+    "shadow_blur": 2,
+    "stroke_enabled": False,
+    "stroke_width": 2,
+}
+
+
 class WatermarkPanel(QWidget):
     settingsChanged = Signal(dict)
 
@@ -46,23 +126,26 @@ class WatermarkPanel(QWidget):
         self.wm_type.setCurrentIndex(0)
 
         self.text = QLineEdit()
-        self.text.setPlaceholderText("输入水印文字")
+        self.text.setPlaceholderText("输入水印文字，可用 {filename} {date:%Y} {index} 等令牌")
+        self.text.setToolTip("逐图展开的令牌：\n" + "\n".join(f"{{{name}}}  {desc}" for name, desc in TOKENS.items()))
 
         self.position = NoWheelComboBox()
         # 九宫格位置：四角、中心、边缘中点（左居中/右居中/上居中/下居中）
-        self.position.addItems(["左上", "右上", "左下", "右下", "居中", "上居中", "下居中", "左居中", "右居中"])
+        self.position.addItems(["左上", "右上", "左下", "右下", "居中", "上居中", "下居中", "左居中", "右居中", "平铺"])
         self.position.setCurrentIndex(3)  # 默认右下
 
-        # 字体选择
-        self.font_family = NoWheelComboBox()
-        # 加载系统所有字体
-        font_families = QFontDatabase.families()
-        self.font_family.addItems(font_families)
-        # 设置默认字体为系统默认
-        default_font = QFont().family()
-        default_index = self.font_family.findText(default_font)
-        if default_index >= 0:
-            self.font_family.setCurrentIndex(default_index)
+        # 平铺模式：间距、交错、整体角度
+        self.tile_spacing = NoWheelSpinBox()
+        self.tile_spacing.setRange(0, 2000)
+        self.tile_spacing.setValue(80)
+        self.tile_stagger = QCheckBox("交错排列")
+        self.tile_stagger.setChecked(True)
+        self.tile_angle = NoWheelSpinBox()
+        self.tile_angle.setRange(-180, 180)
+        self.tile_angle.setValue(-30)
+
+        # 字体选择：系统字体很多时枚举耗时数秒，启动时只用快照，默认选中系统默认字体
+        self.font_family = FontFamilyComboBox()
 
         self.font_size = NoWheelSpinBox()
         self.font_size.setRange(8, 200)
@@ -77,18 +160,133 @@ class WatermarkPanel(QWidget):
         font_style_widget = QWidget()
         font_style_widget.setLayout(font_style_layout)
 
-        # 文本样式：阴影和描边
+        # 文本样式：阴影和描边（较少使用，首次展开时再创建控件）
+        self._shadow_color = QColor(0, 0, 0)  # 默认黑色
+        self._stroke_color = QColor(255, 255, 255)  # 默认白色
+        self._effects_built = False
+        self._effect_values = dict(_EFFECT_DEFAULTS)
+        self.effects_btn = QPushButton("展开阴影与描边设置")
+        text_style_layout = QVBoxLayout()
+        text_style_layout.setContentsMargins(0, 0, 0, 0)
+        text_style_layout.addWidget(self.effects_btn)
+        text_style_widget = QWidget()
+        text_style_widget.setLayout(text_style_layout)
+        self._effects_layout = text_style_layout
+
+        self.opacity = NoWheelSlider(Qt.Orientation.Horizontal)
+        self.opacity.setRange(0, 100)
+        self.opacity.setValue(60)
+
+        self.margin = NoWheelSpinBox()
+        self.margin.setRange(0, 200)
+        self.margin.setValue(20)
+
+        # 旋转角度（度）
+        self.rotation_angle = NoWheelSpinBox()
+        self.rotation_angle.setRange(0, 360)
+        self.rotation_angle.setValue(0)
+
+        # 颜色选择器（默认黑色）
+        self._color = QColor(0, 0, 0)
+        self.color_btn = QPushButton("选择颜色")
+        self._update_color_btn()
+
+        # 图片水印控件在首次切换到图片水印时创建
+        self._image_built = False
+        self._image_values: dict = {}
+
+        # 图层：第 0 层为底层，其余按顺序叠加在其上；控件编辑当前选中的图层，
+        # 其余图层的设置暂存在 _layers 中（选中层的条目以控件为准）
+        self._layers: list = [{}]
+        self._layer_index = 0
+        self._suspend_emit = False
+        self.layer_list = QListWidget()
+        self.layer_list.setMaximumHeight(84)
+        self.layer_add_btn = QPushButton("添加")
+        self.layer_del_btn = QPushButton("删除")
+        self.layer_up_btn = QPushButton("上移")
+        self.layer_down_btn = QPushButton("下移")
+        layer_btn_layout = QHBoxLayout()
+        layer_btn_layout.setContentsMargins(0, 0, 0, 0)
+        for btn in (self.layer_add_btn, self.layer_del_btn, self.layer_up_btn, self.layer_down_btn):
+            layer_btn_layout.addWidget(btn)
+        layers_layout = QVBoxLayout()
+        layers_layout.setContentsMargins(0, 0, 0, 0)
+        layers_layout.addWidget(self.layer_list)
+        layers_layout.addLayout(layer_btn_layout)
+        layers_widget = QWidget()
+        layers_widget.setLayout(layers_layout)
+
+        # 总体布局
+        layout = QFormLayout(self)
+        layout.addRow("图层", layers_widget)
+        layout.addRow("水印类型", self.wm_type)
+        layout.addRow("文本", self.text)
+        layout.addRow("位置", self.position)
+        layout.addRow("平铺间距", self.tile_spacing)
+        layout.addRow("平铺交错", self.tile_stagger)
+        layout.addRow("平铺角度", self.tile_angle)
+        layout.addRow("字体", self.font_family)
+        layout.addRow("字号", self.font_size)
+        layout.addRow("样式", font_style_widget)
+        layout.addRow("透明度", self.opacity)
+        layout.addRow("颜色", self.color_btn)
+        layout.addRow("边距", self.margin)
+        layout.addRow("旋转角度", self.rotation_angle)
+        layout.addRow("文本效果", text_style_widget)
+        self._form = layout
+
+        # 信号连接
+        self.wm_type.currentIndexChanged.connect(self._emit)
+        self.text.textChanged.connect(self._emit)
+        self.position.currentIndexChanged.connect(self._emit)
+        self.tile_spacing.valueChanged.connect(self._emit)
+        self.tile_stagger.stateChanged.connect(self._emit)
+        self.tile_angle.valueChanged.connect(self._emit)
+        self.font_family.currentIndexChanged.connect(self._emit)
+        self.font_size.valueChanged.connect(self._emit)
+        self.font_bold.stateChanged.connect(self._emit)
+        self.font_italic.stateChanged.connect(self._emit)
+        self.opacity.valueChanged.connect(self._emit)
+        self.margin.valueChanged.connect(self._emit)
+        self.rotation_angle.valueChanged.connect(self._emit)
+        self.color_btn.clicked.connect(self._choose_color)
+        
+        self.effects_btn.clicked.connect(self._ensure_effects)
+        self.layer_list.currentRowChanged.connect(self._select_layer)
+        self.layer_add_btn.clicked.connect(self._add_layer)
+        self.layer_del_btn.clicked.connect(self._remove_layer)
+        self.layer_up_btn.clicked.connect(lambda: self._move_layer(1))
+        self.layer_down_btn.clicked.connect(lambda: self._move_layer(-1))
+        self._refresh_layer_list()
+
+        # 初始化 UI 可见性；切换到图片水印时先创建图片控件
+        self._update_visibility()
+        self.wm_type.currentIndexChanged.connect(self._on_type_changed)
+        self.position.currentIndexChanged.connect(self._update_visibility)
+
+    def _on_type_changed(self, index: int) -> None:
+        if index == 1:
+            self._ensure_image_section()
+        self._update_visibility()
+
+    def _ensure_effects(self) -> None:
+        """创建阴影与描边控件，并把暂存的取值写入控件"""
+        if self._effects_built:
+            return
+        self._effects_built = True
+        values = self._effect_values
         # 阴影设置
         self.shadow_enabled = QCheckBox("启用阴影")
+        self.shadow_enabled.setChecked(values["shadow_enabled"])
         self.shadow_offset = NoWheelSpinBox()
         self.shadow_offset.setRange(1, 10)
-        self.shadow_offset.setValue(2)
+        self.shadow_offset.setValue(values["shadow_offset"])
         self.shadow_blur = NoWheelSpinBox()
         self.shadow_blur.setRange(0, 10)
-        self.shadow_blur.setValue(2)
+        self.shadow_blur.setValue(values["shadow_blur"])
         
         # 阴影颜色
-        self._shadow_color = QColor(0, 0, 0)  # 默认黑色
         self.shadow_color_btn = QPushButton("阴影颜色")
         self._update_shadow_color_btn()
         
@@ -103,12 +301,12 @@ class WatermarkPanel(QWidget):
         
         # 描边设置
         self.stroke_enabled = QCheckBox("启用描边")
+        self.stroke_enabled.setChecked(values["stroke_enabled"])
         self.stroke_width = NoWheelSpinBox()
         self.stroke_width.setRange(1, 10)
-        self.stroke_width.setValue(2)
+        self.stroke_width.setValue(values["stroke_width"])
         
         # 描边颜色
-        self._stroke_color = QColor(255, 255, 255)  # 默认白色
         self.stroke_color_btn = QPushButton("描边颜色")
         self._update_stroke_color_btn()
         
@@ -119,34 +317,27 @@ class WatermarkPanel(QWidget):
         
         stroke_group = QGroupBox("描边效果")
         stroke_group.setLayout(stroke_layout)
-        
-        # 文本样式布局
-        text_style_layout = QVBoxLayout()
-        text_style_layout.addWidget(shadow_group)
-        text_style_layout.addWidget(stroke_group)
-        
-        text_style_widget = QWidget()
-        text_style_widget.setLayout(text_style_layout)
 
-        self.opacity = NoWheelSlider(Qt.Orientation.Horizontal)
-        self.opacity.setRange(0, 100)
-        self.opacity.setValue(60)
-
-        self.margin = NoWheelSpinBox()
-        self.margin.setRange(0, 200)
-        self.margin.setValue(20)
-
-        # 旋转角度（度）
-        self.rotation_angle = NoWheelSpinBox()
-        self.rotation_angle.setRange(0, 360)
-        self.rotation_angle.setValue(0)
+        self.effects_btn.hide()
+        self._effects_layout.addWidget(shadow_group)
+        self._effects_layout.addWidget(stroke_group)
 
-        # 颜色选择器（默认黑色）
-        self._color = QColor(0, 0, 0)
-        self.color_btn = QPushButton("选择颜色")
-        self._update_color_btn()
+        # 阴影和描边信号连接
+        self.shadow_enabled.stateChanged.connect(self._emit)
+        self.shadow_offset.valueChanged.connect(self._emit)
+        self.shadow_blur.valueChanged.connect(self._emit)
+        self.shadow_color_btn.clicked.connect(self._choose_shadow_color)
+        
+        self.stroke_enabled.stateChanged.connect(self._emit)
+        self.stroke_width.valueChanged.connect(self._emit)
+        self.stroke_color_btn.clicked.connect(self._choose_stroke_color)
+        self._update_visibility()
 
-        # 图片水印控件
+    def _ensure_image_section(self) -> None:
+        """创建图片水印控件，并应用此前暂存的图片设置"""
+        if self._image_built:
+            return
+        self._image_built = True
         self.image_path_label = QLabel("未选择图片")
         self.image_path_label.setWordWrap(False)
         self.image_path_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
@@ -164,19 +355,7 @@ class WatermarkPanel(QWidget):
         self.img_width.setRange(1, 10000)
         self.img_height.setRange(1, 10000)
 
-        # 总体布局
-        layout = QFormLayout(self)
-        layout.addRow("水印类型", self.wm_type)
-        layout.addRow("文本", self.text)
-        layout.addRow("位置", self.position)
-        layout.addRow("字体", self.font_family)
-        layout.addRow("字号", self.font_size)
-        layout.addRow("样式", font_style_widget)
-        layout.addRow("透明度", self.opacity)
-        layout.addRow("颜色", self.color_btn)
-        layout.addRow("边距", self.margin)
-        layout.addRow("旋转角度", self.rotation_angle)
-        layout.addRow("文本效果", text_style_widget)
+        layout = self._form
         layout.addRow("图片路径", self.image_path_label)
         layout.addRow("选择图片", self.choose_image_btn)
         layout.addRow("图片透明度", self.img_opacity)
@@ -185,41 +364,21 @@ class WatermarkPanel(QWidget):
         layout.addRow("自由宽度", self.img_width)
         layout.addRow("自由高度", self.img_height)
 
-        # 信号连接
-        self.wm_type.currentIndexChanged.connect(self._emit)
-        self.text.textChanged.connect(self._emit)
-        self.position.currentIndexChanged.connect(self._emit)
-        self.font_family.currentIndexChanged.connect(self._emit)
-        self.font_size.valueChanged.connect(self._emit)
-        self.font_bold.stateChanged.connect(self._emit)
-        self.font_italic.stateChanged.connect(self._emit)
-        self.opacity.valueChanged.connect(self._emit)
-        self.margin.valueChanged.connect(self._emit)
-        self.rotation_angle.valueChanged.connect(self._emit)
-        self.color_btn.clicked.connect(self._choose_color)
-        
-        # 阴影和描边信号连接
-        self.shadow_enabled.stateChanged.connect(self._emit)
-        self.shadow_offset.valueChanged.connect(self._emit)
-        self.shadow_blur.valueChanged.connect(self._emit)
-        self.shadow_color_btn.clicked.connect(self._choose_shadow_color)
-        
-        self.stroke_enabled.stateChanged.connect(self._emit)
-        self.stroke_width.valueChanged.connect(self._emit)
-        self.stroke_color_btn.clicked.connect(self._choose_stroke_color)
+        pending = self._image_values
+        self._image_values = {}
+        self._apply_image_settings(pending)
+        if getattr(self, "_image_path", ""):
+            self._update_path_label(self._image_path)
 
         # 图片控件信号
         self.choose_image_btn.clicked.connect(self._choose_image)
         self.img_opacity.valueChanged.connect(self._emit)
         self.img_scale_mode.currentIndexChanged.connect(self._emit)
+        self.img_scale_mode.currentIndexChanged.connect(self._update_visibility)
         self.img_scale_pct.valueChanged.connect(self._emit)
         self.img_width.valueChanged.connect(self._emit)
         self.img_height.valueChanged.connect(self._emit)
 
-        # 初始化 UI 可见性
-        self._update_visibility()
-        self.wm_type.currentIndexChanged.connect(self._update_visibility)
-
     def _update_visibility(self):
         is_text = (self.wm_type.currentIndex() == 0)
         # 文本相关可见性
@@ -232,16 +391,25 @@ class WatermarkPanel(QWidget):
         self.color_btn.setVisible(is_text)
         self.margin.setVisible(True)  # 两种类型均使用边距和位置
         self.position.setVisible(True)
-        # 旋转角度对两种类型都可见
-        self.rotation_angle.setVisible(True)
+        # 旋转角度对两种类型都可见；平铺模式改用平铺角度
+        is_tile = (self.position.currentIndex() == 9)
+        self.rotation_angle.setVisible(not is_tile)
+        self.tile_spacing.setVisible(is_tile)
+        self.tile_stagger.setVisible(is_tile)
+        self.tile_angle.setVisible(is_tile)
         # 文本效果
-        self.shadow_enabled.setVisible(is_text)
-        self.shadow_offset.setVisible(is_text)
-        self.shadow_blur.setVisible(is_text)
-        self.shadow_color_btn.setVisible(is_text)
-        self.stroke_enabled.setVisible(is_text)
-        self.stroke_width.setVisible(is_text)
-        self.stroke_color_btn.setVisible(is_text)
+        if self._effects_built:
+            self.shadow_enabled.setVisible(is_text)
+            self.shadow_offset.setVisible(is_text)
+            self.shadow_blur.setVisible(is_text)
+            self.shadow_color_btn.setVisible(is_text)
+            self.stroke_enabled.setVisible(is_text)
+            self.stroke_width.setVisible(is_text)
+            self.stroke_color_btn.setVisible(is_text)
+        else:
+            self.effects_btn.setVisible(is_text)
+        if not self._image_built:
+            return
         # 图片控件可见性
         self.image_path_label.setVisible(not is_text)
         self.choose_image_btn.setVisible(not is_text)
@@ -252,9 +420,97 @@ class WatermarkPanel(QWidget):
         self.img_height.setVisible(not is_text and self.img_scale_mode.currentIndex() == 1)
 
     def _emit(self, *args) -> None:
+        if self._suspend_emit:
+            return
+        self._update_layer_label(self._layer_index)
         self.settingsChanged.emit(self.get_settings())
 
+    # 图层列表
+
+    def _layer_label(self, index: int, settings: dict) -> str:
+        if settings.get("wm_type") == "image":
+            name = os.path.basename(settings.get("image_path", "")) or "未选择"
+            desc = f"图片：{name}"
+        else:
+            desc = f"文本：{settings.get('text', '') or '（空）'}"
+        return f"{index + 1}. {desc}" + ("（底层）" if index == 0 else "")
+
+    def _update_layer_label(self, index: int) -> None:
+        item = self.layer_list.item(len(self._layers) - 1 - index)
+        if item is not None:
+            item.setText(self._layer_label(index, self._control_settings()))
+
+    def _refresh_layer_list(self) -> None:
+        """列表自上而下为从顶层到底层，与绘制时的上下关系一致"""
+        self.layer_list.blockSignals(True)
+        self.layer_list.clear()
+        current = self._control_settings()
+        for i in reversed(range(len(self._layers))):
+            settings = current if i == self._layer_index else self._layers[i]
+            self.layer_list.addItem(self._layer_label(i, settings))
+        self.layer_list.setCurrentRow(len(self._layers) - 1 - self._layer_index)
+        self.layer_list.blockSignals(False)
+        self.layer_del_btn.setEnabled(len(self._layers) > 1)
+        self.layer_up_btn.setEnabled(self._layer_index < len(self._layers) - 1)
+        self.layer_down_btn.setEnabled(self._layer_index > 0)
+
+    def _show_layer(self, index: int) -> None:
+        """把第 index 层载入控件（不发出中间状态）"""
+        self._layer_index = index
+        self._suspend_emit = True
+        try:
+            self._apply_controls(self._layers[index])
+        finally:
+            self._suspend_emit = False
+        self._refresh_layer_list()
+
+    def _select_layer(self, row: int) -> None:
+        index = len(self._layers) - 1 - row
+        if row < 0 or index == self._layer_index:
+            return
+        self._layers[self._layer_index] = self._control_settings()
+        self._show_layer(index)
+
+    def _add_layer(self) -> None:
+        """在当前图层之上添加一层，沿用当前图层的样式（文本清空）"""
+        current = self._control_settings()
+        self._layers[self._layer_index] = current
+        layer = dict(current)
+        if layer.get("wm_type", "text") == "text":
+            layer["text"] = ""
+        self._layers.insert(self._layer_index + 1, layer)
+        self._show_layer(self._layer_index + 1)
+        self.text.setFocus()
+        self._emit()
+
+    def _remove_layer(self) -> None:
+        if len(self._layers) <= 1:
+            return
+        del self._layers[self._layer_index]
+        self._show_layer(max(0, self._layer_index - 1))
+        self._emit()
+
+    def _move_layer(self, step: int) -> None:
+        """step 为 1 时上移一层（绘制在更上面），-1 时下移"""
+        target = self._layer_index + step
+        if not 0 <= target < len(self._layers):
+            return
+        self._layers[self._layer_index] = self._control_settings()
+        self._layers[self._layer_index], self._layers[target] = self._layers[target], self._layers[self._layer_index]
+        self._layer_index = target
+        self._refresh_layer_list()
+        self._emit()
+
     def get_settings(self) -> dict:
+        """底层设置，附加图层按绘制顺序放在 layers 中"""
+        layers = list(self._layers)
+        layers[self._layer_index] = self._control_settings()
+        settings = dict(layers[0])
+        settings["layers"] = [dict(layer) for layer in layers[1:]]
+        return settings
+
+    def _control_settings(self) -> dict:
+        """控件当前值（即选中图层的设置）"""
         pos_map = {
             0: "top_left",
             1: "top_right",
@@ -265,6 +521,7 @@ class WatermarkPanel(QWidget):
             6: "bottom_center",
             7: "center_left",
             8: "center_right",
+            9: "tile",
         }
         wm_type = "text" if self.wm_type.currentIndex() == 0 else "image"
         settings = {
@@ -280,17 +537,27 @@ class WatermarkPanel(QWidget):
             "color": self._color,
             "margin": int(self.margin.value()),
             "rotation_angle": int(self.rotation_angle.value()),
-            # 阴影设置
-            "shadow_enabled": self.shadow_enabled.isChecked(),
-            "shadow_offset": self.shadow_offset.value(),
-            "shadow_blur": self.shadow_blur.value(),
+            # 平铺设置
+            "tile_spacing": int(self.tile_spacing.value()),
+            "tile_stagger": self.tile_stagger.isChecked(),
+            "tile_angle": int(self.tile_angle.value()),
             "shadow_color": self._shadow_color,
-            # 描边设置
-            "stroke_enabled": self.stroke_enabled.isChecked(),
-            "stroke_width": self.stroke_width.value(),
             "stroke_color": self._stroke_color,
         }
+        if self._effects_built:
+            settings.update({
+                # 阴影设置
+                "shadow_enabled": self.shadow_enabled.isChecked(),
+                "shadow_offset": self.shadow_offset.value(),
+                "shadow_blur": self.shadow_blur.value(),
+                # 描边设置
+                "stroke_enabled": self.stroke_enabled.isChecked(),
+                "stroke_width": self.stroke_width.value(),
+            })
+        else:
+            settings.update(self._effect_values)
         if wm_type == "image":
+            self._ensure_image_section()
             scale_mode = "proportional" if self.img_scale_mode.currentIndex() == 0 else "free"
             settings.update({
                 "image_path": getattr(self, "_image_path", ""),
@@ -302,7 +569,26 @@ class WatermarkPanel(QWidget):
             })
         return settings
 
+    def get_spec(self) -> WatermarkSpec:
+        """当前设置的不可变规格，供导出与缓存使用"""
+        return WatermarkSpec.from_settings(self.get_settings())
+
     def apply_settings(self, settings: dict) -> None:
+        """应用整组设置：底层载入控件，layers 替换附加图层（缺省时只保留底层）"""
+        layers = settings.get("layers") or []
+        self._layers = [{}] + [WatermarkSpec.from_settings(layer).replace(layers=None).to_settings()
+                               for layer in layers if isinstance(layer, (dict, WatermarkSpec))]
+        self._layer_index = 0
+        self._suspend_emit = True
+        try:
+            self._apply_controls(settings)
+        finally:
+            self._suspend_emit = False
+        self._refresh_layer_list()
+        # 应用完毕后发出一次更新
+        self._emit()
+
+    def _apply_controls(self, settings: dict) -> None:
         # 类型切换
         wm_type = settings.get("wm_type")
         if isinstance(wm_type, str):
@@ -318,9 +604,7 @@ class WatermarkPanel(QWidget):
         # 字体设置
         font_family = settings.get("font_family")
         if isinstance(font_family, str):
-            index = self.font_family.findText(font_family)
-            if index >= 0:
-                self.font_family.setCurrentIndex(index)
+            self.font_family.select_family(font_family)
         
         fs = settings.get("font_size")
         if isinstance(fs, int):
@@ -357,47 +641,70 @@ class WatermarkPanel(QWidget):
                 "bottom_center": 6,
                 "center_left": 7,
                 "center_right": 8,
+                "tile": 9,
             }
             if pos in index_map:
                 self.position.setCurrentIndex(index_map[pos])
+        tile_spacing = settings.get("tile_spacing")
+        if isinstance(tile_spacing, int):
+            self.tile_spacing.setValue(tile_spacing)
+        tile_stagger = settings.get("tile_stagger")
+        if isinstance(tile_stagger, bool):
+            self.tile_stagger.setChecked(tile_stagger)
+        tile_angle = settings.get("tile_angle")
+        if isinstance(tile_angle, int):
+            self.tile_angle.setValue(max(-180, min(180, tile_angle)))
         # 新增：旋转角度设置
         rotation_angle = settings.get("rotation_angle")
         if isinstance(rotation_angle, int):
             self.rotation_angle.setValue(max(0, min(360, rotation_angle)))
         
-        # 阴影设置
-        shadow_enabled = settings.get("shadow_enabled")
-        if isinstance(shadow_enabled, bool):
-            self.shadow_enabled.setChecked(shadow_enabled)
-        
-        shadow_offset = settings.get("shadow_offset")
-        if isinstance(shadow_offset, int):
-            self.shadow_offset.setValue(shadow_offset)
-        
-        shadow_blur = settings.get("shadow_blur")
-        if isinstance(shadow_blur, int):
-            self.shadow_blur.setValue(shadow_blur)
-        
+        self._apply_effect_settings(settings)
+        # 图片设置：控件尚未创建时暂存，创建时再应用
+        if self._image_built:
+            self._apply_image_settings(settings)
+        else:
+            self._image_values.update(settings)
+            image_path = settings.get("image_path")
+            if isinstance(image_path, str):
+                setattr(self, "_image_path", image_path)
+
+        # 更新可见性（依赖缩放模式）
+        self._update_visibility()
+
+    def _apply_effect_settings(self, settings: dict) -> None:
+        # 设置中启用了阴影或描边时创建控件，便于用户看到并调整
+        if settings.get("shadow_enabled") is True or settings.get("stroke_enabled") is True:
+            self._ensure_effects()
+        ranges = {"shadow_offset": (1, 10), "shadow_blur": (0, 10), "stroke_width": (1, 10)}
+        for key in _EFFECT_DEFAULTS:
+            value = settings.get(key)
+            expected = bool if key.endswith("_enabled") else int
+            if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+                continue
+            if key in ranges:
+                lo, hi = ranges[key]
+                value = max(lo, min(hi, value))
+            if self._effects_built:
+                widget = getattr(self, key)
+                if expected is bool:
+                    widget.setChecked(value)
+                else:
+                    widget.setValue(value)
+            else:
+                self._effect_values[key] = value
+
         shadow_color = settings.get("shadow_color")
         if isinstance(shadow_color, QColor):
             self._shadow_color = shadow_color
             self._update_shadow_color_btn()
-            
-        # 描边设置
-        stroke_enabled = settings.get("stroke_enabled")
-        if isinstance(stroke_enabled, bool):
-            self.stroke_enabled.setChecked(stroke_enabled)
-            
-        stroke_width = settings.get("stroke_width")
-        if isinstance(stroke_width, int):
-            self.stroke_width.setValue(stroke_width)
-            
+
         stroke_color = settings.get("stroke_color")
         if isinstance(stroke_color, QColor):
             self._stroke_color = stroke_color
             self._update_stroke_color_btn()
 
-        # 图片设置
+    def _apply_image_settings(self, settings: dict) -> None:
         image_path = settings.get("image_path")
         if isinstance(image_path, str):
             setattr(self, "_image_path", image_path)
@@ -423,10 +730,6 @@ class WatermarkPanel(QWidget):
         if isinstance(img_height, int):
             self.img_height.setValue(img_height)
 
-        # 更新可见性（依赖缩放模式）
-        self._update_visibility()
-        # 应用完毕后发出一次更新
-        self._emit()
 
     def _choose_color(self) -> None:
         color = QColorDialog.getColor(self._color, self, "选择水印颜色")
@@ -442,12 +745,16 @@ class WatermarkPanel(QWidget):
         )
 
     def _update_shadow_color_btn(self) -> None:
+        if not self._effects_built:
+            return
         # 在按钮上显示当前颜色块
         self.shadow_color_btn.setStyleSheet(
             f"background-color: {self._shadow_color.name()}; color: white;"
         )
         
     def _update_stroke_color_btn(self) -> None:
+        if not self._effects_built:
+            return
         # 在按钮上显示当前颜色块
         self.stroke_color_btn.setStyleSheet(
             f"background-color: {self._stroke_color.name()}; color: black;"
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+基准脚本：比较各编码预设/参数的编码耗时与输出体积（速度-体积曲线）
+
+用法：
+    python scripts/bench_encoders.py [图片路径 ...] [--repeat N]
+未提供图片时生成一张 4000x3000 的合成测试图。
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from PySide6.QtGui import QImage, QColor, QPainter, QLinearGradient
+from PySide6.QtWidgets import QApplication
+
+from app.services.encoders import ENCODER_PRESETS, DEFAULT_ENCODER_SETTINGS, encode_qimage
+
+
+def create_test_image(width=4000, height=3000):
+    """生成带渐变与细节的合成图，避免纯色图让压缩结果失真"""
+    img = QImage(width, height, QImage.Format_ARGB32)
+    painter = QPainter(img)
+    grad = QLinearGradient(0, 0, width, height)
+    grad.setColorAt(0.0, QColor(30, 60, 120))
+    grad.setColorAt(0.5, QColor(200, 180, 90))
+    grad.setColorAt(1.0, QColor(20, 120, 60))
+    painter.fillRect(img.rect(), grad)
+    painter.setPen(QColor(255, 255, 255, 90))
+    for i in range(0, width, 7):
+        painter.drawLine(i, 0, width - i, height)
+    painter.end()
+    return img
+
+
+def bench_case(img, fmt, settings, repeat):
+    best = None
+    size = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        data = encode_qimage(img, fmt, settings)
+        elapsed = time.perf_counter() - t0
+        if data is None:
+            return None
+        size = len(data)
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+def build_cases():
+    cases = []
+    # 各格式 × 编码预设
+    for fmt in ("PNG", "JPEG", "WEBP"):
+        for name, preset in ENCODER_PRESETS.items():
+            settings = dict(DEFAULT_ENCODER_SETTINGS)
+            settings.update(preset)
+            cases.append((fmt, name, settings))
+    # PNG 压缩级别曲线
+    for level in range(0, 10):
+        settings = dict(DEFAULT_ENCODER_SETTINGS)
+        settings["png_compress_level"] = level
+        cases.append(("PNG", f"level={level}", settings))
+    # WebP 有损/无损
+    for lossless in (False, True):
+        settings = dict(DEFAULT_ENCODER_SETTINGS)
+        settings["webp_lossless"] = lossless
+        cases.append(("WEBP", "lossless" if lossless else "lossy", settings))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="编码参数速度/体积基准")
+    parser.add_argument("images", nargs="*", help="测试图片路径")
+    parser.add_argument("--repeat", type=int, default=3, help="每组参数重复次数（取最快）")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    sources = []
+    for p in args.images:
+        img = QImage(p)
+        if img.isNull():
+            print(f"跳过无法加载的图片：{p}")
+            continue
+        sources.append((Path(p).name, img.convertToFormat(QImage.Format_ARGB32)))
+    if not sources:
+        sources.append(("synthetic 4000x3000", create_test_image()))
+
+    for label, img in sources:
+        mpix = img.width() * img.height() / 1e6
+        print(f"\n=== {label} ({img.width()}x{img.height()}, {mpix:.1f} MP) ===")
+        print(f"{'格式':6} {'参数':12} {'耗时(ms)':>10} {'体积(KB)':>10} {'MP/s':>8}")
+        for fmt, name, settings in build_cases():
+            result = bench_case(img, fmt, settings, max(1, args.repeat))
+            if result is None:
+                print(f"{fmt:6} {name:12} {'失败':>10}")
+                continue
+            elapsed, size = result
+            print(f"{fmt:6} {name:12} {elapsed * 1000:10.1f} {size / 1024:10.1f} {mpix / elapsed:8.1f}")
+
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,11 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from PySide6.QtWidgets import QApplication
 from PySide6.QtGui import QImage, QColor, QPainter, QFont
 from PySide6.QtCore import QRectF
+import numpy as np
 
 from app.ui.preview_view import PreviewView
 from app.ui.main_window import MainWindow
+from app.services.qimage_numpy import ARGB32_CHANNELS, qimage_view
 
 
 def create_test_image(width=800, height=600, color=(255, 255, 255)):
@@ -117,19 +119,23 @@ def test_position_consistency():
 
 def detect_watermark_position(qimage, target_color):
     """检测 QImage 中指定颜色的像素位置（简化的水印检测）"""
-    width = qimage.width()
-    height = qimage.height()
-    
-    # 扫描图像寻找目标颜色
-    for y in range(height):
-        for x in range(width):
-            pixel_color = QColor(qimage.pixel(x, y))
-            if (abs(pixel_color.red() - target_color.red()) < 10 and
-                abs(pixel_color.green() - target_color.green()) < 10 and
-                abs(pixel_color.blue() - target_color.blue()) < 10):
-                return (x, y)  # 返回第一个匹配像素的位置
-    
-    return None
+    # 直接以数组访问像素缓冲，避免逐像素调用 pixel()
+    img = qimage.convertToFormat(QImage.Format_ARGB32)
+    pixels = qimage_view(img).astype(np.int16)
+    r = pixels[:, :, ARGB32_CHANNELS["r"]]
+    g = pixels[:, :, ARGB32_CHANNELS["g"]]
+    b = pixels[:, :, ARGB32_CHANNELS["b"]]
+    mask = (
+        (np.abs(r - target_color.red()) < 10)
+        & (np.abs(g - target_color.green()) < 10)
+        & (np.abs(b - target_color.blue()) < 10)
+    )
+    hits = np.argwhere(mask)
+    if hits.size == 0:
+        return None
+    # 按行优先顺序的第一个匹配像素
+    y, x = hits[0]
+    return (int(x), int(y))
 
 
 if __name__ == "__main__":